@@ -40,8 +40,10 @@ Flujo de trabajo:
     },
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/password_assigner_config_views.xml',
         'views/password_assigner_template_views.xml',
+        'views/password_assigner_issuer_profile_views.xml',
         'views/password_assigner_wizard_views.xml',
         'views/account_move_views.xml',
         'views/menus.xml',
@@ -50,6 +52,8 @@ Flujo de trabajo:
         'web.assets_backend': [
             '/adroc_password_assigner/static/src/js/password_assigner_button.js',
             '/adroc_password_assigner/static/src/xml/password_assigner_button.xml',
+            '/adroc_password_assigner/static/src/js/password_assigner_job_poller.js',
+            '/adroc_password_assigner/static/src/xml/password_assigner_job_poller.xml',
         ],
     },
     'installable': True,
@@ -1,3 +1,11 @@
 # -*- coding: utf-8 -*-
 from . import password_assigner_config
 from . import password_assigner_template
+from . import password_assigner_issuer_profile
+from . import account_move
+from . import account_move_line
+from . import password_assigner_line_token
+from . import password_assigner_job
+from . import password_assigner_extraction_cache
+from . import password_assigner_extraction_cache_stat
+from . import password_assigner_rate_limit_waiter
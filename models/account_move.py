@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from odoo.tools.sql import column_exists, create_column
+import logging
+
+from ..tools.invoice_keys import (
+    normalize_invoice_key, invoice_numeric_tail, sql_invoice_key, sql_invoice_numeric_tail,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Facturas que el asignador puede buscar (predicado de los índices parciales)
+CANDIDATE_MOVES_WHERE = "move_type IN ('out_invoice', 'out_refund') AND state = 'posted'"
+
+
+def _ensure_pg_trgm(cr):
+    """Intenta activar pg_trgm; retorna True si la extensión está disponible"""
+    cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cr.fetchone():
+        return True
+    try:
+        with cr.savepoint(flush=False):
+            cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        return True
+    except Exception as e:
+        _logger.warning(
+            'pg_trgm could not be installed (%s). Partial invoice matching will not be index-backed.',
+            str(e)
+        )
+        return False
+
+
+def _create_trigram_index(cr, indexname, tablename, column, where=None):
+    """Crea un índice GIN de trigramas si no existe"""
+    query = f'CREATE INDEX IF NOT EXISTS "{indexname}" ON "{tablename}" USING gin ("{column}" gin_trgm_ops)'
+    if where:
+        query += f' WHERE {where}'
+    cr.execute(query)
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    password_match_key = fields.Char(
+        string='Clave de Match',
+        compute='_compute_password_match_key',
+        store=True,
+        index=True,
+        copy=False,
+        help='Número de factura normalizado (solo letras y dígitos, mayúsculas, sin ceros a la izquierda)'
+    )
+    password_match_tail = fields.Char(
+        string='Cola Numérica de Match',
+        compute='_compute_password_match_key',
+        store=True,
+        index=True,
+        copy=False,
+        help='Último grupo de dígitos del número de factura, sin ceros a la izquierda'
+    )
+
+    @api.depends('move_type', 'invoice_number', 'name')
+    def _compute_password_match_key(self):
+        for move in self:
+            if move.move_type in ('out_invoice', 'out_refund'):
+                source = move.invoice_number or move.name or ''
+                move.password_match_key = normalize_invoice_key(source) or False
+                move.password_match_tail = invoice_numeric_tail(source) or False
+            else:
+                move.password_match_key = False
+                move.password_match_tail = False
+
+    def _post(self, soft=True):
+        posted = super()._post(soft=soft)
+        self.env['password.assigner.line.token']._refresh_moves(posted)
+        return posted
+
+    def _auto_init(self):
+        """Llena las claves con SQL al instalar para no recomputar todas las facturas con el ORM"""
+        cr = self.env.cr
+        if not column_exists(cr, 'account_move', 'password_match_key'):
+            create_column(cr, 'account_move', 'password_match_key', 'varchar')
+            create_column(cr, 'account_move', 'password_match_tail', 'varchar')
+            source = "COALESCE(NULLIF(invoice_number, ''), name, '')"
+            cr.execute(f"""
+                UPDATE account_move
+                   SET password_match_key = {sql_invoice_key(source)},
+                       password_match_tail = {sql_invoice_numeric_tail(source)}
+                 WHERE move_type IN ('out_invoice', 'out_refund')
+            """)
+        return super()._auto_init()
+
+    def init(self):
+        """Índices de trigramas para las búsquedas ilike '%número%' del asignador"""
+        super().init()
+        if not _ensure_pg_trgm(self.env.cr):
+            return
+        for column in ('invoice_number', 'name', 'ref'):
+            _create_trigram_index(
+                self.env.cr,
+                f'account_move_password_assigner_{column}_trgm_idx',
+                self._table,
+                column,
+                where=CANDIDATE_MOVES_WHERE,
+            )
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+from .account_move import _ensure_pg_trgm, _create_trigram_index
+
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        # Líneas agregadas a facturas ya publicadas (importaciones, reversiones)
+        self.env['password.assigner.line.token']._refresh_moves(
+            lines.move_id.filtered(lambda m: m.state == 'posted')
+        )
+        return lines
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'name' in vals:
+            self.env['password.assigner.line.token']._refresh_moves(
+                self.move_id.filtered(lambda m: m.state == 'posted')
+            )
+        return res
+
+    def init(self):
+        """Índice de trigramas para buscar números de factura en la descripción de las líneas"""
+        super().init()
+        if not _ensure_pg_trgm(self.env.cr):
+            return
+        _create_trigram_index(
+            self.env.cr,
+            'account_move_line_password_assigner_name_trgm_idx',
+            self._table,
+            'name',
+        )
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+from odoo.tools import config as odoo_config
 import logging
 
+from ..tools import cpu_pool, openai_client
+from ..tools.rate_limit import WAITER_TABLE, WAITER_TIMEOUT, RateLimiter
+
 _logger = logging.getLogger(__name__)
 
 DEFAULT_INSTRUCTIONS = """Eres un asistente especializado en extraer información de documentos de contraseña de pago de Guatemala.
@@ -99,6 +103,162 @@ class PasswordAssignerConfig(models.Model):
         help='Tiempo máximo de espera para la respuesta de OpenAI'
     )
 
+    connect_timeout = fields.Integer(
+        string='Timeout de Conexión (segundos)',
+        default=10,
+        help='Tiempo máximo para establecer la conexión con OpenAI'
+    )
+    max_retries = fields.Integer(
+        string='Reintentos',
+        default=3,
+        help='Reintentos ante errores de conexión, límite de tasa (429) o errores 5xx, '
+             'con espera exponencial entre intentos'
+    )
+
+    # Rate limiting (shared by every worker using this configuration)
+    rate_limit_rpm = fields.Integer(
+        string='Límite de Solicitudes por Minuto',
+        default=0,
+        help='Solicitudes por minuto permitidas para esta API Key (0 = sin límite). '
+             'Las solicitudes que excedan el límite esperan en cola.'
+    )
+    rate_limit_tpm = fields.Integer(
+        string='Límite de Tokens por Minuto',
+        default=0,
+        help='Tokens por minuto permitidos para esta API Key (0 = sin límite). '
+             'Se estiman a partir de las imágenes, el tamaño del PDF y los tokens de salida.'
+    )
+    rate_limit_max_wait = fields.Integer(
+        string='Espera Máxima en Cola (segundos)',
+        default=300,
+        help='Tiempo máximo que una solicitud espera capacidad antes de fallar. Fuera de '
+             'los trabajos en segundo plano se limita a la mitad de limit_time_real del servidor.'
+    )
+    rate_limit_queue_depth = fields.Integer(
+        string='Solicitudes en Cola',
+        compute='_compute_rate_limit_queue_depth',
+        help='Solicitudes esperando capacidad en este momento'
+    )
+    rate_limit_request_budget = fields.Float(
+        string='Presupuesto de Solicitudes',
+        readonly=True,
+        copy=False
+    )
+    rate_limit_token_budget = fields.Float(
+        string='Presupuesto de Tokens',
+        readonly=True,
+        copy=False
+    )
+    rate_limit_updated_at = fields.Float(
+        string='Última Actualización del Presupuesto',
+        readonly=True,
+        copy=False,
+        help='Epoch de la última recarga de las cubetas'
+    )
+
+    # Performance
+    max_parallel_documents = fields.Integer(
+        string='Documentos en Paralelo',
+        default=4,
+        help='Cantidad máxima de imágenes/PDFs que se envían a OpenAI al mismo tiempo. '
+             'Cada documento en paralelo usa una conexión adicional a la base de datos.'
+    )
+
+    use_background_jobs = fields.Boolean(
+        string='Procesar en Segundo Plano',
+        default=False,
+        help='Encola cada documento y lo procesa con un cron, fuera de la solicitud del wizard. '
+             'El preview se va llenando a medida que terminan los documentos.'
+    )
+    pdf_chunked_extraction = fields.Boolean(
+        string='Dividir PDFs Largos',
+        default=True,
+        help='Al convertir PDFs a imágenes, envía todas las páginas en solicitudes paralelas '
+             'de pocas páginas en lugar de procesar solo las primeras 10'
+    )
+    pdf_chunk_pages = fields.Integer(
+        string='Páginas por Solicitud',
+        default=10,
+        help='Cantidad de páginas (imágenes) por solicitud al dividir PDFs largos'
+    )
+
+    pdf_text_first = fields.Boolean(
+        string='Enviar Texto de PDFs',
+        default=True,
+        help='Para PDFs con capa de texto envía a OpenAI el texto extraído de cada página en lugar '
+             'del archivo completo. Si el texto no alcanza, se envía el PDF o sus imágenes.'
+    )
+    pdf_text_include_words = fields.Boolean(
+        string='Incluir Coordenadas de Palabras',
+        default=False,
+        help='Agrega la posición de cada palabra al texto enviado, para tablas que el texto '
+             'con disposición no alcanza a alinear'
+    )
+
+    cpu_workers = fields.Integer(
+        string='Procesos de CPU',
+        default=0,
+        help='Procesos por worker para extraer tablas y convertir páginas de PDFs en paralelo. '
+             '0 = procesar en el mismo worker. Cada proceso consume memoria propia: '
+             'activar solo si el servidor tiene CPU y memoria libres.'
+    )
+
+    # Image preprocessing
+    image_preprocessing = fields.Boolean(
+        string='Preprocesar Imágenes',
+        default=True,
+        help='Antes de enviar imágenes y páginas escaneadas a OpenAI las orienta, recorta '
+             'los bordes vacíos, las reduce y las recodifica para usar menos tokens'
+    )
+    image_max_side = fields.Integer(
+        string='Resolución Máxima (px)',
+        default=1600,
+        help='Lado mayor máximo de las imágenes enviadas a OpenAI'
+    )
+    image_grayscale = fields.Boolean(
+        string='Escala de Grises',
+        default=True
+    )
+    image_detail = fields.Selection([
+        ('auto', 'Automático'),
+        ('high', 'Alto'),
+        ('low', 'Bajo'),
+    ], string='Nivel de Detalle',
+        default='auto',
+        help='Automático usa detalle bajo solo para imágenes pequeñas (un tile de 512px)'
+    )
+
+    # Extraction cache
+    use_extraction_cache = fields.Boolean(
+        string='Usar Caché de Extracción',
+        default=True,
+        help='Reutiliza el resultado de un archivo idéntico ya procesado con el mismo modelo, '
+             'instrucciones y schema en lugar de llamar de nuevo a OpenAI'
+    )
+    cache_ttl_days = fields.Integer(
+        string='Vigencia de Caché (días)',
+        default=30
+    )
+    cache_max_entries = fields.Integer(
+        string='Máximo de Entradas en Caché',
+        default=5000,
+        help='Al superarse se eliminan las entradas usadas hace más tiempo'
+    )
+    cache_max_size_mb = fields.Integer(
+        string='Tamaño Máximo de Caché (MB)',
+        default=500,
+        help='Al superarse el tamaño total de los resultados guardados se eliminan '
+             'las entradas usadas hace más tiempo. 0 = sin límite de tamaño.'
+    )
+    cache_hits = fields.Integer(
+        string='Aciertos de Caché',
+        compute='_compute_cache_stats'
+    )
+    cache_misses = fields.Integer(
+        string='Fallos de Caché',
+        compute='_compute_cache_stats'
+    )
+
     # JSON Schema for Structured Outputs
     json_schema = fields.Text(
         string='JSON Schema',
@@ -107,6 +267,25 @@ class PasswordAssignerConfig(models.Model):
         help='Schema JSON para Structured Outputs de OpenAI'
     )
 
+    def _compute_rate_limit_queue_depth(self):
+        depths = {}
+        if self.ids:
+            self.env.cr.execute(f"""
+                SELECT config_id, COUNT(*)
+                  FROM {WAITER_TABLE}
+                 WHERE config_id = ANY(%s)
+                   AND heartbeat_at >= EXTRACT(EPOCH FROM clock_timestamp()) - %s
+              GROUP BY config_id
+            """, [self.ids, WAITER_TIMEOUT])
+            depths = dict(self.env.cr.fetchall())
+        for record in self:
+            record.rate_limit_queue_depth = depths.get(record.id, 0)
+
+    def _compute_cache_stats(self):
+        totals = self.env['password.assigner.extraction.cache.stat'].sudo()._get_totals(self)
+        for record in self:
+            record.cache_hits, record.cache_misses = totals.get(record.id, (0, 0))
+
     @api.depends('name')
     def _compute_json_schema(self):
         """Genera el JSON Schema para extracción de contraseñas"""
@@ -211,48 +390,146 @@ class PasswordAssignerConfig(models.Model):
             if record.timeout < 10 or record.timeout > 600:
                 raise ValidationError(_('El timeout debe estar entre 10 y 600 segundos'))
 
-    def action_test_connection(self):
-        """Prueba la conexión con OpenAI"""
-        self.ensure_one()
-        import requests
-        import json
+    @api.constrains('connect_timeout', 'max_retries')
+    def _check_retry_settings(self):
+        for record in self:
+            if record.connect_timeout < 1 or record.connect_timeout > 60:
+                raise ValidationError(_('El timeout de conexión debe estar entre 1 y 60 segundos'))
+            if record.max_retries < 0 or record.max_retries > 10:
+                raise ValidationError(_('Los reintentos deben estar entre 0 y 10'))
 
-        try:
-            headers = {
-                'Authorization': f'Bearer {self.openai_api_key}',
-                'Content-Type': 'application/json',
-            }
+    @api.constrains('rate_limit_rpm', 'rate_limit_tpm', 'rate_limit_max_wait')
+    def _check_rate_limits(self):
+        for record in self:
+            if record.rate_limit_rpm < 0 or record.rate_limit_tpm < 0:
+                raise ValidationError(_('Los límites de tasa no pueden ser negativos'))
+            if record.rate_limit_max_wait < 0 or record.rate_limit_max_wait > 3600:
+                raise ValidationError(_('La espera máxima en cola debe estar entre 0 y 3600 segundos'))
+
+    @api.constrains('max_parallel_documents')
+    def _check_max_parallel_documents(self):
+        for record in self:
+            if record.max_parallel_documents < 1 or record.max_parallel_documents > 16:
+                raise ValidationError(_('Los documentos en paralelo deben estar entre 1 y 16'))
 
-            # Simple test request
-            payload = {
-                "model": self.openai_model,
-                "input": "Responde solo: OK",
-                "max_output_tokens": 20,
+    @api.constrains('pdf_chunk_pages')
+    def _check_pdf_chunk_pages(self):
+        for record in self:
+            if record.pdf_chunk_pages < 1 or record.pdf_chunk_pages > 20:
+                raise ValidationError(_('Las páginas por solicitud deben estar entre 1 y 20'))
+
+    @api.constrains('cpu_workers')
+    def _check_cpu_workers(self):
+        for record in self:
+            if record.cpu_workers < 0 or record.cpu_workers > cpu_pool.MAX_CPU_WORKERS:
+                raise ValidationError(_('Los procesos de CPU deben estar entre 0 y %s') % cpu_pool.MAX_CPU_WORKERS)
+
+    @api.constrains('image_max_side')
+    def _check_image_max_side(self):
+        for record in self:
+            if record.image_max_side < 512 or record.image_max_side > 4096:
+                raise ValidationError(_('La resolución máxima debe estar entre 512 y 4096 pixeles'))
+
+    @api.constrains('cache_ttl_days', 'cache_max_entries', 'cache_max_size_mb')
+    def _check_cache_limits(self):
+        for record in self:
+            if record.cache_ttl_days < 1:
+                raise ValidationError(_('La vigencia de la caché debe ser de al menos 1 día'))
+            if record.cache_max_entries < 0:
+                raise ValidationError(_('El máximo de entradas en caché no puede ser negativo'))
+            if record.cache_max_size_mb < 0:
+                raise ValidationError(_('El tamaño máximo de la caché no puede ser negativo'))
+
+    def action_clear_cache(self):
+        """Elimina la caché de extracción de esta configuración"""
+        self.ensure_one()
+        self.env['password.assigner.extraction.cache'].sudo().search([('config_id', '=', self.id)]).unlink()
+        self.env['password.assigner.extraction.cache.stat'].sudo().search([('config_id', '=', self.id)]).unlink()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Caché Eliminada'),
+                'message': _('Se eliminó la caché de extracción.'),
+                'type': 'success',
+                'sticky': False,
             }
+        }
 
-            response = requests.post(
-                self.openai_api_url,
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=30
-            )
-
-            if response.status_code == 200:
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': _('Conexión Exitosa'),
-                        'message': _('La conexión con OpenAI se realizó correctamente.'),
-                        'type': 'success',
-                        'sticky': False,
-                    }
-                }
-            else:
-                error_msg = response.json().get('error', {}).get('message', response.text)
-                raise ValidationError(_('Error de OpenAI: %s') % error_msg)
+    def _get_rate_limit_max_wait(self):
+        """
+        Espera máxima en cola. Dentro de una solicitud HTTP (fuera de los trabajos en
+        segundo plano) se limita a la mitad de limit_time_real, para que el worker no
+        se termine a la fuerza mientras espera.
+        """
+        self.ensure_one()
+        max_wait = self.rate_limit_max_wait
+        limit_time_real = odoo_config.get('limit_time_real') or 0
+        if limit_time_real > 0 and not self.env.context.get('password_assigner_background'):
+            max_wait = min(max_wait, limit_time_real // 2)
+        return max_wait
+
+    def _get_openai_request_params(self):
+        """Datos de conexión para tools.openai_client (se pueden usar sin cursor)"""
+        self.ensure_one()
+        return {
+            'url': self.openai_api_url,
+            'api_key': self.openai_api_key,
+            'timeout': self.timeout,
+            'connect_timeout': self.connect_timeout,
+            'max_retries': self.max_retries,
+            'rate_limiter': RateLimiter(
+                self.env.registry.cursor,
+                self.id,
+                self.rate_limit_rpm,
+                self.rate_limit_tpm,
+                self._get_rate_limit_max_wait(),
+            ) if self.rate_limit_rpm or self.rate_limit_tpm else None,
+        }
+
+    def _get_image_preprocess_options(self):
+        """Opciones para tools.image_preprocess, o None si el preprocesamiento está desactivado"""
+        self.ensure_one()
+        if not self.image_preprocessing:
+            return None
+        return {
+            'max_side': self.image_max_side,
+            'grayscale': self.image_grayscale,
+            'detail': self.image_detail or 'auto',
+        }
+
+    def action_test_connection(self):
+        """Prueba la conexión con OpenAI"""
+        self.ensure_one()
+
+        # Simple test request
+        payload = {
+            "model": self.openai_model,
+            "input": "Responde solo: OK",
+            "max_output_tokens": 20,
+        }
+        params = dict(self._get_openai_request_params(), timeout=30)
 
-        except requests.exceptions.Timeout:
+        try:
+            response = openai_client.post_json(params, payload)
+        except openai_client.OpenAITimeoutError:
             raise ValidationError(_('Timeout: No se pudo conectar con OpenAI'))
-        except requests.exceptions.RequestException as e:
+        except openai_client.OpenAIError as e:
             raise ValidationError(_('Error de conexión: %s') % str(e))
+
+        if response.status_code == 200:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Conexión Exitosa'),
+                    'message': _('La conexión con OpenAI se realizó correctamente.'),
+                    'type': 'success',
+                    'sticky': False,
+                }
+            }
+        try:
+            error_msg = response.json().get('error', {}).get('message', response.text)
+        except ValueError:
+            error_msg = response.text
+        raise ValidationError(_('Error de OpenAI: %s') % error_msg)
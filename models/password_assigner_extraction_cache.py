@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from datetime import timedelta
+import hashlib
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class PasswordAssignerExtractionCache(models.Model):
+    _name = 'password.assigner.extraction.cache'
+    _description = 'Caché de Extracción de Documentos'
+    _order = 'last_hit_at desc, id desc'
+
+    key = fields.Char(
+        string='Clave',
+        required=True,
+        index=True,
+        help='sha256 del archivo, etapa, modelo, instrucciones y schema'
+    )
+    stage = fields.Char(
+        string='Etapa',
+        help='Etapa de extracción que generó el resultado (tablas, PDF directo, imágenes)'
+    )
+    config_id = fields.Many2one(
+        'password.assigner.config',
+        string='Configuración IA',
+        ondelete='cascade',
+        index=True
+    )
+    result_data = fields.Text(
+        string='Resultado',
+        help='Resultado de la extracción en formato JSON'
+    )
+    size = fields.Integer(
+        string='Tamaño (bytes)'
+    )
+    hit_count = fields.Integer(
+        string='Aciertos',
+        default=0
+    )
+    last_hit_at = fields.Datetime(
+        string='Último Uso'
+    )
+
+    _key_unique = models.Constraint(
+        'UNIQUE(key)',
+        'La clave de caché debe ser única.',
+    )
+
+    @api.model
+    def _make_key(self, stage, file_content, config=None, variant=''):
+        """
+        Clave de caché para el resultado de una etapa sobre un archivo.
+        Las etapas de IA incluyen el modelo y hashes de las instrucciones y el schema.
+        """
+        parts = [stage, hashlib.sha256(file_content).hexdigest(), variant]
+        if config:
+            parts += [
+                config.openai_model or '',
+                hashlib.sha256((config.openai_instructions or '').encode()).hexdigest(),
+                hashlib.sha256((config.json_schema or '').encode()).hexdigest(),
+            ]
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    @api.model
+    def _lookup(self, key, config):
+        """
+        Busca un resultado vigente.
+
+        Returns:
+            tuple: (encontrado, resultado)
+        """
+        limit_date = fields.Datetime.now() - timedelta(days=config.cache_ttl_days)
+        self.env.cr.execute(f"""
+            SELECT id, result_data
+              FROM {self._table}
+             WHERE key = %s
+               AND create_date >= %s
+        """, [key, limit_date])
+        row = self.env.cr.fetchone()
+
+        # Contadores en una transacción corta, fuera de la fila de la configuración
+        with self.env.registry.cursor() as cr:
+            if row:
+                cr.execute(f"""
+                    UPDATE {self._table}
+                       SET hit_count = hit_count + 1, last_hit_at = NOW() AT TIME ZONE 'UTC'
+                     WHERE id = %s
+                """, [row[0]])
+            self.env['password.assigner.extraction.cache.stat']._record(cr, config.id, bool(row))
+
+        if not row:
+            return False, None
+        return True, json.loads(row[1])
+
+    @api.model
+    def _store(self, key, stage, result, config):
+        """Guarda (o reemplaza) el resultado de una extracción"""
+        result_data = json.dumps(result, default=str)
+        with self.env.registry.cursor() as cr:
+            cr.execute(f"""
+                INSERT INTO {self._table}
+                       (key, stage, config_id, result_data, size, hit_count, last_hit_at,
+                        create_uid, create_date, write_uid, write_date)
+                VALUES (%s, %s, %s, %s, %s, 0, NOW() AT TIME ZONE 'UTC',
+                        %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC')
+                ON CONFLICT (key) DO UPDATE
+                   SET result_data = EXCLUDED.result_data,
+                       size = EXCLUDED.size,
+                       create_date = EXCLUDED.create_date,
+                       write_date = EXCLUDED.write_date
+            """, [key, stage, config.id, result_data, len(result_data), self.env.uid, self.env.uid])
+
+    @api.model
+    def _cron_evict(self):
+        """
+        Elimina entradas vencidas y las menos usadas cuando se supera el máximo de
+        entradas o el tamaño máximo (suma de size) por configuración.
+        """
+        configs = self.env['password.assigner.config'].with_context(active_test=False).search([])
+        for config in configs:
+            limit_date = fields.Datetime.now() - timedelta(days=config.cache_ttl_days)
+            max_size = config.cache_max_size_mb * 1024 * 1024 if config.cache_max_size_mb > 0 else None
+            self.env.cr.execute(f"""
+                DELETE FROM {self._table}
+                 WHERE config_id = %s
+                   AND (create_date < %s
+                        OR id IN (
+                            SELECT id
+                              FROM (
+                                    SELECT id,
+                                           ROW_NUMBER() OVER recent AS rnk,
+                                           SUM(COALESCE(size, 0)) OVER recent AS total_size
+                                      FROM {self._table}
+                                     WHERE config_id = %s
+                                    WINDOW recent AS (ORDER BY COALESCE(last_hit_at, create_date) DESC, id DESC)
+                                   ) AS ranked
+                             WHERE rnk > %s
+                                OR total_size > %s
+                        ))
+            """, [config.id, limit_date, config.id, max(config.cache_max_entries, 0), max_size])
+            if self.env.cr.rowcount:
+                _logger.info('Evicted %d extraction cache entries for config %s',
+                             self.env.cr.rowcount, config.id)
+        self.invalidate_model()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class PasswordAssignerExtractionCacheStat(models.Model):
+    _name = 'password.assigner.extraction.cache.stat'
+    _description = 'Estadística de Caché de Extracción'
+    _order = 'date desc, id desc'
+
+    config_id = fields.Many2one(
+        'password.assigner.config',
+        string='Configuración IA',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    date = fields.Date(
+        string='Fecha',
+        required=True
+    )
+    hits = fields.Integer(
+        string='Aciertos',
+        default=0
+    )
+    misses = fields.Integer(
+        string='Fallos',
+        default=0
+    )
+
+    _config_date_unique = models.Constraint(
+        'UNIQUE(config_id, date)',
+        'Solo puede haber una estadística por configuración y día.',
+    )
+
+    @api.model
+    def _record(self, cr, config_id, hit):
+        """
+        Suma un acierto o un fallo a la fila del día de la configuración.
+
+        Se ejecuta en el cursor corto de la búsqueda en caché: los contadores no
+        viven en la fila de password.assigner.config, que el limitador de tasa
+        bloquea en cada solicitud.
+        """
+        cr.execute(f"""
+            INSERT INTO {self._table}
+                   (config_id, date, hits, misses, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, (NOW() AT TIME ZONE 'UTC')::date, %s, %s,
+                    %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT (config_id, date) DO UPDATE
+               SET hits = {self._table}.hits + EXCLUDED.hits,
+                   misses = {self._table}.misses + EXCLUDED.misses,
+                   write_date = EXCLUDED.write_date
+        """, [config_id, int(hit), int(not hit), self.env.uid, self.env.uid])
+
+    @api.model
+    def _get_totals(self, configs):
+        """
+        Returns:
+            dict: {config_id: (aciertos, fallos)}
+        """
+        return {
+            config.id: (hits, misses)
+            for config, hits, misses in self._read_group(
+                [('config_id', 'in', configs.ids)],
+                ['config_id'],
+                ['hits:sum', 'misses:sum'],
+            )
+        }
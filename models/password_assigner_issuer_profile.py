@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+import logging
+import re
+
+from ..tools import issuer_profiles, worker_cache
+
+_logger = logging.getLogger(__name__)
+
+
+class PasswordAssignerIssuerProfile(models.Model):
+    _name = 'password.assigner.issuer.profile'
+    _description = 'Perfil de Formato de Emisor'
+    _order = 'sequence, name'
+
+    name = fields.Char(
+        string='Emisor',
+        required=True,
+        help='Nombre del emisor que se asigna a las contraseñas leídas con este perfil'
+    )
+    sequence = fields.Integer(
+        string='Secuencia',
+        default=10
+    )
+    active = fields.Boolean(
+        string='Activo',
+        default=True
+    )
+
+    # Identification
+    header_fingerprint = fields.Char(
+        string='Huella de Encabezado',
+        required=True,
+        help='Expresión regular que se busca en las primeras líneas de la primera página '
+             'para reconocer los documentos del emisor (ej: DISTELSA)'
+    )
+    password_regex = fields.Char(
+        string='Expresión de Contraseña',
+        required=True,
+        help='Expresión regular que encuentra la contraseña en el texto; '
+             'el primer grupo es el número (ej: No\\.\\s*([A-Z]+\\s*-?\\s*\\d+))'
+    )
+
+    # Invoice table
+    invoice_regex = fields.Char(
+        string='Expresión de Factura',
+        default=issuer_profiles.DEFAULT_INVOICE_PATTERN,
+        help='Las filas cuya celda de factura no coincide completa con esta expresión '
+             '(encabezados, totales) se ignoran'
+    )
+    invoice_column = fields.Integer(
+        string='Columna Factura',
+        required=True,
+        default=2,
+        help='Posición de la columna con el número de factura (1 = primera columna)'
+    )
+    series_column = fields.Integer(
+        string='Columna Serie',
+        default=0,
+        help='Posición de la columna con la serie (0 = sin columna)'
+    )
+    amount_column = fields.Integer(
+        string='Columna Monto',
+        default=0,
+        help='Posición de la columna con el monto (0 = sin columna)'
+    )
+    table_strategy = fields.Selection([
+        ('lines', 'Bordes de tabla'),
+        ('text', 'Columnas alineadas por texto'),
+    ], string='Detección de Tabla',
+        default='lines',
+        required=True
+    )
+    crop_box = fields.Char(
+        string='Zona de la Tabla',
+        help='Zona de cada página donde está la tabla, en puntos: x0,top,x1,bottom '
+             '(vacío = página completa)'
+    )
+    currency = fields.Char(
+        string='Moneda',
+        default='Q'
+    )
+
+    # Usage
+    source_document = fields.Char(
+        string='Documento de Origen',
+        readonly=True,
+        help='Documento revisado a partir del cual se creó el perfil'
+    )
+
+    @api.constrains('header_fingerprint', 'password_regex', 'invoice_regex')
+    def _check_regexes(self):
+        for record in self:
+            for field_name in ('header_fingerprint', 'password_regex', 'invoice_regex'):
+                try:
+                    re.compile(record[field_name] or '')
+                except re.error as e:
+                    raise ValidationError(_('Expresión inválida en %(field)s: %(error)s') % {
+                        'field': record._fields[field_name].string,
+                        'error': str(e),
+                    })
+
+    @api.constrains('invoice_column', 'series_column', 'amount_column')
+    def _check_columns(self):
+        for record in self:
+            if record.invoice_column < 1:
+                raise ValidationError(_('La columna de factura debe ser 1 o mayor'))
+            if record.series_column < 0 or record.amount_column < 0:
+                raise ValidationError(_('Las columnas de serie y monto no pueden ser negativas'))
+
+    @api.constrains('crop_box')
+    def _check_crop_box(self):
+        for record in self:
+            try:
+                issuer_profiles.parse_crop_box(record.crop_box)
+            except ValueError:
+                raise ValidationError(_(
+                    'La zona de la tabla debe tener el formato x0,top,x1,bottom '
+                    'con x0 < x1 y top < bottom'
+                ))
+
+    @api.model
+    def _get_compiled_profiles(self):
+        """
+        Perfiles activos con sus expresiones compiladas, en el orden de búsqueda.
+        Se compilan una vez por worker y se recargan cuando cambia algún perfil.
+        """
+        self.flush_model()
+        signature = worker_cache.table_signature(self.env.cr, self._table, 'active')
+
+        def load_profiles():
+            profiles = []
+            for profile in self.sudo().search([]):
+                try:
+                    profiles.append(issuer_profiles.compile_profile({
+                        'id': profile.id,
+                        'name': profile.name,
+                        'header_fingerprint': profile.header_fingerprint,
+                        'password_regex': profile.password_regex,
+                        'invoice_regex': profile.invoice_regex,
+                        'invoice_column': profile.invoice_column,
+                        'series_column': profile.series_column,
+                        'amount_column': profile.amount_column,
+                        'crop_box': profile.crop_box,
+                        'table_strategy': profile.table_strategy,
+                        'currency': profile.currency,
+                    }))
+                except (re.error, ValueError) as e:
+                    _logger.warning('Issuer profile %s ignored: %s', profile.name, str(e))
+            return tuple(profiles)
+
+        return worker_cache.get_cached('issuer_profiles', self.env.cr.dbname, signature, load_profiles)
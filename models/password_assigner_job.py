@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json
+import logging
+
+from ..tools.pdf_document import PDF_KINDS
+
+_logger = logging.getLogger(__name__)
+
+# Intentos máximos antes de dejar un trabajo en error
+MAX_ATTEMPTS = 3
+# Días que se conservan los trabajos terminados
+JOB_RETENTION_DAYS = 7
+
+
+class PasswordAssignerJob(models.Model):
+    _name = 'password.assigner.job'
+    _description = 'Trabajo de Procesamiento de Documento'
+    _order = 'id'
+
+    name = fields.Char(
+        string='Documento',
+        related='attachment_id.name'
+    )
+    attachment_id = fields.Many2one(
+        'ir.attachment',
+        string='Adjunto',
+        required=True,
+        ondelete='cascade'
+    )
+    config_id = fields.Many2one(
+        'password.assigner.config',
+        string='Configuración IA',
+        ondelete='set null'
+    )
+    template_id = fields.Many2one(
+        'password.assigner.template',
+        string='Plantilla Excel',
+        ondelete='set null'
+    )
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        required=True,
+        default=lambda self: self.env.company
+    )
+
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'Procesando'),
+        ('done', 'Terminado'),
+        ('error', 'Error'),
+    ], string='Estado',
+        default='pending',
+        required=True,
+        index=True
+    )
+    attempts = fields.Integer(
+        string='Intentos',
+        default=0
+    )
+    started_at = fields.Datetime(
+        string='Inicio'
+    )
+    finished_at = fields.Datetime(
+        string='Fin'
+    )
+
+    pdf_kind = fields.Selection(
+        PDF_KINDS,
+        string='Tipo de PDF',
+        readonly=True,
+        help='Clasificación local del PDF que decidió las etapas de extracción'
+    )
+
+    # Results
+    result_data = fields.Text(
+        string='Resultados',
+        help='Contraseñas extraídas en formato JSON'
+    )
+    processing_log = fields.Text(
+        string='Log de Procesamiento'
+    )
+    error_message = fields.Text(
+        string='Error'
+    )
+    imported = fields.Boolean(
+        string='Importado al Preview',
+        default=False,
+        help='Indica si los resultados ya se cargaron en el wizard'
+    )
+
+    def _get_results(self):
+        """Resultados extraídos, en el formato de _process_excel / _process_image_pdf"""
+        self.ensure_one()
+        return json.loads(self.result_data) if self.result_data else []
+
+    @api.model
+    def _trigger_processing(self):
+        self.env.ref('adroc_password_assigner.ir_cron_password_assigner_process_jobs')._trigger()
+
+    @api.model
+    def _get_stale_threshold(self):
+        """Un trabajo en proceso por más de este tiempo se considera abandonado"""
+        return fields.Datetime.now() - timedelta(minutes=15)
+
+    @api.model
+    def _requeue_stale_jobs(self):
+        """Reencola los trabajos de un worker que se cayó a medio procesar"""
+        stale_jobs = self.search([
+            ('state', '=', 'running'),
+            ('started_at', '<', self._get_stale_threshold()),
+        ])
+        for job in stale_jobs:
+            if job.attempts >= MAX_ATTEMPTS:
+                job.write({
+                    'state': 'error',
+                    'error_message': _('El procesamiento se interrumpió %s veces.') % job.attempts,
+                    'finished_at': fields.Datetime.now(),
+                })
+            else:
+                _logger.info('Requeuing stale password assigner job %s', job.id)
+                job.state = 'pending'
+
+    @api.model
+    def _acquire_next_jobs(self, limit=1):
+        """Toma hasta limit trabajos pendientes sin competir con otros workers"""
+        self.env.cr.execute(f"""
+            SELECT id
+              FROM {self._table}
+             WHERE state = 'pending'
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [limit])
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        for job in jobs:
+            job.write({
+                'state': 'running',
+                'attempts': job.attempts + 1,
+                'started_at': fields.Datetime.now(),
+            })
+        return jobs
+
+    @api.model
+    def _cron_process_jobs(self):
+        """
+        Procesa en paralelo hasta max_parallel_documents trabajos pendientes (según la
+        configuración del primero) por ejecución; el cron se reprograma mientras queden.
+        Cada trabajo se procesa en su propio hilo y cursor, como las extracciones del wizard.
+        """
+        self._requeue_stale_jobs()
+        jobs = self._acquire_next_jobs()
+        if jobs and jobs.config_id.max_parallel_documents > 1:
+            jobs |= self._acquire_next_jobs(jobs.config_id.max_parallel_documents - 1)
+        if jobs:
+            # Hacer visible el estado 'running' antes de las llamadas a OpenAI
+            self.env.cr.commit()
+            if len(jobs) == 1 or self.env.registry.in_test_mode():
+                for job in jobs:
+                    job._process_as_owner()
+            else:
+                self._process_jobs_in_threads(jobs)
+
+        remaining = self.search_count([('state', '=', 'pending')])
+        self.env['ir.cron']._notify_progress(done=len(jobs), remaining=remaining)
+
+    @api.model
+    def _process_jobs_in_threads(self, jobs):
+        """Procesa cada trabajo en un hilo con su propio cursor, que se confirma al terminar"""
+        registry = self.env.registry
+        context = dict(self.env.context)
+
+        def process_in_thread(job_id):
+            with registry.cursor() as cr:
+                env = api.Environment(cr, self.env.uid, context)
+                env[self._name].browse(job_id)._process_as_owner()
+
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix='password_assigner_job') as executor:
+            for future in [executor.submit(process_in_thread, job_id) for job_id in jobs.ids]:
+                try:
+                    future.result()
+                except Exception:
+                    # El trabajo queda en 'running' y se reencola al vencer _get_stale_threshold
+                    _logger.exception('Error processing password assigner job')
+
+    def _process_as_owner(self):
+        self.ensure_one()
+        self.with_user(self.create_uid).with_company(self.company_id)._process()
+
+    def _process(self):
+        """Extrae el documento del trabajo y guarda los resultados"""
+        self.ensure_one()
+        wizard = self.env['password.assigner.wizard'].with_context(password_assigner_background=True).new({
+            'config_id': self.config_id.id,
+            'template_id': self.template_id.id,
+            'company_id': self.company_id.id,
+        })
+        document = wizard._prepare_document(self.attachment_id)
+        if not document['kind']:
+            document['error'] = _('Tipo de archivo no soportado: %s') % document['filename']
+        else:
+            wizard._run_document_extraction(document)
+
+        vals = {
+            'processing_log': '\n'.join(document['log']),
+            'pdf_kind': document.get('pdf_kind'),
+            'finished_at': fields.Datetime.now(),
+        }
+        if document.get('error'):
+            vals.update(state='error', error_message=document['error'])
+        else:
+            vals.update(state='done', result_data=json.dumps(document['results'], default=str))
+        self.write(vals)
+
+    def action_retry(self):
+        """Vuelve a encolar trabajos con error"""
+        failed = self.filtered(lambda j: j.state == 'error')
+        if not failed:
+            raise UserError(_('Solo se pueden reintentar trabajos con error.'))
+        failed.write({
+            'state': 'pending',
+            'attempts': 0,
+            'error_message': False,
+            'imported': False,
+        })
+        self._trigger_processing()
+
+    @api.autovacuum
+    def _gc_finished_jobs(self):
+        """Elimina los trabajos terminados antiguos"""
+        limit_date = fields.Datetime.now() - timedelta(days=JOB_RETENTION_DAYS)
+        self.search([
+            ('state', 'in', ('done', 'error')),
+            ('finished_at', '<', limit_date),
+        ]).unlink()
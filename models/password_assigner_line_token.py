@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import logging
+
+from ..tools.invoice_keys import description_tokens
+
+_logger = logging.getLogger(__name__)
+
+BACKFILL_LAST_ID_PARAM = 'adroc_password_assigner.line_token_backfill_last_id'
+BACKFILL_DONE_PARAM = 'adroc_password_assigner.line_token_backfill_done'
+
+
+class PasswordAssignerLineToken(models.Model):
+    _name = 'password.assigner.line.token'
+    _description = 'Token de Descripción de Línea de Factura'
+    _log_access = False
+
+    token = fields.Char(
+        string='Token',
+        required=True,
+        index=True,
+        help='Número o código normalizado encontrado en la descripción de la línea'
+    )
+    move_id = fields.Many2one(
+        'account.move',
+        string='Factura',
+        required=True,
+        index=True,
+        ondelete='cascade'
+    )
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        required=True
+    )
+
+    _token_move_unique = models.Constraint(
+        'UNIQUE(token, move_id)',
+        'El token ya existe para esta factura.',
+    )
+
+    @api.model
+    def _refresh_moves(self, moves):
+        """Recalcula los tokens de las facturas de cliente publicadas indicadas"""
+        moves = moves.filtered(
+            lambda m: m.move_type in ('out_invoice', 'out_refund') and m.state == 'posted'
+        )
+        if not moves:
+            return
+
+        self.env['account.move.line'].flush_model(['name', 'move_id'])
+        cr = self.env.cr
+        cr.execute(f"DELETE FROM {self._table} WHERE move_id = ANY(%s)", [moves.ids])
+        cr.execute("""
+            SELECT l.move_id, m.company_id, l.name
+              FROM account_move_line l
+              JOIN account_move m ON m.id = l.move_id
+             WHERE l.move_id = ANY(%s)
+               AND l.name IS NOT NULL
+        """, [moves.ids])
+
+        rows = set()
+        for move_id, company_id, name in cr.fetchall():
+            for token in description_tokens(name):
+                rows.add((token, move_id, company_id))
+
+        if rows:
+            tokens, move_ids, company_ids = zip(*rows)
+            cr.execute(f"""
+                INSERT INTO {self._table} (token, move_id, company_id)
+                SELECT * FROM unnest(%s::varchar[], %s::int[], %s::int[])
+                ON CONFLICT DO NOTHING
+            """, [list(tokens), list(move_ids), list(company_ids)])
+        self.invalidate_model()
+
+    @api.model
+    def _is_backfill_done(self):
+        return self.env['ir.config_parameter'].sudo().get_param(BACKFILL_DONE_PARAM) == '1'
+
+    @api.model
+    def _cron_backfill_tokens(self, batch_size=2000):
+        """Llena los tokens de las facturas publicadas antes de instalar el módulo, por bloques"""
+        params = self.env['ir.config_parameter'].sudo()
+        if params.get_param(BACKFILL_DONE_PARAM) == '1':
+            return
+
+        last_id = int(params.get_param(BACKFILL_LAST_ID_PARAM, 0))
+        self.env.cr.execute("""
+            SELECT id
+              FROM account_move
+             WHERE id > %s
+               AND move_type IN ('out_invoice', 'out_refund')
+               AND state = 'posted'
+          ORDER BY id
+             LIMIT %s
+        """, [last_id, batch_size])
+        move_ids = [row[0] for row in self.env.cr.fetchall()]
+
+        if move_ids:
+            self._refresh_moves(self.env['account.move'].browse(move_ids))
+            params.set_param(BACKFILL_LAST_ID_PARAM, move_ids[-1])
+
+        self.env.cr.execute("""
+            SELECT COUNT(*)
+              FROM account_move
+             WHERE id > %s
+               AND move_type IN ('out_invoice', 'out_refund')
+               AND state = 'posted'
+        """, [move_ids[-1] if move_ids else last_id])
+        remaining = self.env.cr.fetchone()[0]
+
+        if not remaining:
+            params.set_param(BACKFILL_DONE_PARAM, '1')
+            _logger.info('Invoice line token backfill completed')
+        self.env['ir.cron']._notify_progress(done=len(move_ids), remaining=remaining)
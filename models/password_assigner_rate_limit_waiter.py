@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class PasswordAssignerRateLimitWaiter(models.Model):
+    _name = 'password.assigner.rate.limit.waiter'
+    _description = 'Solicitud en Cola del Limitador de Tasa'
+
+    # Filas escritas por tools.rate_limit.RateLimiter con SQL: una por solicitud
+    # que espera capacidad, con un latido en cada consulta al presupuesto
+
+    config_id = fields.Many2one(
+        'password.assigner.config',
+        string='Configuración IA',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    heartbeat_at = fields.Float(
+        string='Último Latido',
+        help='Epoch de la última consulta al presupuesto de la solicitud en espera'
+    )
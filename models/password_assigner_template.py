@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+import itertools
 import logging
+import re
+
+from ..tools import template_index, worker_cache
 
 _logger = logging.getLogger(__name__)
 
+# Columnas de cada factura en parse_file_grouped
+INVOICE_COLUMNS = ['invoice_number', 'invoice_series', 'amount', 'date']
+# Filas por lote en la lectura por lotes de archivos grandes
+STREAM_BATCH_ROWS = 20000
+
 
 class PasswordAssignerTemplate(models.Model):
     _name = 'password.assigner.template'
@@ -81,6 +90,28 @@ class PasswordAssignerTemplate(models.Model):
         default=0,
         help='Índice de la hoja de Excel (0 = primera hoja)'
     )
+    sheet_mode = fields.Selection([
+        ('single', 'Una hoja'),
+        ('pattern', 'Hojas cuyo nombre coincide'),
+        ('all', 'Todas las hojas'),
+    ], string='Hojas a Leer',
+        default='single',
+        required=True,
+        help='Una hoja (por nombre o índice), las hojas cuyo nombre coincide con la expresión, '
+             'o todas. Con varias hojas el libro se abre una sola vez y cada factura guarda '
+             'su hoja de origen'
+    )
+    sheet_pattern = fields.Char(
+        string='Expresión de Hojas',
+        help='Expresión regular que se busca en el nombre de cada hoja (ej: ^Contraseña)'
+    )
+
+    stream_threshold_kb = fields.Integer(
+        string='Leer por Lotes desde (KB)',
+        default=5120,
+        help='Los archivos de este tamaño o mayores se leen por lotes de filas y solo con las '
+             'columnas configuradas, sin cargar la hoja completa en memoria (0 = nunca)'
+    )
 
     # Password grouping
     password_mode = fields.Selection([
@@ -93,6 +124,15 @@ class PasswordAssignerTemplate(models.Model):
         help='Cómo se estructura la contraseña en el archivo'
     )
 
+    # Automatic detection
+    header_fingerprint = fields.Char(
+        string='Huella de Encabezado',
+        compute='_compute_header_fingerprint',
+        store=True,
+        index=True,
+        help='Columnas configuradas normalizadas; se usa para detectar la plantilla de cada archivo'
+    )
+
     # Sample file for reference
     sample_file = fields.Binary(
         string='Archivo de Ejemplo',
@@ -102,13 +142,31 @@ class PasswordAssignerTemplate(models.Model):
         string='Nombre Archivo Ejemplo'
     )
 
+    @api.depends('column_password', 'column_invoice_number', 'column_invoice_series',
+                 'column_amount', 'column_date')
+    def _compute_header_fingerprint(self):
+        for record in self:
+            record.header_fingerprint = template_index.header_fingerprint(record._configured_columns())
+
     @api.constrains('column_invoice_number')
     def _check_column_invoice_number(self):
         for record in self:
             if not record.column_invoice_number:
                 raise ValidationError(_('Debe especificar la columna de número de factura'))
 
-    @api.constrains('skip_rows', 'header_row', 'sheet_index')
+    @api.constrains('sheet_mode', 'sheet_pattern')
+    def _check_sheet_pattern(self):
+        for record in self:
+            if record.sheet_mode != 'pattern':
+                continue
+            if not record.sheet_pattern:
+                raise ValidationError(_('Debe especificar la expresión de las hojas a leer'))
+            try:
+                re.compile(record.sheet_pattern)
+            except re.error as e:
+                raise ValidationError(_('Expresión de hojas inválida: %s') % str(e))
+
+    @api.constrains('skip_rows', 'header_row', 'sheet_index', 'stream_threshold_kb')
     def _check_positive_integers(self):
         for record in self:
             if record.skip_rows < 0:
@@ -117,6 +175,125 @@ class PasswordAssignerTemplate(models.Model):
                 raise ValidationError(_('La fila de encabezados no puede ser negativa'))
             if record.sheet_index < 0:
                 raise ValidationError(_('El índice de hoja no puede ser negativo'))
+            if record.stream_threshold_kb < 0:
+                raise ValidationError(_('El tamaño para leer por lotes no puede ser negativo'))
+
+    @api.model
+    def _get_header_index(self):
+        """
+        Índice de encabezados de las plantillas activas (tools.template_index).
+        Se construye una vez por worker y se reconstruye cuando cambia alguna plantilla.
+        """
+        self.flush_model()
+        signature = worker_cache.table_signature(self.env.cr, self._table, 'active')
+
+        def load_index():
+            return template_index.TemplateHeaderIndex([
+                {
+                    'id': template.id,
+                    'file_type': template.file_type,
+                    'sheet': template._header_sheet_key(),
+                    'header_offset': template.skip_rows + template.header_row,
+                    'invoice_column': template.column_invoice_number,
+                    'fingerprint': template.header_fingerprint or '',
+                }
+                for template in self.sudo().search([])
+            ])
+
+        return worker_cache.get_cached('template_headers', self.env.cr.dbname, signature, load_index)
+
+    def _header_sheet_key(self):
+        """Hoja cuyo encabezado identifica la plantilla: nombre, índice o ('pattern', expresión)"""
+        if self.sheet_mode == 'all':
+            return 0
+        if self.sheet_mode == 'pattern':
+            return ('pattern', self.sheet_pattern)
+        return self.sheet_name or self.sheet_index
+
+    @api.model
+    def _detect_template(self, file_content, filename):
+        """
+        Detecta la plantilla de un archivo leyendo solo sus filas de encabezado.
+
+        Returns:
+            password.assigner.template: Las plantillas cuyas columnas están todas en el
+                archivo: una si la detección es única, varias si es ambigua, vacío si
+                ninguna coincide
+        """
+        lower_name = (filename or '').lower()
+        if lower_name.endswith('.csv'):
+            file_type = 'csv'
+        elif lower_name.endswith('.xlsx'):
+            file_type = 'excel'
+        else:
+            # .xls no se puede leer con openpyxl sin cargar el archivo completo
+            return self.browse()
+
+        index = self._get_header_index()
+        read_keys = index.read_keys(file_type)
+        if not read_keys:
+            return self.browse()
+
+        try:
+            if file_type == 'csv':
+                headers = self._read_csv_headers(file_content, read_keys)
+            else:
+                headers = self._read_excel_headers(file_content, read_keys)
+        except Exception as e:
+            _logger.warning('Could not read headers of %s for template detection: %s', filename, str(e))
+            return self.browse()
+
+        return self.browse(index.best_matches(headers))
+
+    @api.model
+    def _read_csv_headers(self, file_content, read_keys):
+        """Encabezados normalizados de un CSV para cada clave de lectura"""
+        import pandas as pd
+        import io
+
+        headers = {}
+        for read_key in read_keys:
+            header = pd.read_csv(io.BytesIO(file_content), skiprows=read_key[2], header=0, nrows=0)
+            headers[read_key] = {template_index.normalize_header(column) for column in header.columns}
+        return headers
+
+    @api.model
+    def _read_excel_headers(self, file_content, read_keys):
+        """
+        Encabezados normalizados de un xlsx para cada clave de lectura. El libro se
+        abre una sola vez en modo read_only y de cada hoja se leen solo las filas
+        hasta el encabezado.
+        """
+        import openpyxl
+        import io
+
+        headers = {}
+        workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+        try:
+            for read_key in read_keys:
+                _file_type, sheet, header_offset = read_key
+                if isinstance(sheet, tuple):
+                    # Primera hoja cuyo nombre coincide con la expresión
+                    names = _match_sheet_names(workbook.sheetnames, 'pattern', sheet[1])
+                    if not names:
+                        continue
+                    worksheet = workbook[names[0]]
+                elif isinstance(sheet, str):
+                    if sheet not in workbook.sheetnames:
+                        continue
+                    worksheet = workbook[sheet]
+                elif sheet < len(workbook.worksheets):
+                    worksheet = workbook.worksheets[sheet]
+                else:
+                    continue
+                row = next(worksheet.iter_rows(
+                    min_row=header_offset + 1, max_row=header_offset + 1, values_only=True
+                ), None)
+                if row:
+                    headers[read_key] = {template_index.normalize_header(value) for value in row if value is not None}
+        finally:
+            workbook.close()
+        return headers
 
     def parse_file(self, file_content, filename):
         """
@@ -129,88 +306,361 @@ class PasswordAssignerTemplate(models.Model):
         Returns:
             list: Lista de diccionarios con los datos extraídos
         """
-        self.ensure_one()
-        import pandas as pd
-        import io
+        results = []
+        for parsed in self.iter_file_batches(file_content, filename):
+            results.extend(parsed.to_dict('records'))
+        return results
+
+    def parse_file_grouped(self, file_content, filename):
+        """
+        Parsea un archivo y agrupa las facturas por contraseña, en el orden en que
+        aparece cada contraseña. Las filas sin contraseña forman un grupo con
+        password_number vacío.
+
+        Con varias hojas, cada grupo es una contraseña dentro de una hoja.
+
+        Returns:
+            list: [{'password_number': str, 'sheet': str,
+                    'invoices': [{invoice_number, invoice_series, amount, date}]}]
+        """
+        groups = {}
+        for parsed in self.iter_file_batches(file_content, filename):
+            for (sheet, password), group in parsed.groupby(['sheet', 'password'], sort=False):
+                groups.setdefault((sheet, password), []).extend(group[INVOICE_COLUMNS].to_dict('records'))
+        return [
+            {'password_number': password, 'sheet': sheet, 'invoices': invoices}
+            for (sheet, password), invoices in groups.items()
+        ]
+
+    def iter_file_batches(self, file_content, filename, batch_size=STREAM_BATCH_ROWS):
+        """
+        Parsea el archivo por columnas (sin recorrer filas en Python), por lotes.
 
+        Los archivos desde stream_threshold_kb se leen en lotes de batch_size filas
+        y solo con las columnas configuradas; los demás en un solo lote. La contraseña
+        se arrastra de un lote al siguiente dentro de cada hoja.
+
+        Yields:
+            DataFrame: Columnas password, invoice_number, invoice_series, amount, date,
+                       row_index y sheet (vacía en modo de una hoja), solo para las filas
+                       con número de factura
+        """
+        self.ensure_one()
+        total = 0
         try:
-            if self.file_type == 'excel':
-                # Determinar sheet
-                sheet = self.sheet_name if self.sheet_name else self.sheet_index
-
-                df = pd.read_excel(
-                    io.BytesIO(file_content),
-                    sheet_name=sheet,
-                    skiprows=self.skip_rows,
-                    header=self.header_row,
-                    engine='openpyxl'
-                )
-            elif self.file_type == 'csv':
-                df = pd.read_csv(
-                    io.BytesIO(file_content),
-                    skiprows=self.skip_rows,
-                    header=self.header_row
-                )
-            else:
-                raise ValidationError(_('Tipo de archivo no soportado: %s') % self.file_type)
-
-            # Validar columnas requeridas
-            if self.column_invoice_number not in df.columns:
-                available_cols = ', '.join(df.columns.tolist())
-                raise ValidationError(
-                    _('Columna "%s" no encontrada. Columnas disponibles: %s') %
-                    (self.column_invoice_number, available_cols)
-                )
-
-            results = []
-            current_password = None
-
-            for idx, row in df.iterrows():
-                invoice_number = str(row.get(self.column_invoice_number, '')).strip()
-                if not invoice_number or invoice_number == 'nan':
-                    continue
+            password_carry = ''
+            current_sheet = None
+            for sheet, df in self._iter_frames(file_content, batch_size):
+                if sheet != current_sheet:
+                    # Cada hoja empieza sin contraseña arrastrada
+                    password_carry = ''
+                    current_sheet = sheet
+                parsed, password_carry = self._transform_dataframe(df, password_carry)
+                parsed['sheet'] = sheet or ''
+                total += len(parsed)
+                yield parsed
 
-                # Obtener contraseña
-                if self.column_password and self.column_password in df.columns:
-                    password_val = row.get(self.column_password, '')
-                    if password_val and str(password_val) != 'nan':
-                        current_password = str(password_val).strip()
-
-                # Obtener serie
-                invoice_series = ''
-                if self.column_invoice_series and self.column_invoice_series in df.columns:
-                    series_val = row.get(self.column_invoice_series, '')
-                    if series_val and str(series_val) != 'nan':
-                        invoice_series = str(series_val).strip()
-
-                # Obtener monto
-                amount = 0.0
-                if self.column_amount and self.column_amount in df.columns:
-                    amount_val = row.get(self.column_amount, 0)
-                    try:
-                        amount = float(amount_val) if amount_val and str(amount_val) != 'nan' else 0.0
-                    except (ValueError, TypeError):
-                        amount = 0.0
-
-                # Obtener fecha
-                date_val = ''
-                if self.column_date and self.column_date in df.columns:
-                    date_raw = row.get(self.column_date, '')
-                    if date_raw and str(date_raw) != 'nan':
-                        date_val = str(date_raw)
-
-                results.append({
-                    'password': current_password or '',
-                    'invoice_number': invoice_number,
-                    'invoice_series': invoice_series,
-                    'amount': amount,
-                    'date': date_val,
-                    'row_index': idx,
-                })
-
-            _logger.info('Template %s parsed %d rows from %s', self.name, len(results), filename)
-            return results
+            _logger.info('Template %s parsed %d rows from %s', self.name, total, filename)
 
         except Exception as e:
             _logger.error('Error parsing file %s with template %s: %s', filename, self.name, str(e))
             raise ValidationError(_('Error al procesar el archivo: %s') % str(e))
+
+    def _iter_frames(self, file_content, batch_size):
+        """
+        Lotes a parsear según el modo de hojas y el tamaño del archivo.
+
+        Yields:
+            tuple: (nombre de la hoja o None en modo de una hoja, DataFrame)
+        """
+        streaming = self._use_streaming(file_content)
+        if self.file_type == 'excel' and self.sheet_mode != 'single':
+            if streaming:
+                yield from self._iter_workbook_frames(file_content, batch_size)
+            else:
+                yield from self._read_workbook_dataframes(file_content)
+            return
+
+        if streaming:
+            frames = self._iter_csv_frames(file_content, batch_size) if self.file_type == 'csv' \
+                else self._iter_excel_frames(file_content, batch_size)
+        else:
+            frames = [self._read_dataframe(file_content)]
+        for df in frames:
+            yield None, df
+
+    def _select_sheets(self, sheet_names):
+        """Hojas a leer en modo de varias hojas; error si ninguna coincide"""
+        names = _match_sheet_names(sheet_names, self.sheet_mode, self.sheet_pattern)
+        if not names:
+            raise ValidationError(
+                _('Ninguna hoja coincide con "%s". Hojas disponibles: %s') %
+                (self.sheet_pattern or '', ', '.join(sheet_names))
+            )
+        return names
+
+    def _skip_sheet(self, sheet, columns, skipped):
+        """
+        True si una hoja no tiene la columna de factura (portadas, resúmenes): las
+        hojas seleccionadas por expresión o todas las hojas pueden incluirlas. La
+        hoja omitida se agrega a skipped.
+        """
+        if self.column_invoice_number in columns:
+            return False
+        _logger.info('Template %s skipped sheet %s: column %s not found',
+                     self.name, sheet, self.column_invoice_number)
+        skipped.append(sheet)
+        return True
+
+    def _check_skipped_sheets(self, sheets, skipped):
+        if len(skipped) == len(sheets):
+            raise ValidationError(
+                _('Ninguna hoja tiene la columna "%s". Hojas revisadas: %s') %
+                (self.column_invoice_number, ', '.join(sheets))
+            )
+
+    def _read_workbook_dataframes(self, file_content):
+        """
+        Lee las hojas seleccionadas de un libro abierto una sola vez.
+
+        Yields:
+            tuple: (nombre de la hoja, DataFrame)
+        """
+        import pandas as pd
+        import io
+
+        with pd.ExcelFile(io.BytesIO(file_content), engine='openpyxl') as workbook:
+            sheets = self._select_sheets(workbook.sheet_names)
+            skipped = []
+            for sheet in sheets:
+                df = workbook.parse(sheet, skiprows=self.skip_rows, header=self.header_row)
+                if self._skip_sheet(sheet, df.columns, skipped):
+                    continue
+                yield sheet, df
+        self._check_skipped_sheets(sheets, skipped)
+
+    def _iter_workbook_frames(self, file_content, batch_size):
+        """
+        Lee las hojas seleccionadas en lotes de filas, con el libro abierto una sola
+        vez en modo read_only.
+
+        Yields:
+            tuple: (nombre de la hoja, DataFrame)
+        """
+        import openpyxl
+        import io
+
+        workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+        try:
+            sheets = self._select_sheets(workbook.sheetnames)
+            skipped = []
+            for sheet in sheets:
+                for df in self._iter_worksheet_frames(workbook[sheet], batch_size, skipped=skipped):
+                    yield sheet, df
+        finally:
+            workbook.close()
+        self._check_skipped_sheets(sheets, skipped)
+
+    def _use_streaming(self, file_content):
+        """True si el archivo debe leerse por lotes (xlsx o csv desde stream_threshold_kb)"""
+        return bool(self.stream_threshold_kb) and len(file_content) >= self.stream_threshold_kb * 1024
+
+    def _configured_columns(self):
+        """Columnas del archivo que usa la plantilla"""
+        return [
+            column for column in (
+                self.column_password,
+                self.column_invoice_number,
+                self.column_invoice_series,
+                self.column_amount,
+                self.column_date,
+            ) if column
+        ]
+
+    def _check_invoice_column(self, columns):
+        # Validar columnas requeridas
+        if self.column_invoice_number not in columns:
+            available_cols = ', '.join(str(col) for col in columns)
+            raise ValidationError(
+                _('Columna "%s" no encontrada. Columnas disponibles: %s') %
+                (self.column_invoice_number, available_cols)
+            )
+
+    def _read_dataframe(self, file_content):
+        """Lee el archivo completo según el tipo, las filas a saltar y la hoja de la plantilla"""
+        import pandas as pd
+        import io
+
+        if self.file_type == 'excel':
+            # Determinar sheet
+            sheet = self.sheet_name if self.sheet_name else self.sheet_index
+
+            return pd.read_excel(
+                io.BytesIO(file_content),
+                sheet_name=sheet,
+                skiprows=self.skip_rows,
+                header=self.header_row,
+                engine='openpyxl'
+            )
+        if self.file_type == 'csv':
+            return pd.read_csv(
+                io.BytesIO(file_content),
+                skiprows=self.skip_rows,
+                header=self.header_row
+            )
+        raise ValidationError(_('Tipo de archivo no soportado: %s') % self.file_type)
+
+    def _iter_csv_frames(self, file_content, batch_size):
+        """Lee un CSV en lotes de filas, solo con las columnas configuradas"""
+        import pandas as pd
+        import io
+
+        header = pd.read_csv(io.BytesIO(file_content), skiprows=self.skip_rows, header=self.header_row, nrows=0)
+        self._check_invoice_column(header.columns)
+        wanted = set(self._configured_columns())
+        usecols = [column for column in header.columns if column in wanted]
+
+        yield from pd.read_csv(
+            io.BytesIO(file_content),
+            skiprows=self.skip_rows,
+            header=self.header_row,
+            usecols=usecols,
+            chunksize=batch_size,
+        )
+
+    def _iter_excel_frames(self, file_content, batch_size):
+        """
+        Lee una hoja de Excel en lotes de filas con openpyxl en modo read_only,
+        solo con las columnas configuradas. El índice de cada lote sigue la
+        numeración de filas de datos de pandas.read_excel.
+        """
+        import openpyxl
+        import io
+
+        workbook = openpyxl.load_workbook(io.BytesIO(file_content), read_only=True, data_only=True)
+        try:
+            sheet = workbook[self.sheet_name] if self.sheet_name else workbook.worksheets[self.sheet_index]
+            yield from self._iter_worksheet_frames(sheet, batch_size)
+        finally:
+            workbook.close()
+
+    def _iter_worksheet_frames(self, worksheet, batch_size, skipped=None):
+        """
+        Lotes de filas de una hoja de openpyxl, solo con las columnas configuradas.
+
+        Args:
+            skipped: Si se indica, la hoja sin columna de factura se omite (sin lotes)
+                     y se agrega a esta lista en lugar de dar error
+        """
+        import pandas as pd
+
+        rows = itertools.islice(worksheet.iter_rows(values_only=True), self.skip_rows + self.header_row, None)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = [str(value) if value is not None else f'Unnamed: {index}' for index, value in enumerate(header)]
+        if skipped is not None and self._skip_sheet(worksheet.title, names, skipped):
+            return
+        self._check_invoice_column(names)
+
+        wanted = set(self._configured_columns())
+        positions = [index for index, name in enumerate(names) if name in wanted]
+        columns = [names[index] for index in positions]
+
+        start = 0
+        while True:
+            batch = [
+                tuple(row[index] if index < len(row) else None for index in positions)
+                for row in itertools.islice(rows, batch_size)
+            ]
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=columns, index=range(start, start + len(batch)))
+            start += len(batch)
+
+    def _transform_dataframe(self, df, password_carry=''):
+        """
+        Convierte las columnas leídas al formato de parse_file.
+
+        Args:
+            password_carry: Contraseña vigente al final del lote anterior
+
+        Returns:
+            tuple: (DataFrame parseado, contraseña vigente al final de este lote)
+        """
+        import pandas as pd
+
+        self._check_invoice_column(df.columns)
+        parsed = pd.DataFrame(index=df.index)
+
+        invoice_column = df[self.column_invoice_number]
+        invoice_number = _cell_text(invoice_column.where(invoice_column.notna(), '')).str.strip()
+        has_invoice = (invoice_number != '') & (invoice_number != 'nan')
+
+        # La contraseña se arrastra a las filas siguientes hasta la próxima
+        # celda con valor (grupos de varias filas por contraseña); las filas sin
+        # número de factura se omiten y su contraseña no se arrastra
+        if self.column_password and self.column_password in df.columns:
+            password = _clean_text(df[self.column_password])
+            password = password.where((password != '') & has_invoice).ffill().fillna(password_carry)
+            if len(password):
+                password_carry = password.iloc[-1]
+            parsed['password'] = password
+        else:
+            parsed['password'] = ''
+
+        parsed['invoice_number'] = invoice_number
+
+        if self.column_invoice_series and self.column_invoice_series in df.columns:
+            parsed['invoice_series'] = _clean_text(df[self.column_invoice_series])
+        else:
+            parsed['invoice_series'] = ''
+
+        if self.column_amount and self.column_amount in df.columns:
+            parsed['amount'] = pd.to_numeric(df[self.column_amount], errors='coerce').fillna(0.0).astype(float)
+        else:
+            parsed['amount'] = 0.0
+
+        if self.column_date and self.column_date in df.columns:
+            parsed['date'] = _date_text(df[self.column_date])
+        else:
+            parsed['date'] = ''
+
+        parsed['row_index'] = df.index
+        parsed = parsed[has_invoice]
+        return parsed, password_carry
+
+
+def _match_sheet_names(sheet_names, mode, pattern):
+    """Nombres de hoja a leer en modo 'all' o 'pattern', en el orden del libro"""
+    if mode == 'all':
+        return list(sheet_names)
+    sheet_re = re.compile(pattern or '', re.IGNORECASE)
+    return [name for name in sheet_names if sheet_re.search(name)]
+
+
+def _clean_text(series):
+    """Texto sin espacios de una columna; vacío para celdas vacías (NaN) o falsas"""
+    valid = series.notna() & series.astype(bool)
+    return _cell_text(series.where(valid, '')).str.strip()
+
+
+def _cell_text(series):
+    """
+    Texto de cada celda. Los floats enteros se escriben sin '.0': pandas lee como
+    float las columnas numéricas con celdas vacías (12345 -> 12345.0) y openpyxl
+    entrega int, y ambas lecturas deben dar el mismo número de factura.
+    """
+    return series.map(
+        lambda value: str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+    )
+
+
+def _date_text(series):
+    """Fecha como texto; las columnas datetime usan str() de cada Timestamp"""
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.map(str).where(series.notna(), '')
+    valid = series.notna() & series.astype(bool)
+    return series.where(valid, '').astype(str)
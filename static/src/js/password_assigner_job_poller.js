@@ -0,0 +1,50 @@
+/** @odoo-module */
+import { Component, onMounted, onWillUnmount } from "@odoo/owl";
+import { registry } from "@web/core/registry";
+import { useService } from "@web/core/utils/hooks";
+import { standardWidgetProps } from "@web/views/widgets/standard_widget_props";
+
+// Intervalo entre consultas de los trabajos en segundo plano (ms)
+const POLL_INTERVAL = 5000;
+
+/**
+ * Mientras el wizard está en proceso, consulta periódicamente los trabajos en
+ * segundo plano: los documentos terminados se cargan al preview y el formulario
+ * se recarga sin que el usuario tenga que pulsar "Actualizar".
+ */
+export class PasswordAssignerJobPoller extends Component {
+    static template = "adroc_password_assigner.JobPoller";
+    static props = { ...standardWidgetProps };
+
+    setup() {
+        this.orm = useService("orm");
+        this.polling = false;
+        onMounted(() => {
+            this.interval = setInterval(() => this.poll(), POLL_INTERVAL);
+        });
+        onWillUnmount(() => clearInterval(this.interval));
+    }
+
+    async poll() {
+        const record = this.props.record;
+        if (this.polling || !record.resId || record.data.state !== "processing") {
+            return;
+        }
+        // No descartar cambios sin guardar en las líneas del preview
+        if (await record.isDirty()) {
+            return;
+        }
+        this.polling = true;
+        try {
+            // Recargar siempre: también cambia el estado de los trabajos en curso
+            await this.orm.call(record.resModel, "action_poll_jobs", [[record.resId]]);
+            await record.load();
+        } finally {
+            this.polling = false;
+        }
+    }
+}
+
+registry.category("view_widgets").add("password_assigner_job_poller", {
+    component: PasswordAssignerJobPoller,
+});
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from . import candidate_index
+from . import cpu_pool
+from . import image_preprocess
+from . import invoice_keys
+from . import issuer_profiles
+from . import openai_client
+from . import pdf_document
+from . import pdf_tasks
+from . import rate_limit
+from . import template_index
+from . import worker_cache
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Índice en memoria de facturas candidatas para el match de contraseñas.
+
+Las facturas candidatas son las facturas de cliente publicadas y sin contraseña.
+El índice se construye una vez y permite buscar números de factura por igualdad,
+prefijo o subcadena sin consultar la base de datos por cada número.
+"""
+import bisect
+from array import array
+
+NGRAM_SIZE = 3
+
+
+def _ngrams(value):
+    return {value[i:i + NGRAM_SIZE] for i in range(len(value) - NGRAM_SIZE + 1)}
+
+
+class InvoiceCandidateIndex:
+    """
+    Índice de n-gramas sobre invoice_number, name y ref de las facturas candidatas.
+
+    Las búsquedas no distinguen mayúsculas (igual que ilike) y devuelven los ids
+    en el orden en que se cargaron las facturas.
+    """
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows: Iterable de tuplas (move_id, invoice_number, name, ref),
+                  ordenadas como account.move.search
+        """
+        self._rank = {}
+        self._values = []
+        self._value_moves = array('i')
+        self._exact = {}
+        postings = {}
+
+        for move_id, *fields_values in rows:
+            self._rank.setdefault(move_id, len(self._rank))
+            for raw in fields_values:
+                if not raw:
+                    continue
+                value = raw.lower()
+                value_id = len(self._values)
+                self._values.append(value)
+                self._value_moves.append(move_id)
+                self._exact.setdefault(value, []).append(move_id)
+                for gram in _ngrams(value):
+                    postings.setdefault(gram, []).append(value_id)
+
+        self._postings = {gram: array('i', ids) for gram, ids in postings.items()}
+        self._sorted_values = sorted(range(len(self._values)), key=self._values.__getitem__)
+        self._sorted_keys = [self._values[value_id] for value_id in self._sorted_values]
+
+    def __len__(self):
+        return len(self._rank)
+
+    def _sorted_moves(self, move_ids, limit=None):
+        moves = sorted(set(move_ids), key=self._rank.__getitem__)
+        return moves[:limit] if limit else moves
+
+    def exact(self, term, limit=None):
+        """Facturas con algún campo igual al término"""
+        return self._sorted_moves(self._exact.get(term.lower(), []), limit)
+
+    def prefix(self, term, limit=None):
+        """Facturas con algún campo que empieza con el término"""
+        term = term.lower()
+        start = bisect.bisect_left(self._sorted_keys, term)
+        move_ids = []
+        for pos in range(start, len(self._sorted_keys)):
+            if not self._sorted_keys[pos].startswith(term):
+                break
+            move_ids.append(self._value_moves[self._sorted_values[pos]])
+        return self._sorted_moves(move_ids, limit)
+
+    def contains(self, term, limit=None):
+        """Facturas con algún campo que contiene el término (equivalente a ilike)"""
+        term = term.lower()
+        if len(term) < NGRAM_SIZE:
+            candidates = range(len(self._values))
+        else:
+            # Verificar solo los valores del n-grama menos frecuente del término
+            candidates = array('i')
+            for gram in _ngrams(term):
+                posting = self._postings.get(gram)
+                if posting is None:
+                    return []
+                if not candidates or len(posting) < len(candidates):
+                    candidates = posting
+        move_ids = [
+            self._value_moves[value_id]
+            for value_id in candidates
+            if term in self._values[value_id]
+        ]
+        return self._sorted_moves(move_ids, limit)
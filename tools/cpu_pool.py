@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de procesos para el trabajo de CPU de los PDFs (tablas y rasterizado).
+
+Las etapas por página de pdfplumber y Pillow son CPU pura: en el hilo del worker
+compiten por el GIL y cuentan para limit_time_cpu. El pool se crea al primer uso
+en cada worker, se comparte entre los hilos del worker y se cierra al terminar el
+proceso. Las tareas reciben bytes y devuelven solo tipos simples (picklables);
+nunca usan el cursor ni el ORM.
+
+Los procesos se crean con forkserver (o spawn) y no con fork: el pool suele crearse
+desde un hilo de extracción, y un fork heredaría locks tomados por otros hilos, los
+sockets de la base de datos y el límite de CPU del worker. Como los procesos nuevos
+no tienen el addons path de Odoo, las tareas se importan desde este directorio como
+el paquete TASKS_PACKAGE (ver task()); sus módulos no pueden depender de Odoo.
+"""
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import runpy
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+MAX_CPU_WORKERS = 16
+
+# Nombre con el que los procesos del pool importan los módulos de tools
+TASKS_PACKAGE = 'adroc_password_assigner_cpu_tasks'
+# run_name con el que cada proceso del pool ejecuta este archivo al iniciar
+_WORKER_RUN_NAME = '__password_assigner_cpu_worker__'
+
+# Pool del proceso actual: (pid, max_workers, executor)
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_executor(max_workers):
+    """
+    Pool de procesos del worker con max_workers procesos, o None si max_workers es 0.
+    """
+    global _POOL
+    max_workers = min(max_workers or 0, MAX_CPU_WORKERS)
+    if max_workers < 1:
+        return None
+
+    with _POOL_LOCK:
+        pid = os.getpid()
+        if _POOL and _POOL[0] == pid and _POOL[1] == max_workers and not _is_broken(_POOL[2]):
+            return _POOL[2]
+        if _POOL and _POOL[0] == pid:
+            # Cambió el tamaño configurado o el pool quedó roto: reemplazarlo
+            _POOL[2].shutdown(wait=False, cancel_futures=True)
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=_get_context(),
+            initializer=runpy.run_path,
+            initargs=(__file__, None, _WORKER_RUN_NAME),
+        )
+        _POOL = (pid, max_workers, executor)
+        _logger.info('CPU process pool started with %d workers (pid %d)', max_workers, pid)
+        return executor
+
+
+def task(module_name, function_name):
+    """
+    Función de tools.<module_name> importada desde TASKS_PACKAGE, para enviarla al
+    pool: se serializa por nombre y los procesos del pool la importan sin Odoo.
+    """
+    _register_tasks_package()
+    module = importlib.import_module(f'{TASKS_PACKAGE}.{module_name}')
+    return getattr(module, function_name)
+
+
+def _register_tasks_package():
+    """Registra este directorio como el paquete TASKS_PACKAGE (sin su __init__)"""
+    if TASKS_PACKAGE not in sys.modules:
+        package = types.ModuleType(TASKS_PACKAGE)
+        package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[TASKS_PACKAGE] = package
+
+
+def _get_context():
+    """forkserver donde existe (sin precargar el __main__ del servidor), si no spawn"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _init_worker():
+    """Inicialización de cada proceso del pool"""
+    _register_tasks_package()
+    try:
+        import resource
+    except ImportError:
+        return
+    # El límite de CPU del worker de Odoo (limit_time_cpu) no aplica al pool
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _is_broken(executor):
+    return getattr(executor, '_broken', False)
+
+
+@atexit.register
+def shutdown():
+    """Cierra el pool del proceso actual (al reciclar el worker)"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL and _POOL[0] == os.getpid():
+            _POOL[2].shutdown(wait=True, cancel_futures=True)
+        _POOL = None
+
+
+def split_range(first, last, parts):
+    """Divide first..last (inclusive) en hasta `parts` rangos contiguos"""
+    count = last - first + 1
+    parts = max(min(parts, count), 1)
+    size, extra = divmod(count, parts)
+    ranges = []
+    start = first
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+if __name__ == _WORKER_RUN_NAME:
+    _init_worker()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Preprocesamiento de imágenes antes de enviarlas al modelo de visión.
+
+Las fotos de teléfono y los escaneos llegan con resoluciones y formatos que
+cuestan miles de tokens sin mejorar la lectura. Cada imagen se orienta según
+su EXIF, se pasa a escala de grises, se recortan los bordes vacíos, se reduce
+a la resolución máxima de la configuración y se recodifica como JPEG.
+"""
+import base64
+import io
+import logging
+
+from .rate_limit import estimate_image_tokens
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+JPEG_QUALITY = 70
+# Diferencia con el color de fondo a partir de la cual un pixel se considera contenido
+CROP_THRESHOLD = 24
+# Margen que se conserva alrededor del contenido recortado
+CROP_MARGIN = 12
+# Con detalle "auto", imágenes que caben en un solo tile se envían en detalle bajo
+LOW_DETAIL_MAX_SIDE = 512
+
+
+def _crop_borders(img):
+    """Recorta bordes y márgenes del color de la esquina superior izquierda"""
+    gray = img if img.mode == 'L' else img.convert('L')
+    background = gray.getpixel((0, 0))
+    mask = gray.point(lambda value: 255 if abs(value - background) > CROP_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    bbox = (
+        max(left - CROP_MARGIN, 0),
+        max(top - CROP_MARGIN, 0),
+        min(right + CROP_MARGIN, img.width),
+        min(bottom + CROP_MARGIN, img.height),
+    )
+    if bbox == (0, 0, img.width, img.height):
+        return img
+    return img.crop(bbox)
+
+
+def choose_detail(width, height, detail='auto'):
+    """Nivel de detalle para la imagen ('low' o 'high')"""
+    if detail in ('low', 'high'):
+        return detail
+    return 'low' if max(width, height) <= LOW_DETAIL_MAX_SIDE else 'high'
+
+
+def preprocess_image(img, max_side=1600, grayscale=True, crop=True, detail='auto'):
+    """
+    Prepara una imagen PIL para la API de visión.
+
+    Args:
+        img: Imagen PIL (no se modifica)
+        max_side: Lado mayor máximo en pixeles
+        grayscale: Convertir a escala de grises
+        crop: Recortar bordes vacíos
+        detail: 'auto', 'low' o 'high'
+
+    Returns:
+        dict: base64, mime, detail, width, height, bytes, tokens_before y tokens_after
+    """
+    tokens_before = estimate_image_tokens(img.width, img.height)
+
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('L') if grayscale else img.convert('RGB')
+    if crop:
+        img = _crop_borders(img)
+    if max(img.width, img.height) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    detail = choose_detail(img.width, img.height, detail)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    data = buffer.getvalue()
+
+    return {
+        'base64': base64.b64encode(data).decode('utf-8'),
+        'mime': 'image/jpeg',
+        'detail': detail,
+        'width': img.width,
+        'height': img.height,
+        'bytes': len(data),
+        'tokens_before': tokens_before,
+        'tokens_after': estimate_image_tokens(img.width, img.height, detail),
+    }
+
+
+def preprocess_image_bytes(content, **options):
+    """
+    preprocess_image para el contenido de un archivo de imagen.
+
+    Returns:
+        dict: Como preprocess_image, más bytes_before (tamaño original)
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        img.load()
+        result = preprocess_image(img, **options)
+    result['bytes_before'] = len(content)
+    return result
+
+
+def format_preprocess_stats(images):
+    """Línea de log con el resumen de las imágenes preprocesadas"""
+    bytes_after = sum(image['bytes'] for image in images)
+    tokens_before = sum(image['tokens_before'] for image in images)
+    tokens_after = sum(image['tokens_after'] for image in images)
+    details = sorted({image['detail'] for image in images})
+
+    size = f"{bytes_after / 1024:.0f} KB"
+    if all(image.get('bytes_before') for image in images):
+        bytes_before = sum(image['bytes_before'] for image in images)
+        size = f"{bytes_before / 1024:.0f} KB -> {size}"
+
+    return (
+        f"Imágenes preprocesadas: {len(images)}, {size}, "
+        f"~{tokens_before} -> ~{tokens_after} tokens "
+        f"({tokens_before - tokens_after} ahorrados, detalle {'/'.join(details)})"
+    )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Normalización de números de factura para el match por igualdad.
+
+Los números extraídos llegan en formatos distintos (TK00023243, 0098,
+FP-MEG-202512-0002, ...). La clave normalizada deja solo letras y dígitos
+en mayúsculas y sin ceros a la izquierda; la cola numérica es el último grupo
+de dígitos, también sin ceros a la izquierda.
+
+Las expresiones SQL equivalentes se usan para llenar las columnas almacenadas,
+por lo que ambas versiones deben mantenerse sincronizadas.
+"""
+import re
+
+_NON_ALNUM_RE = re.compile(r'[^A-Za-z0-9]')
+_NUMERIC_TAIL_RE = re.compile(r'([0-9]+)[^0-9]*$')
+_DIGITS_RE = re.compile(r'^[0-9]+$')
+
+
+def normalize_invoice_key(value):
+    """'fp-meg-202512-0002' -> 'FPMEG2025120002', '0098' -> '98'"""
+    if not value:
+        return ''
+    return _NON_ALNUM_RE.sub('', value).upper().lstrip('0')
+
+
+def invoice_numeric_tail(value):
+    """'TK00023243' -> '23243', 'FP-MEG-202512-0002' -> '2'"""
+    if not value:
+        return ''
+    match = _NUMERIC_TAIL_RE.search(value)
+    return match.group(1).lstrip('0') if match else ''
+
+
+def is_numeric_key(value):
+    """True si el número extraído solo tiene dígitos (ignorando separadores)"""
+    return bool(_DIGITS_RE.match(_NON_ALNUM_RE.sub('', value or '')))
+
+
+def sql_invoice_key(expression):
+    """Expresión SQL equivalente a normalize_invoice_key"""
+    return f"NULLIF(LTRIM(UPPER(REGEXP_REPLACE({expression}, '[^A-Za-z0-9]', '', 'g')), '0'), '')"
+
+
+def sql_invoice_numeric_tail(expression):
+    """Expresión SQL equivalente a invoice_numeric_tail"""
+    return f"NULLIF(LTRIM(SUBSTRING({expression} FROM '([0-9]+)[^0-9]*$'), '0'), '')"
+
+
+# Tokens más cortos no identifican una factura
+MIN_TOKEN_LENGTH = 3
+
+
+def description_tokens(text):
+    """
+    Tokens normalizados de una descripción de línea de factura.
+
+    Incluye cada palabra (separada por espacios), cada grupo de letras y dígitos
+    y cada grupo de dígitos, todos normalizados con normalize_invoice_key.
+    Ej: 'Poliza POLTT2483374605 TK-00023243' ->
+        {'POLIZA', 'POLTT2483374605', '2483374605', 'TK00023243', '23243'}
+    """
+    tokens = set()
+    for word in (text or '').split():
+        tokens.add(normalize_invoice_key(word))
+        for run in _NON_ALNUM_RE.split(word):
+            tokens.add(normalize_invoice_key(run))
+            for digits in re.findall(r'[0-9]+', run):
+                tokens.add(digits.lstrip('0'))
+    return {token for token in tokens if len(token) >= MIN_TOKEN_LENGTH}
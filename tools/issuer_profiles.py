@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Perfiles de formato por emisor (password.assigner.issuer.profile).
+
+Un perfil describe el PDF de contraseñas de un emisor recurrente: una huella del
+encabezado que lo identifica, la expresión de la contraseña y la posición de las
+columnas de la tabla de facturas. Un documento que coincide con un perfil se lee
+con pdfplumber sin llamar a OpenAI.
+
+Los perfiles se compilan una vez por worker (tools.worker_cache).
+"""
+import re
+
+from .invoice_keys import normalize_invoice_key
+
+# Líneas del inicio de la primera página donde se busca la huella del encabezado
+HEADER_LINES = 15
+# Número de factura por defecto: alfanumérico con al menos un dígito
+DEFAULT_INVOICE_PATTERN = r'[A-Za-z0-9-]*\d[A-Za-z0-9-]*'
+NUMERIC_INVOICE_PATTERN = r'\d+'
+# Fracción mínima de las facturas revisadas que debe encontrarse en una columna
+MIN_COLUMN_COVERAGE = 0.5
+# Palabras de la etiqueta que precede a la contraseña que se incluyen en la expresión
+PASSWORD_LABEL_WORDS = 2
+
+
+def compile_profile(values):
+    """
+    Compila las expresiones de un perfil.
+
+    Args:
+        values: dict con id, name, header_fingerprint, password_regex, invoice_regex,
+                invoice_column, series_column, amount_column, crop_box,
+                table_strategy y currency
+
+    Returns:
+        dict: Los mismos valores con header_re, password_re e invoice_re compiladas,
+              columnas en base 0 (None si no se usan) y crop_box como tupla
+    """
+    profile = dict(values)
+    profile['header_re'] = re.compile(values['header_fingerprint'], re.IGNORECASE)
+    profile['password_re'] = re.compile(values['password_regex'], re.IGNORECASE)
+    profile['invoice_re'] = re.compile(values.get('invoice_regex') or DEFAULT_INVOICE_PATTERN)
+    for column in ('invoice_column', 'series_column', 'amount_column'):
+        profile[column] = values[column] - 1 if values.get(column) else None
+    profile['crop_box'] = parse_crop_box(values.get('crop_box'))
+    return profile
+
+
+def parse_crop_box(value):
+    """Convierte "x0,top,x1,bottom" (puntos) en tupla de floats, o None si está vacío"""
+    if not value or not value.strip():
+        return None
+    parts = [float(part) for part in value.replace(';', ',').split(',')]
+    if len(parts) != 4 or parts[0] >= parts[2] or parts[1] >= parts[3]:
+        raise ValueError(value)
+    return tuple(parts)
+
+
+def header_text(pdf_document):
+    """Primeras líneas de la primera página, donde se busca la huella del emisor"""
+    lines = [line for line in pdf_document.page_text(0).splitlines() if line.strip()]
+    return '\n'.join(lines[:HEADER_LINES])
+
+
+def find_profile(profiles, pdf_document):
+    """Primer perfil cuya huella aparece en el encabezado del documento, o None"""
+    if not profiles:
+        return None
+    header = header_text(pdf_document)
+    for profile in profiles:
+        if profile['header_re'].search(header):
+            return profile
+    return None
+
+
+def parse_amount(value):
+    """Monto de una celda: "Q 1,606.58" -> 1606.58 (0.0 si no es un número)"""
+    cleaned = re.sub(r'[^\d.,]', '', str(value or '')).replace(',', '')
+    try:
+        return float(cleaned) if cleaned else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _cell(row, index):
+    if index is None or index >= len(row):
+        return ''
+    return ' '.join(str(row[index] or '').split())
+
+
+def parse_with_profile(profile, pdf_document):
+    """
+    Lee la contraseña y las facturas de un documento según un perfil.
+
+    Returns:
+        dict: Resultado en el formato de _extract_tables_from_pdf, o None si el
+              perfil no encontró contraseña o facturas
+    """
+    password_number = None
+    invoices = []
+    pages = []
+
+    for index in range(pdf_document.page_count):
+        if not password_number:
+            match = profile['password_re'].search(pdf_document.page_text(index))
+            if match:
+                password_number = (match.group(1) if match.groups() else match.group(0)).strip()
+
+        page_invoices = 0
+        tables = pdf_document.page_tables(index, crop_box=profile['crop_box'], strategy=profile['table_strategy'])
+        for table in tables:
+            for row in table:
+                if not row:
+                    continue
+                invoice_number = _cell(row, profile['invoice_column'])
+                if not invoice_number or not profile['invoice_re'].fullmatch(invoice_number):
+                    continue
+                invoices.append({
+                    'invoice_number': invoice_number,
+                    'invoice_series': _cell(row, profile['series_column']) or None,
+                    'amount': parse_amount(_cell(row, profile['amount_column'])),
+                    'currency': profile.get('currency') or 'Q',
+                    'date': None,
+                })
+                page_invoices += 1
+        if page_invoices:
+            pages.append(index + 1)
+
+    if not password_number or not invoices:
+        return None
+
+    return {
+        'password_number': password_number,
+        'issuer_name': profile['name'],
+        'page_numbers': pages,
+        'invoices': invoices,
+        'source': 'issuer_profile',
+        'confidence': 99,
+    }
+
+
+def _value_pattern(value, generalize=True):
+    """
+    Expresión para un valor de ejemplo con separadores flexibles ("DIS-5994" también
+    encuentra "DIS - 5994"). Con generalize, letras -> [A-Z]+ y dígitos -> \\d+.
+    """
+    parts = []
+    for chunk in re.findall(r'[A-Za-z]+|\d+|[\s-]+|.', value.strip()):
+        if chunk.isalpha():
+            parts.append('[A-Z]+' if generalize else re.escape(chunk))
+        elif chunk.isdigit():
+            parts.append(r'\d+' if generalize else chunk)
+        elif re.fullmatch(r'[\s-]+', chunk):
+            parts.append(r'\s*-?\s*')
+        else:
+            parts.append(re.escape(chunk))
+    return ''.join(parts)
+
+
+def _words_pattern(text):
+    return r'\s+'.join(re.escape(word) for word in text.split())
+
+
+def derive_password_regex(pdf_document, password_number):
+    """
+    Expresión para la contraseña a partir de su valor revisado: la etiqueta que la
+    precede en el documento (p.ej. "No.") seguida del valor generalizado.
+    """
+    value_re = re.compile(_value_pattern(password_number, generalize=False), re.IGNORECASE)
+    for index in range(pdf_document.page_count):
+        for line in pdf_document.page_text(index).splitlines():
+            match = value_re.search(line)
+            if not match:
+                continue
+            label = ' '.join(line[:match.start()].split()[-PASSWORD_LABEL_WORDS:])
+            if label:
+                return f'{_words_pattern(label)}\\s*({_value_pattern(password_number)})'
+            return f'\\b({_value_pattern(password_number)})\\b'
+    return None
+
+
+def derive_header_fingerprint(pdf_document, issuer_name=None):
+    """Huella del encabezado: el nombre del emisor si aparece, si no la primera línea"""
+    header = header_text(pdf_document)
+    if issuer_name and issuer_name.strip():
+        pattern = _words_pattern(issuer_name)
+        if re.search(pattern, header, re.IGNORECASE):
+            return pattern
+    first_line = next((line.strip() for line in header.splitlines() if line.strip()), '')
+    return _words_pattern(first_line[:60]) if first_line else None
+
+
+def derive_columns(pdf_document, invoices):
+    """
+    Busca en las tablas del documento la columna con más números de factura
+    revisados y, en las mismas filas, la columna con sus montos.
+
+    Args:
+        invoices: Lista de tuplas (número de factura, monto) revisadas
+
+    Returns:
+        dict: invoice_column, amount_column (base 1, 0 = sin columna) y table_strategy,
+              o None si ninguna columna alcanza MIN_COLUMN_COVERAGE
+    """
+    amounts = {normalize_invoice_key(number): amount for number, amount in invoices if number}
+    if not amounts:
+        return None
+
+    best = None
+    for strategy in ('lines', 'text'):
+        invoice_hits = {}
+        amount_hits = {}
+        for index in range(pdf_document.page_count):
+            for table in pdf_document.page_tables(index, strategy=strategy):
+                width = max((len(row) for row in table if row), default=0)
+                for row in table:
+                    if not row:
+                        continue
+                    for column in range(width):
+                        key = normalize_invoice_key(_cell(row, column))
+                        if key not in amounts:
+                            continue
+                        invoice_hits[column] = invoice_hits.get(column, 0) + 1
+                        for amount_column in range(width):
+                            if amount_column != column and amounts[key] and \
+                                    abs(parse_amount(_cell(row, amount_column)) - amounts[key]) < 0.01:
+                                pair = (column, amount_column)
+                                amount_hits[pair] = amount_hits.get(pair, 0) + 1
+        if not invoice_hits:
+            continue
+        column, hits = max(invoice_hits.items(), key=lambda item: item[1])
+        if hits < len(amounts) * MIN_COLUMN_COVERAGE:
+            continue
+        pairs = {pair: count for pair, count in amount_hits.items() if pair[0] == column}
+        amount_column = max(pairs, key=pairs.get)[1] if pairs else None
+        if best is None or hits > best[0]:
+            best = (hits, {
+                'invoice_column': column + 1,
+                'amount_column': amount_column + 1 if amount_column is not None else 0,
+                'table_strategy': strategy,
+            })
+        if hits >= len(amounts):
+            break
+
+    return best[1] if best else None
+
+
+def build_profile_values(pdf_document, password_number, invoices, issuer_name=None):
+    """
+    Valores de un perfil nuevo a partir de una extracción revisada de un documento.
+
+    Args:
+        password_number: Contraseña revisada
+        invoices: Lista de tuplas (número de factura, monto) revisadas
+
+    Returns:
+        dict: Valores para password.assigner.issuer.profile, o None si el documento
+              no permite deducir la huella, la contraseña o las columnas
+    """
+    fingerprint = derive_header_fingerprint(pdf_document, issuer_name)
+    password_regex = derive_password_regex(pdf_document, password_number)
+    columns = derive_columns(pdf_document, invoices)
+    if not fingerprint or not password_regex or not columns:
+        return None
+
+    numbers = [number for number, _amount in invoices if number]
+    invoice_regex = NUMERIC_INVOICE_PATTERN if all(number.strip().isdigit() for number in numbers) \
+        else DEFAULT_INVOICE_PATTERN
+    header = header_text(pdf_document)
+    return dict(
+        columns,
+        name=issuer_name or header.split('\n', 1)[0].strip()[:60],
+        header_fingerprint=fingerprint,
+        password_regex=password_regex,
+        invoice_regex=invoice_regex,
+    )
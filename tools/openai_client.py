@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente mínimo para la Responses API de OpenAI.
+
+No usa el ORM, por lo que puede llamarse desde hilos sin cursor. Los errores se
+reportan con excepciones propias para que el llamador los traduzca a UserError.
+"""
+import contextlib
+import email.utils
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import RateLimitTimeout, estimate_request_tokens
+
+_logger = logging.getLogger(__name__)
+
+# Respuestas que vale la pena reintentar (límite de tasa o falla temporal del servidor)
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Backoff exponencial: base * 2^intento, con jitter completo y tope
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# Tope para esperas pedidas por Retry-After
+RETRY_AFTER_MAX = 60.0
+# Conexiones keep-alive por host y sesión
+POOL_MAXSIZE = 16
+
+# Sesiones HTTP del worker: {(pid, url): requests.Session}
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class OpenAIError(Exception):
+    """Error base del cliente"""
+
+
+class OpenAITimeoutError(OpenAIError):
+    """La API no respondió a tiempo"""
+
+
+class OpenAIConnectionError(OpenAIError):
+    """No se pudo conectar con la API"""
+
+
+class OpenAIResponseError(OpenAIError):
+    """La API respondió con un error"""
+
+
+class OpenAIParseError(OpenAIError):
+    """La respuesta no es JSON válido"""
+
+
+class OpenAIRateLimitError(OpenAIError):
+    """El limitador de tasa local no dio capacidad a tiempo"""
+
+
+def extract_output_text(resp_json):
+    """Obtiene el texto de salida de una respuesta de la Responses API"""
+    content_txt = resp_json.get('output_text')
+    if content_txt:
+        return content_txt
+    for blk in resp_json.get('output', []):
+        for p in blk.get('content', []):
+            if p.get('type') in ('output_text', 'text') and p.get('text'):
+                return p['text']
+    return None
+
+
+def get_session(url):
+    """
+    Sesión HTTP con pool de conexiones keep-alive, compartida por los hilos del worker.
+    Se indexa por pid para no reutilizar sockets heredados de otro proceso.
+    """
+    key = (os.getpid(), url)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SESSIONS[key] = session
+    return session
+
+
+def _retry_after_seconds(response):
+    """Segundos indicados por el encabezado Retry-After (número o fecha HTTP)"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def _backoff_delay(attempt, response=None):
+    """Espera antes del siguiente intento: Retry-After si viene, si no backoff con jitter"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    retry_after = _retry_after_seconds(response)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_AFTER_MAX))
+    return delay
+
+
+def post_json(params, payload):
+    """
+    Envía un payload a la API y retorna la respuesta HTTP.
+
+    Las solicitudes de extracción no tienen efectos secundarios, así que se tratan
+    como idempotentes: los errores de conexión, timeouts y respuestas 429/5xx se
+    reintentan con backoff exponencial (respetando Retry-After).
+
+    Args:
+        params: dict con url, api_key, timeout (lectura), connect_timeout, max_retries,
+                rate_limiter opcional (ver password.assigner.config._get_openai_request_params)
+                y request_slots opcional: semáforo que limita las solicitudes en curso
+                compartido entre hilos
+        payload: dict con el cuerpo de la solicitud
+    """
+    headers = {
+        'Authorization': f"Bearer {params['api_key']}",
+        'Content-Type': 'application/json',
+    }
+    data = json.dumps(payload)
+    timeout = (params.get('connect_timeout') or params['timeout'], params['timeout'])
+    max_retries = params.get('max_retries', 0)
+    session = get_session(params['url'])
+    rate_limiter = params.get('rate_limiter')
+    request_slots = params.get('request_slots')
+    estimated_tokens = estimate_request_tokens(payload) if rate_limiter else 0
+
+    attempt = 0
+    while True:
+        if rate_limiter:
+            try:
+                rate_limiter.acquire(estimated_tokens)
+            except RateLimitTimeout as e:
+                raise OpenAIRateLimitError(str(e)) from e
+        try:
+            with request_slots or contextlib.nullcontext():
+                response = session.post(params['url'], headers=headers, data=data, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            if attempt >= max_retries:
+                if isinstance(e, requests.exceptions.Timeout):
+                    raise OpenAITimeoutError(str(e)) from e
+                raise OpenAIConnectionError(str(e)) from e
+            delay = _backoff_delay(attempt)
+            _logger.warning('OpenAI request failed (%s), retrying in %.1fs (%d/%d)',
+                            str(e), delay, attempt + 1, max_retries)
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                return response
+            delay = _backoff_delay(attempt, response)
+            _logger.warning('OpenAI returned HTTP %s, retrying in %.1fs (%d/%d)',
+                            response.status_code, delay, attempt + 1, max_retries)
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def request_extraction(params, payload):
+    """
+    Llama a la API con un payload de extracción y retorna el JSON extraído.
+
+    Returns:
+        dict o None si la respuesta no trae contenido
+    """
+    response = post_json(params, payload)
+
+    try:
+        if response.status_code != 200:
+            error_msg = response.json().get('error', {}).get('message', response.text)
+            _logger.error('OpenAI API error: %s', error_msg)
+            raise OpenAIResponseError(error_msg)
+
+        content_txt = extract_output_text(response.json())
+        if content_txt:
+            return json.loads(content_txt)
+    except json.JSONDecodeError as e:
+        _logger.error('Error parsing OpenAI response: %s', str(e))
+        raise OpenAIParseError(str(e)) from e
+
+    _logger.warning('No content extracted from OpenAI response')
+    return None
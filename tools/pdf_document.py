@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Análisis de un PDF compartido por todas las etapas de extracción.
+
+El PDF se abre una sola vez con pdfplumber; el texto y las tablas de cada página
+se extraen la primera vez que una etapa los pide y las imágenes de las páginas
+se renderizan solo si alguna etapa las necesita, por ventanas de pocas páginas
+para que la memoria no crezca con el número de páginas del documento.
+"""
+import hashlib
+import io
+import logging
+from collections import deque
+from concurrent.futures import CancelledError
+
+from . import cpu_pool
+from .cpu_pool import split_range
+from .pdf_tasks import extract_pages, render_pages
+
+_logger = logging.getLogger(__name__)
+
+# Dependencias opcionales: sin ellas las etapas que las usan se omiten
+try:
+    import pdfplumber
+except ImportError:
+    pdfplumber = None
+    _logger.warning('pdfplumber not available. Table extraction will use AI only.')
+
+try:
+    from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+except ImportError:
+    convert_from_bytes = pdfinfo_from_bytes = None
+    _logger.warning('pdf2image not available. PDF support will be limited.')
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PDFPLUMBER_AVAILABLE = pdfplumber is not None
+PDF2IMAGE_AVAILABLE = convert_from_bytes is not None
+PIL_AVAILABLE = Image is not None
+
+# Caracteres no blancos por página a partir de los cuales la capa de texto es usable
+MIN_TEXT_CHARS_PER_PAGE = 40
+# Configuración de pdfplumber para cada estrategia de detección de tablas
+TABLE_STRATEGIES = {
+    'lines': None,
+    'text': {'vertical_strategy': 'text', 'horizontal_strategy': 'text'},
+}
+# Clasificación texto/escaneado: páginas analizadas y fracción de la página cubierta
+# por imágenes a partir de la cual una página sin texto se considera escaneada
+CLASSIFY_SAMPLE_PAGES = 5
+SCANNED_MIN_IMAGE_COVERAGE = 0.6
+# Tipos de PDF según classify()
+PDF_KINDS = [
+    ('text', 'Con texto'),
+    ('scanned', 'Escaneado'),
+    ('mixed', 'Mixto'),
+    ('unknown', 'Desconocido'),
+]
+# Páginas rasterizadas por llamada a poppler
+RENDER_WINDOW_PAGES = 4
+# Tareas de tools.pdf_tasks que PdfDocument reparte por rangos de páginas
+TASKS = {
+    'extract_pages': extract_pages,
+    'render_pages': render_pages,
+}
+
+
+class PdfDocument:
+    """
+    Documento PDF analizado.
+
+    Usar como context manager (o llamar close()) para liberar el PDF abierto.
+
+    Con cpu_executor (tools.cpu_pool), el texto y las tablas de todas las páginas
+    (prefetch_pages) y el rasterizado se calculan en el pool de procesos, con a lo
+    sumo cpu_workers tareas en curso.
+    """
+
+    def __init__(self, content, cpu_executor=None, cpu_workers=1):
+        self.content = content
+        self.cpu_executor = cpu_executor
+        self.cpu_workers = max(cpu_workers, 1)
+        self._sha256 = None
+        self._pdf = None
+        self._page_count = None
+        self._page_texts = {}
+        self._page_layout_texts = {}
+        self._page_tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.content).hexdigest()
+        return self._sha256
+
+    @property
+    def pdf(self):
+        """PDF abierto con pdfplumber (None si pdfplumber no está instalado)"""
+        if self._pdf is None and pdfplumber is not None:
+            self._pdf = pdfplumber.open(io.BytesIO(self.content))
+        return self._pdf
+
+    @property
+    def page_count(self):
+        if self._page_count is None:
+            self._page_count = self._read_page_count()
+        return self._page_count
+
+    def _read_page_count(self):
+        try:
+            if self.pdf:
+                return len(self.pdf.pages)
+            if pdfinfo_from_bytes is not None:
+                return pdfinfo_from_bytes(self.content)['Pages']
+        except Exception:
+            _logger.debug('Could not read PDF page count', exc_info=True)
+        return 1
+
+    def page_text(self, index):
+        """Texto de la página (índice desde 0)"""
+        if index not in self._page_texts:
+            self._page_texts[index] = self.pdf.pages[index].extract_text() or ''
+        return self._page_texts[index]
+
+    def page_layout_text(self, index):
+        """Texto de la página conservando la disposición de columnas (índice desde 0)"""
+        if index not in self._page_layout_texts:
+            text = self.pdf.pages[index].extract_text(layout=True) or ''
+            self._page_layout_texts[index] = '\n'.join(line.rstrip() for line in text.splitlines()).strip('\n')
+        return self._page_layout_texts[index]
+
+    def page_words(self, index):
+        """Palabras de la página como tuplas (x0, top, texto), coordenadas en puntos"""
+        return [
+            (round(word['x0']), round(word['top']), word['text'])
+            for word in self.pdf.pages[index].extract_words()
+        ]
+
+    def page_tables(self, index, crop_box=None, strategy='lines'):
+        """
+        Tablas detectadas por pdfplumber en la página (índice desde 0).
+
+        Args:
+            crop_box: Tupla (x0, top, x1, bottom) en puntos para leer solo esa zona
+            strategy: 'lines' (bordes dibujados) o 'text' (columnas alineadas por texto)
+        """
+        key = (index, crop_box, strategy)
+        if key not in self._page_tables:
+            page = self.pdf.pages[index]
+            if crop_box:
+                x0, top, x1, bottom = crop_box
+                page = page.crop((max(x0, 0), max(top, 0), min(x1, page.width), min(bottom, page.height)))
+            self._page_tables[key] = page.extract_tables(TABLE_STRATEGIES[strategy])
+        return self._page_tables[key]
+
+    @property
+    def text_chars_per_page(self):
+        """Densidad de la capa de texto: caracteres no blancos por página"""
+        if not self.pdf:
+            return 0.0
+        total = sum(len(''.join(self.page_text(i).split())) for i in range(self.page_count))
+        return total / max(self.page_count, 1)
+
+    @property
+    def has_text_layer(self):
+        """True si el PDF tiene suficiente texto para enviarlo en lugar del archivo"""
+        try:
+            return bool(self.pdf) and self.text_chars_per_page >= MIN_TEXT_CHARS_PER_PAGE
+        except Exception:
+            _logger.debug('Could not read PDF text layer', exc_info=True)
+            return False
+
+    def classify(self, sample_pages=CLASSIFY_SAMPLE_PAGES):
+        """
+        Clasifica el PDF sin llamar a OpenAI, con las primeras páginas: caracteres
+        de texto por página, fracción de la página cubierta por imágenes y fuentes
+        usadas por el texto.
+
+        Returns:
+            tuple: (tipo, métricas) con tipo 'text', 'scanned', 'mixed' o 'unknown'
+                   y métricas chars_per_page, image_coverage y fonts
+        """
+        try:
+            if not self.pdf:
+                return 'unknown', {}
+            pages = self.pdf.pages[:sample_pages]
+            chars = 0
+            coverage = 0.0
+            fonts = set()
+            for index, page in enumerate(pages):
+                chars += len(''.join(self.page_text(index).split()))
+                fonts.update(char.get('fontname') for char in page.chars)
+                page_area = float(page.width * page.height) or 1.0
+                image_area = sum(
+                    max(image['x1'] - image['x0'], 0) * max(image['bottom'] - image['top'], 0)
+                    for image in page.images
+                )
+                coverage += min(image_area / page_area, 1.0)
+        except Exception:
+            _logger.debug('Could not classify PDF', exc_info=True)
+            return 'unknown', {}
+
+        sampled = max(len(pages), 1)
+        metrics = {
+            'chars_per_page': chars / sampled,
+            'image_coverage': coverage / sampled,
+            'fonts': len(fonts - {None}),
+        }
+        if metrics['chars_per_page'] >= MIN_TEXT_CHARS_PER_PAGE:
+            kind = 'text'
+        elif metrics['image_coverage'] >= SCANNED_MIN_IMAGE_COVERAGE or not metrics['fonts']:
+            kind = 'scanned'
+        else:
+            kind = 'mixed'
+        return kind, metrics
+
+    def iter_page_images(self, first_page=1, last_page=None, window=RENDER_WINDOW_PAGES, image_options=None):
+        """
+        Renderiza las páginas first_page..last_page (desde 1) como JPEG base64.
+
+        Es un generador: poppler rasteriza ventanas de `window` páginas y cada imagen
+        se libera apenas se codifica, de modo que en memoria solo hay una ventana de
+        imágenes (una por proceso del pool) sin importar cuántas páginas tenga el PDF.
+
+        Args:
+            image_options: Opciones de tools.image_preprocess.preprocess_image; si se
+                indican, cada página se preprocesa y el dict incluye detail y estadísticas
+
+        Yields:
+            dict: {'page': n, 'base64': str, 'mime': 'image/jpeg'}
+        """
+        last_page = min(last_page or self.page_count, self.page_count)
+        window = max(window, 1)
+        windows = [
+            (window_first, min(window_first + window - 1, last_page))
+            for window_first in range(first_page, last_page + 1, window)
+        ]
+        for pages in self._map_ranges('render_pages', windows, image_options):
+            yield from pages
+
+    def page_images(self, first_page=1, last_page=None, image_options=None):
+        """
+        Páginas renderizadas como JPEG base64 (ver iter_page_images).
+
+        Returns:
+            list: [{'page': n, 'base64': str, 'mime': 'image/jpeg'}]
+        """
+        return list(self.iter_page_images(first_page, last_page, image_options=image_options))
+
+    def prefetch_pages(self):
+        """
+        Extrae en el pool de procesos el texto y las tablas (estrategia 'lines', sin
+        recorte) de todas las páginas, repartidas en rangos contiguos.
+        """
+        if self.cpu_executor is None or not self.pdf or self.page_count < 2:
+            return
+        missing = [index for index in range(self.page_count) if (index, None, 'lines') not in self._page_tables]
+        if not missing:
+            return
+        ranges = split_range(missing[0], missing[-1], self.cpu_workers)
+        try:
+            for pages in self._map_ranges('extract_pages', ranges):
+                for index, text, tables in pages:
+                    self._page_texts.setdefault(index, text)
+                    self._page_tables.setdefault((index, None, 'lines'), tables)
+        except Exception:
+            # Las páginas que falten se extraen al pedirlas
+            _logger.debug('Could not prefetch PDF pages', exc_info=True)
+
+    def _map_ranges(self, task, ranges, *args):
+        """
+        Genera pdf_tasks.<task>(content, first, last, *args) para cada rango, en orden.
+
+        Con pool de procesos hay a lo sumo cpu_workers tareas en curso; si el pool
+        se rompe (p.ej. un proceso murió por memoria) o se reemplaza mientras tanto
+        (cancelando sus tareas), el resto se calcula en este proceso.
+        """
+        done = 0
+        if self.cpu_executor is not None and len(ranges) > 1:
+            function = cpu_pool.task('pdf_tasks', task)
+            pending = deque()
+            try:
+                while done < len(ranges):
+                    while done + len(pending) < len(ranges) and len(pending) < self.cpu_workers:
+                        first, last = ranges[done + len(pending)]
+                        pending.append(self.cpu_executor.submit(function, self.content, first, last, *args))
+                    result = pending.popleft().result()
+                    done += 1
+                    yield result
+            except (CancelledError, RuntimeError) as error:
+                # BrokenProcessPool es un RuntimeError, igual que submit sobre un pool
+                # que get_executor ya cerró para reemplazarlo
+                _logger.warning('CPU process pool unavailable (%r), continuing in-process', error)
+                self.cpu_executor = None
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        function = TASKS[task]
+        for first, last in ranges[done:]:
+            yield function(self.content, first, last, *args)
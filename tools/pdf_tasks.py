@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tareas de CPU sobre PDFs que se ejecutan en el pool de procesos (tools.cpu_pool).
+
+Los procesos del pool importan este módulo sin Odoo (ver cpu_pool.task), por eso
+solo depende de las librerías de PDF e imágenes y de otros módulos de tools sin
+Odoo. Las funciones reciben bytes y devuelven tipos simples (picklables).
+"""
+import base64
+import io
+
+from .image_preprocess import preprocess_image
+
+# Dependencias opcionales: tools.pdf_document avisa si faltan y omite las etapas
+try:
+    import pdfplumber
+except ImportError:
+    pdfplumber = None
+
+try:
+    from pdf2image import convert_from_bytes
+except ImportError:
+    convert_from_bytes = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Renderizado de páginas: 100 DPI para balance velocidad/calidad
+RENDER_DPI = 100
+RENDER_MAX_WIDTH = 1500
+RENDER_JPEG_QUALITY = 75
+# Procesos pdftoppm en paralelo por llamada a poppler
+RENDER_THREAD_COUNT = 2
+
+
+def extract_pages(content, first, last):
+    """
+    Texto y tablas de las páginas first..last (índices desde 0).
+
+    Returns:
+        list: [(índice, texto, tablas)]
+    """
+    with pdfplumber.open(io.BytesIO(content)) as pdf:
+        return [
+            (index, pdf.pages[index].extract_text() or '', pdf.pages[index].extract_tables())
+            for index in range(first, last + 1)
+        ]
+
+
+def render_pages(content, first_page, last_page, image_options=None):
+    """
+    Rasteriza las páginas first_page..last_page (desde 1) y las codifica; cada imagen
+    se libera apenas se codifica. Se ejecuta en el pool de procesos o en el worker.
+    poppler entrega PPM sin pérdida: la página se comprime como JPEG una sola vez.
+
+    Returns:
+        list: [{'page': n, 'base64': str, 'mime': 'image/jpeg', ...}]
+    """
+    images = convert_from_bytes(
+        content,
+        dpi=RENDER_DPI,
+        fmt='ppm',
+        first_page=first_page,
+        last_page=last_page,
+        thread_count=min(RENDER_THREAD_COUNT, last_page - first_page + 1),
+    )
+    pages = []
+    for offset in range(len(images)):
+        img = images[offset]
+        images[offset] = None
+        if image_options is not None:
+            page = preprocess_image(img, **image_options)
+        else:
+            page = {'base64': encode_page(img), 'mime': 'image/jpeg'}
+        page['page'] = first_page + offset
+        pages.append(page)
+        img.close()
+    return pages
+
+
+def encode_page(img):
+    """Redimensiona una página renderizada y la codifica como JPEG base64"""
+    # Redimensionar si es muy grande
+    if img.width > RENDER_MAX_WIDTH:
+        ratio = RENDER_MAX_WIDTH / img.width
+        new_size = (RENDER_MAX_WIDTH, int(img.height * ratio))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # Convertir imagen a base64 (calidad reducida para reducir tamaño)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=RENDER_JPEG_QUALITY)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Limitador de tasa compartido para las llamadas a OpenAI.
+
+Cada configuración tiene dos cubetas de tokens (solicitudes por minuto y tokens
+por minuto) guardadas en su fila de password_assigner_config, así que todos los
+workers comparten el mismo presupuesto. Cada consulta usa una transacción corta
+propia; la fila solo se bloquea mientras se recalcula el presupuesto.
+
+Las solicitudes que esperan se registran en password_assigner_rate_limit_waiter
+con un latido en cada consulta. La cola cuenta solo las filas con latido reciente,
+así que un worker terminado a la fuerza no la deja inflada.
+"""
+import logging
+import random
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Tokens estimados por imagen cuando no se conocen sus dimensiones (~6 tiles en detalle alto)
+DEFAULT_IMAGE_TOKENS = 1105
+# Bytes de PDF por token estimado al enviar el archivo directo
+PDF_BYTES_PER_TOKEN = 50
+MIN_PDF_TOKENS = 1500
+# Caracteres por token estimado para texto
+CHARS_PER_TOKEN = 4
+# Espera máxima entre consultas al presupuesto
+MAX_POLL_INTERVAL = 5.0
+# Una solicitud en cola sin latido durante este tiempo ya no está esperando
+WAITER_TIMEOUT = 3 * MAX_POLL_INTERVAL
+WAITER_TABLE = 'password_assigner_rate_limit_waiter'
+
+
+def estimate_image_tokens(width, height, detail='high'):
+    """Tokens de una imagen según la fórmula de visión de OpenAI (tiles de 512px)"""
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048.0 / max(width, height, 1))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768.0 / max(min(width, height), 1))
+    width, height = width * scale, height * scale
+    tiles = -(-int(width) // 512) * -(-int(height) // 512)
+    return 170 * tiles + 85
+
+
+def estimate_request_tokens(payload):
+    """
+    Estimación de los tokens que la API cuenta para una solicitud de extracción:
+    imágenes, tamaño del PDF, texto e instrucciones, más max_output_tokens.
+    """
+    tokens = len(payload.get('instructions') or '') // CHARS_PER_TOKEN
+    tokens += payload.get('max_output_tokens') or 0
+
+    messages = payload.get('input')
+    if isinstance(messages, str):
+        return tokens + len(messages) // CHARS_PER_TOKEN
+
+    for message in messages or []:
+        for block in message.get('content', []):
+            if block.get('type') == 'input_image':
+                tokens += 85 if block.get('detail') == 'low' else DEFAULT_IMAGE_TOKENS
+            elif block.get('type') == 'input_file':
+                data = (block.get('file_data') or '').partition('base64,')[2]
+                pdf_size = len(data) * 3 // 4
+                tokens += max(MIN_PDF_TOKENS, pdf_size // PDF_BYTES_PER_TOKEN)
+            elif block.get('type') == 'input_text':
+                tokens += len(block.get('text') or '') // CHARS_PER_TOKEN
+    return tokens
+
+
+class RateLimitTimeout(Exception):
+    """No hubo capacidad disponible dentro de la espera máxima"""
+
+
+class RateLimiter:
+    """
+    Token bucket por configuración en Postgres.
+
+    Args:
+        cursor_factory: Función que abre un cursor nuevo (registry.cursor)
+        config_id: Id de password.assigner.config
+        rpm: Solicitudes por minuto (0 = sin límite)
+        tpm: Tokens por minuto (0 = sin límite)
+        max_wait: Segundos máximos de espera en cola
+    """
+
+    def __init__(self, cursor_factory, config_id, rpm, tpm, max_wait):
+        self.cursor_factory = cursor_factory
+        self.config_id = config_id
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+
+    def _try_acquire(self, cost, waiter_id=None):
+        """
+        Intenta descontar una solicitud y cost tokens; retorna los segundos a esperar (0 = ok).
+        Con waiter_id, registra además el latido de la solicitud en cola.
+        """
+        with self.cursor_factory() as cr:
+            if waiter_id:
+                cr.execute(f"""
+                    UPDATE {WAITER_TABLE}
+                       SET heartbeat_at = EXTRACT(EPOCH FROM clock_timestamp())
+                     WHERE id = %s
+                """, [waiter_id])
+            cr.execute("""
+                SELECT rate_limit_request_budget, rate_limit_token_budget, rate_limit_updated_at,
+                       EXTRACT(EPOCH FROM clock_timestamp())
+                  FROM password_assigner_config
+                 WHERE id = %s
+                   FOR UPDATE
+            """, [self.config_id])
+            request_budget, token_budget, updated_at, now = cr.fetchone()
+            now = float(now)
+            elapsed = max(now - (updated_at or 0.0), 0.0)
+
+            wait = 0.0
+            if self.rpm:
+                request_budget = min(float(self.rpm), (request_budget or 0.0) + elapsed * self.rpm / 60.0)
+                if request_budget < 1.0:
+                    wait = max(wait, (1.0 - request_budget) * 60.0 / self.rpm)
+            if self.tpm:
+                # Una solicitud más grande que el límite espera a tener la cubeta llena
+                needed = min(float(cost), float(self.tpm))
+                token_budget = min(float(self.tpm), (token_budget or 0.0) + elapsed * self.tpm / 60.0)
+                if token_budget < needed:
+                    wait = max(wait, (needed - token_budget) * 60.0 / self.tpm)
+
+            if not wait:
+                if self.rpm:
+                    request_budget -= 1.0
+                if self.tpm:
+                    token_budget -= min(float(cost), float(self.tpm))
+
+            cr.execute("""
+                UPDATE password_assigner_config
+                   SET rate_limit_request_budget = %s,
+                       rate_limit_token_budget = %s,
+                       rate_limit_updated_at = %s
+                 WHERE id = %s
+            """, [request_budget, token_budget, now, self.config_id])
+        return wait
+
+    def _register_waiter(self):
+        """Registra una solicitud en cola (y descarta las de workers que ya no laten)"""
+        with self.cursor_factory() as cr:
+            cr.execute(f"""
+                DELETE FROM {WAITER_TABLE}
+                 WHERE config_id = %s
+                   AND heartbeat_at < EXTRACT(EPOCH FROM clock_timestamp()) - %s
+            """, [self.config_id, WAITER_TIMEOUT])
+            cr.execute(f"""
+                INSERT INTO {WAITER_TABLE} (config_id, heartbeat_at)
+                VALUES (%s, EXTRACT(EPOCH FROM clock_timestamp()))
+             RETURNING id
+            """, [self.config_id])
+            return cr.fetchone()[0]
+
+    def _unregister_waiter(self, waiter_id):
+        with self.cursor_factory() as cr:
+            cr.execute(f"DELETE FROM {WAITER_TABLE} WHERE id = %s", [waiter_id])
+
+    def acquire(self, cost):
+        """Espera (en cola) hasta tener capacidad para una solicitud de cost tokens"""
+        if not self.rpm and not self.tpm:
+            return
+
+        wait = self._try_acquire(cost)
+        if not wait:
+            return
+
+        deadline = time.monotonic() + self.max_wait
+        waiter_id = self._register_waiter()
+        try:
+            while wait:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimitTimeout(
+                        f'sin capacidad disponible después de {self.max_wait} segundos en cola'
+                    )
+                _logger.info('OpenAI rate limit reached for config %s, waiting %.1fs (%d tokens)',
+                             self.config_id, wait, cost)
+                time.sleep(min(wait + random.uniform(0, 0.5), MAX_POLL_INTERVAL, remaining))
+                wait = self._try_acquire(cost, waiter_id)
+        finally:
+            self._unregister_waiter(waiter_id)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de encabezados de las plantillas Excel/CSV para detectarlas automáticamente.
+
+Cada plantilla tiene una huella: sus columnas configuradas normalizadas (sin
+mayúsculas, acentos ni espacios repetidos). Las plantillas se agrupan por la forma
+de leer el encabezado (tipo de archivo, hoja y fila), así cada archivo se lee una
+sola vez por grupo y solo hasta la fila del encabezado.
+"""
+import unicodedata
+
+
+def normalize_header(value):
+    """Nombre de columna normalizado: sin acentos, en minúsculas y con espacios simples"""
+    text = unicodedata.normalize('NFKD', str(value or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def header_fingerprint(columns):
+    """Huella de un conjunto de columnas: nombres normalizados, ordenados y separados por |"""
+    return '|'.join(sorted({normalize_header(column) for column in columns if column}))
+
+
+class TemplateHeaderIndex:
+    """
+    Plantillas activas agrupadas por forma de lectura del encabezado.
+
+    La clave de lectura es (file_type, hoja, fila del encabezado), con la hoja como
+    nombre o índice y la fila contada desde 0 (skip_rows + header_row).
+    """
+
+    def __init__(self, templates):
+        """
+        Args:
+            templates: Iterable de dicts id, file_type, sheet, header_offset,
+                       invoice_column y fingerprint, en orden de prioridad
+        """
+        self._entries = []
+        for template in templates:
+            read_key = (template['file_type'], template['sheet'], template['header_offset'])
+            self._entries.append((
+                read_key,
+                template['id'],
+                normalize_header(template['invoice_column']),
+                frozenset(filter(None, template['fingerprint'].split('|'))),
+            ))
+
+    def read_keys(self, file_type):
+        """Formas de lectura del encabezado necesarias para un tipo de archivo"""
+        return list(dict.fromkeys(key for key, *_rest in self._entries if key[0] == file_type))
+
+    def best_matches(self, headers):
+        """
+        Plantillas cuyas columnas configuradas están todas en el encabezado del archivo.
+
+        Solo cuentan las plantillas con cobertura completa: con una columna faltante
+        (p.ej. la de contraseña) las filas se agruparían mal sin aviso. Si varias
+        coinciden gana la de más columnas; un empate se devuelve completo para que
+        el llamador lo reporte en lugar de elegir por prioridad.
+
+        Args:
+            headers: {clave de lectura: conjunto de encabezados normalizados}
+
+        Returns:
+            list: Ids de las plantillas empatadas en la mejor coincidencia (vacía si ninguna)
+        """
+        best_size = 0
+        best_ids = []
+        for read_key, template_id, invoice_column, columns in self._entries:
+            header = headers.get(read_key)
+            if not header or invoice_column not in header or not columns <= header:
+                continue
+            if len(columns) > best_size:
+                best_size, best_ids = len(columns), [template_id]
+            elif len(columns) == best_size and template_id not in best_ids:
+                best_ids.append(template_id)
+        return best_ids
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Valores que se construyen desde la base y se comparten entre los hilos de un worker.
+
+Cada valor (índice de candidatas, perfiles de emisor, índice de plantillas) se
+guarda con la firma de sus datos de origen: la cantidad de filas y la última
+modificación. Mientras la firma no cambie se reutiliza; si cambia, se reconstruye.
+"""
+import threading
+
+# {(namespace, key): (signature, value)}
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def table_signature(cr, table, where='TRUE', params=None):
+    """
+    Firma de las filas de una tabla: (cantidad, última write_date).
+
+    Args:
+        table: Nombre de la tabla (constante del modelo, no un valor del usuario)
+        where: Condición SQL de las filas que forman el valor
+        params: Parámetros de la condición
+    """
+    cr.execute(f"""
+        SELECT COUNT(*), MAX(write_date)
+          FROM {table}
+         WHERE {where}
+    """, params or [])
+    return cr.fetchone()
+
+
+def get_cached(namespace, key, signature, loader):
+    """
+    Devuelve el valor guardado en el worker para (namespace, key) si su firma
+    sigue vigente, o construye uno nuevo con loader().
+
+    Args:
+        namespace: Tipo de valor (p.ej. 'invoice_candidates')
+        key: Identificador dentro del tipo (p.ej. (dbname, company_id))
+        signature: Valor que cambia cuando cambian los datos de origen
+        loader: Función que construye el valor
+    """
+    cache_key = (namespace, key)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(cache_key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    value = loader()
+    with _CACHE_LOCK:
+        _CACHE[cache_key] = (signature, value)
+    return value
+
+
+def invalidate(namespace, key=None):
+    """Descarta el valor de (namespace, key), o todos los del namespace si key es None"""
+    with _CACHE_LOCK:
+        if key is None:
+            for cache_key in [cache_key for cache_key in _CACHE if cache_key[0] == namespace]:
+                del _CACHE[cache_key]
+        else:
+            _CACHE.pop((namespace, key), None)
@@ -2,8 +2,13 @@
 from odoo import models, fields, api, _
 import logging
 
+from ..tools.invoice_keys import normalize_invoice_key
+
 _logger = logging.getLogger(__name__)
 
+# Campos de la línea que cambian los contadores del wizard
+STATISTICS_FIELDS = {'wizard_id', 'apply', 'invoice_ids'}
+
 
 class PasswordAssignerWizardLine(models.TransientModel):
     _name = 'password.assigner.wizard.line'
@@ -100,27 +105,62 @@ class PasswordAssignerWizardLine(models.TransientModel):
         help='Notas o advertencias sobre esta línea'
     )
 
-    # Related fields for display
+    # Related fields for display (almacenados: se calculan al crear las líneas o
+    # cambiar sus facturas y no en cada carga del preview; dependen solo de
+    # invoice_ids para no recalcular las líneas al modificar las facturas)
     invoice_partners = fields.Char(
         string='Clientes',
-        compute='_compute_invoice_info'
+        compute='_compute_invoice_info',
+        store=True
     )
     invoice_amounts = fields.Char(
         string='Montos',
-        compute='_compute_invoice_info'
+        compute='_compute_invoice_info',
+        store=True
     )
     invoice_numbers_display = fields.Char(
         string='Números de Factura',
-        compute='_compute_invoice_info'
+        compute='_compute_invoice_info',
+        store=True
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines._refresh_wizard_statistics(lines.wizard_id)
+        return lines
+
+    def write(self, vals):
+        wizards = self.wizard_id
+        result = super().write(vals)
+        if STATISTICS_FIELDS.intersection(vals):
+            self._refresh_wizard_statistics(wizards | self.wizard_id)
+        return result
+
+    def unlink(self):
+        wizards = self.wizard_id
+        result = super().unlink()
+        self._refresh_wizard_statistics(wizards.exists())
+        return result
+
+    def _refresh_wizard_statistics(self, wizards):
+        """
+        Actualiza los contadores de los wizards, salvo dentro de un write del wizard
+        que edita sus líneas: ese write los actualiza una sola vez al terminar.
+        """
+        if not self.env.context.get('password_assigner_defer_statistics'):
+            wizards._refresh_statistics()
+
     @api.depends('invoice_ids')
     def _compute_invoice_count(self):
         for line in self:
             line.invoice_count = len(line.invoice_ids)
 
-    @api.depends('invoice_ids', 'invoice_ids.partner_id', 'invoice_ids.amount_total', 'invoice_ids.invoice_number')
+    @api.depends('invoice_ids')
     def _compute_invoice_info(self):
+        # Leer facturas, clientes y monedas de todas las líneas en una sola consulta por modelo
+        self.invoice_ids.partner_id.mapped('name')
+        self.invoice_ids.currency_id.mapped('symbol')
         for line in self:
             if line.invoice_ids:
                 # Partners
@@ -191,7 +231,14 @@ class PasswordAssignerWizardLine(models.TransientModel):
             ('invoice_number', 'ilike', f'%{clean_number}%'),
         ]
 
+        # Más las facturas con la misma clave normalizada (igualdad indexada)
         matched = AccountMove.search(search_domain, limit=10)
+        key = normalize_invoice_key(clean_number)
+        if key and len(matched) < 10:
+            matched |= AccountMove.search(
+                base_domain + [('password_match_key', '=', key), ('id', 'not in', matched.ids)],
+                limit=10 - len(matched),
+            )
 
         # Si no encontró, buscar en líneas de factura
         if not matched:
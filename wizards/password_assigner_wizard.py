@@ -1,37 +1,35 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import config as odoo_config
 import base64
-import io
 import json
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import re
 
-_logger = logging.getLogger(__name__)
+from ..tools import cpu_pool, image_preprocess, issuer_profiles, openai_client, worker_cache
+from ..tools.pdf_document import (
+    PDF2IMAGE_AVAILABLE, PDF_KINDS, PDFPLUMBER_AVAILABLE, PIL_AVAILABLE, PdfDocument,
+)
+from ..tools.candidate_index import InvoiceCandidateIndex
+from ..tools.invoice_keys import normalize_invoice_key, is_numeric_key, MIN_TOKEN_LENGTH
 
-# PDF to Image conversion - optional dependencies
-try:
-    from pdf2image import convert_from_bytes
-    PDF2IMAGE_AVAILABLE = True
-except ImportError:
-    PDF2IMAGE_AVAILABLE = False
-    _logger.warning('pdf2image not available. PDF support will be limited.')
-
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-# PDF table extraction - optional dependency
-try:
-    import pdfplumber
-    PDFPLUMBER_AVAILABLE = True
-except ImportError:
-    PDFPLUMBER_AVAILABLE = False
-    _logger.warning('pdfplumber not available. Table extraction will use AI only.')
+_logger = logging.getLogger(__name__)
 
-import re
+# Colas numéricas más cortas coinciden con demasiadas facturas
+MIN_NUMERIC_TAIL_LENGTH = 4
+# Facturas extraídas que se buscan en cada consulta del match por lotes
+MATCH_BATCH_SIZE = 5000
+# Términos sin resultado en la tabla de tokens que se buscan con ilike en las líneas
+# (claves cortas, subcadenas fuera del límite de un token). Desde 3 caracteres la
+# búsqueda usa el índice de trigramas.
+LINE_ILIKE_MIN_LENGTH = 3
+LINE_ILIKE_MAX_TERMS = 200
+# Conexiones a la base de datos por hilo de extracción: su cursor y hasta dos
+# transacciones cortas a la vez (caché de extracción y sus contadores, límite de tasa)
+EXTRACTION_THREAD_CONNECTIONS = 3
 
 
 class PasswordAssignerWizard(models.TransientModel):
@@ -69,7 +67,8 @@ class PasswordAssignerWizard(models.TransientModel):
     template_id = fields.Many2one(
         'password.assigner.template',
         string='Plantilla Excel',
-        help='Plantilla para procesar archivos Excel (opcional)'
+        help='Plantilla para procesar archivos Excel (opcional). '
+             'Si se deja vacía, se detecta la plantilla de cada archivo por sus encabezados.'
     )
     company_id = fields.Many2one(
         'res.company',
@@ -78,6 +77,20 @@ class PasswordAssignerWizard(models.TransientModel):
         required=True
     )
 
+    # Background jobs
+    job_ids = fields.Many2many(
+        'password.assigner.job',
+        'password_assigner_wizard_job_rel',
+        'wizard_id',
+        'job_id',
+        string='Trabajos',
+        help='Documentos encolados para procesamiento en segundo plano'
+    )
+    jobs_pending = fields.Integer(
+        string='Documentos Pendientes',
+        compute='_compute_jobs_pending'
+    )
+
     # Preview lines
     line_ids = fields.One2many(
         'password.assigner.wizard.line',
@@ -95,36 +108,84 @@ class PasswordAssignerWizard(models.TransientModel):
         readonly=True
     )
 
-    # Statistics (computed)
+    # Statistics: los contadores de líneas se guardan y los actualiza
+    # _refresh_statistics cuando cambian las líneas
     total_documents = fields.Integer(
         string='Documentos',
-        compute='_compute_statistics'
+        compute='_compute_total_documents'
     )
     total_passwords = fields.Integer(
         string='Contraseñas',
-        compute='_compute_statistics'
+        readonly=True
     )
     total_matched = fields.Integer(
         string='Con Match',
-        compute='_compute_statistics'
+        readonly=True
     )
     total_unmatched = fields.Integer(
         string='Sin Match',
-        compute='_compute_statistics'
+        readonly=True
     )
     total_to_apply = fields.Integer(
         string='A Aplicar',
-        compute='_compute_statistics'
+        readonly=True
     )
 
-    @api.depends('document_ids', 'line_ids', 'line_ids.apply', 'line_ids.match_status', 'line_ids.invoice_ids')
-    def _compute_statistics(self):
+    @api.depends('document_ids')
+    def _compute_total_documents(self):
         for wizard in self:
             wizard.total_documents = len(wizard.document_ids)
-            wizard.total_passwords = len(wizard.line_ids)
-            wizard.total_matched = len(wizard.line_ids.filtered(lambda l: l.invoice_ids))
-            wizard.total_unmatched = len(wizard.line_ids.filtered(lambda l: not l.invoice_ids))
-            wizard.total_to_apply = len(wizard.line_ids.filtered(lambda l: l.apply and l.invoice_ids))
+
+    def write(self, vals):
+        if 'line_ids' not in vals:
+            return super().write(vals)
+        # Al guardar el formulario llega un comando por línea editada: los
+        # contadores se actualizan una vez al final y no por cada línea
+        result = super(PasswordAssignerWizard, self.with_context(password_assigner_defer_statistics=True)).write(vals)
+        self._refresh_statistics()
+        return result
+
+    def _refresh_statistics(self):
+        """
+        Actualiza los contadores del preview con una sola consulta agrupada sobre
+        las líneas y su relación con las facturas, sin cargar las líneas en memoria.
+        """
+        if not self:
+            return
+        self.env['password.assigner.wizard.line'].flush_model(['wizard_id', 'apply', 'invoice_ids'])
+        self.env.cr.execute("""
+            SELECT wizard_id,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE has_invoices),
+                   COUNT(*) FILTER (WHERE has_invoices AND apply)
+              FROM (
+                    SELECT line.wizard_id,
+                           line.apply,
+                           EXISTS (
+                               SELECT 1
+                                 FROM password_assigner_line_invoice_rel rel
+                                WHERE rel.line_id = line.id
+                           ) AS has_invoices
+                      FROM password_assigner_wizard_line line
+                     WHERE line.wizard_id = ANY(%s)
+                   ) lines
+          GROUP BY wizard_id
+        """, [self.ids])
+        counts = {wizard_id: (total, matched, to_apply) for wizard_id, total, matched, to_apply in self.env.cr.fetchall()}
+
+        for wizard in self:
+            total, matched, to_apply = counts.get(wizard.id, (0, 0, 0))
+            wizard.write({
+                'total_passwords': total,
+                'total_matched': matched,
+                'total_unmatched': total - matched,
+                'total_to_apply': to_apply,
+            })
+
+    @api.depends('job_ids.state')
+    def _compute_jobs_pending(self):
+        for wizard in self:
+            wizard.jobs_pending = len(wizard.job_ids.filtered(lambda j: j.state in ('pending', 'running')))
 
     @api.onchange('document_ids')
     def _onchange_document_ids(self):
@@ -144,45 +205,60 @@ class PasswordAssignerWizard(models.TransientModel):
         if not self.document_ids:
             raise UserError(_('Debe subir al menos un documento.'))
 
+        if self.config_id.use_background_jobs:
+            return self._queue_document_jobs()
+
         self.state = 'processing'
         self.error_message = ''
         self.processing_log = ''
         errors = []
         log_lines = []
+        pending_results = []
 
         # Clear existing lines
         self.line_ids.unlink()
 
+        documents = []
         for attachment in self.document_ids:
             try:
-                filename = attachment.name or ''
-                file_content = base64.b64decode(attachment.datas)
-                mime_type = attachment.mimetype or self._guess_mimetype(filename)
-
-                log_lines.append(f"Procesando: {filename} ({mime_type})")
-
-                if self._is_excel_file(filename, mime_type):
-                    # Process Excel with template
-                    results = self._process_excel(attachment, file_content, filename)
-                elif self._is_image_or_pdf(filename, mime_type):
-                    # Process image/PDF with OpenAI
-                    results = self._process_image_pdf(attachment, file_content, filename, mime_type)
-                else:
-                    errors.append(f"Tipo de archivo no soportado: {filename}")
-                    continue
-
-                # Create preview lines from results
-                for result in results:
-                    self._create_preview_line(result, filename)
-
-                log_lines.append(f"  -> {len(results)} contraseñas encontradas")
-
+                documents.append(self._prepare_document(attachment))
             except Exception as e:
                 error_msg = f"Error procesando {attachment.name}: {str(e)}"
                 errors.append(error_msg)
-                log_lines.append(f"  -> ERROR: {str(e)}")
                 _logger.exception(error_msg)
 
+        # La extracción (llamadas a OpenAI) se ejecuta en paralelo; el ORM queda en este cursor
+        self._run_document_extractions(documents)
+
+        for document in documents:
+            filename = document['filename']
+            log_lines.append(f"Procesando: {filename} ({document['mime_type']})")
+            log_lines.extend(f"  {line}" for line in document['log'])
+
+            if not document['kind']:
+                errors.append(f"Tipo de archivo no soportado: {filename}")
+                continue
+
+            if document.get('error'):
+                errors.append(f"Error procesando {filename}: {document['error']}")
+                log_lines.append(f"  -> ERROR: {document['error']}")
+                continue
+
+            results = document['results']
+            # Las líneas se crean al final para hacer el match de todo el lote
+            pending_results.extend((result, filename) for result in results)
+
+            log_lines.append(f"  -> {len(results)} contraseñas encontradas")
+
+        # Crear líneas de preview con un solo match por lotes para toda la corrida
+        try:
+            self._create_preview_lines(pending_results)
+        except Exception as e:
+            error_msg = f"Error buscando facturas: {str(e)}"
+            errors.append(error_msg)
+            log_lines.append(f"  -> ERROR: {str(e)}")
+            _logger.exception(error_msg)
+
         self.processing_log = '\n'.join(log_lines)
         if errors:
             self.error_message = '\n'.join(errors)
@@ -197,6 +273,194 @@ class PasswordAssignerWizard(models.TransientModel):
             'target': 'new',
         }
 
+    def _queue_document_jobs(self):
+        """Encola un trabajo por documento para procesarlo con el cron"""
+        self.line_ids.unlink()
+        jobs = self.env['password.assigner.job'].create([{
+            'attachment_id': attachment.id,
+            'config_id': self.config_id.id,
+            'template_id': self.template_id.id,
+            'company_id': self.company_id.id,
+        } for attachment in self.document_ids])
+        self.write({
+            'job_ids': [(6, 0, jobs.ids)],
+            'state': 'processing',
+            'error_message': '',
+            'processing_log': '\n'.join(f"Encolado: {job.name}" for job in jobs),
+        })
+        jobs._trigger_processing()
+        return self._reopen_wizard()
+
+    def action_refresh_jobs(self):
+        """Carga al preview los documentos que ya terminaron de procesarse"""
+        self.ensure_one()
+        self._import_finished_jobs()
+        return self._reopen_wizard()
+
+    def action_poll_jobs(self):
+        """
+        Llamado periódicamente por el formulario (widget password_assigner_job_poller)
+        mientras el wizard está en proceso.
+
+        Returns:
+            bool: True si se cargaron documentos nuevos
+        """
+        self.ensure_one()
+        if self.state != 'processing':
+            return False
+        return self._import_finished_jobs()
+
+    def _import_finished_jobs(self):
+        """
+        Crea las líneas de preview de los trabajos terminados que aún no se cargaron.
+
+        Returns:
+            bool: True si se cargó algún trabajo
+        """
+        finished = self.job_ids.filtered(lambda j: j.state in ('done', 'error') and not j.imported)
+        if not finished:
+            if not self.jobs_pending:
+                self.state = 'preview'
+                return True
+            return False
+
+        errors = [self.error_message] if self.error_message else []
+        log_lines = [self.processing_log] if self.processing_log else []
+        pending_results = []
+
+        for job in finished:
+            log_lines.append(f"Procesado: {job.name}")
+            if job.processing_log:
+                log_lines.extend(f"  {line}" for line in job.processing_log.split('\n'))
+            if job.state == 'error':
+                errors.append(f"Error procesando {job.name}: {job.error_message}")
+                log_lines.append(f"  -> ERROR: {job.error_message}")
+                continue
+            results = job._get_results()
+            pending_results.extend((result, job.name) for result in results)
+            log_lines.append(f"  -> {len(results)} contraseñas encontradas")
+
+        try:
+            self._create_preview_lines(pending_results)
+        except Exception as e:
+            error_msg = f"Error buscando facturas: {str(e)}"
+            errors.append(error_msg)
+            log_lines.append(f"  -> ERROR: {str(e)}")
+            _logger.exception(error_msg)
+
+        finished.write({'imported': True})
+        self.write({
+            'processing_log': '\n'.join(log_lines),
+            'error_message': '\n'.join(errors),
+            'state': 'processing' if self.jobs_pending else 'preview',
+        })
+        return True
+
+    def _reopen_wizard(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _prepare_document(self, attachment):
+        """
+        Lee un adjunto y determina cómo debe procesarse.
+
+        Returns:
+            dict: Documento con filename, content, mime_type, kind ('excel', 'ai' o False)
+                  y log (líneas adicionales para el log de procesamiento)
+        """
+        filename = attachment.name or ''
+        mime_type = attachment.mimetype or self._guess_mimetype(filename)
+
+        if self._is_excel_file(filename, mime_type):
+            kind = 'excel'
+        elif self._is_image_or_pdf(filename, mime_type):
+            kind = 'ai'
+        else:
+            kind = False
+
+        return {
+            'attachment_id': attachment.id,
+            'filename': filename,
+            'content': base64.b64decode(attachment.datas) if kind else b'',
+            'mime_type': mime_type,
+            'kind': kind,
+            'log': [],
+        }
+
+    def _run_document_extractions(self, documents):
+        """
+        Extrae la información de todos los documentos.
+
+        Los archivos Excel se procesan en el cursor actual. Las imágenes y PDFs
+        dependen de la red, así que se procesan en un pool de hilos acotado por
+        la configuración y por db_maxconn. Cada hilo lee con su propio cursor y
+        escribe la caché de extracción, sus contadores y el límite de tasa en
+        transacciones cortas: hasta EXTRACTION_THREAD_CONNECTIONS conexiones por hilo.
+        Todas las solicitudes a OpenAI de la corrida (documentos y partes de PDFs)
+        comparten un mismo cupo de max_parallel_documents solicitudes en curso.
+        Los resultados quedan en document['results'] o document['error'].
+        """
+        ai_documents = [doc for doc in documents if doc['kind'] == 'ai']
+        # Una conexión queda para el cursor de la corrida
+        max_threads = max((odoo_config.get('db_maxconn') or 64) - 1, 0) // EXTRACTION_THREAD_CONNECTIONS
+        pool_size = min(self.config_id.max_parallel_documents or 1, len(ai_documents), max_threads)
+
+        if pool_size <= 1 or self.env.registry.in_test_mode():
+            for document in documents:
+                if document['kind']:
+                    self._run_document_extraction(document)
+            return
+
+        for document in documents:
+            if document['kind'] == 'excel':
+                self._run_document_extraction(document)
+
+        registry = self.env.registry
+        uid = self.env.uid
+        context = dict(
+            self.env.context,
+            password_assigner_request_slots=threading.BoundedSemaphore(self.config_id.max_parallel_documents),
+        )
+        wizard_vals = {
+            'config_id': self.config_id.id,
+            'template_id': self.template_id.id,
+            'company_id': self.company_id.id,
+        }
+
+        def extract_in_thread(document):
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                wizard = env[self._name].new(wizard_vals)
+                wizard._run_document_extraction(document)
+
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='password_assigner') as executor:
+            list(executor.map(extract_in_thread, ai_documents))
+
+    def _run_document_extraction(self, document):
+        """Extrae un documento guardando el resultado o el error en el propio documento"""
+        try:
+            document['results'] = self._extract_document(document)
+        except Exception as e:
+            document['error'] = str(e)
+            _logger.exception('Error procesando %s', document['filename'])
+
+    def _extract_document(self, document):
+        """Extrae las contraseñas de un documento preparado con _prepare_document"""
+        attachment = self.env['ir.attachment'].browse(document['attachment_id'])
+        if document['kind'] == 'excel':
+            # Process Excel with template
+            return self._process_excel(attachment, document['content'], document['filename'], log=document['log'])
+        # Process image/PDF with OpenAI
+        return self._process_image_pdf(
+            attachment, document['content'], document['filename'], document['mime_type'],
+            log=document['log'], document_info=document,
+        )
+
     def _is_excel_file(self, filename, mime_type):
         """Verifica si es un archivo Excel"""
         excel_extensions = ('.xlsx', '.xls', '.csv')
@@ -238,150 +502,152 @@ class PasswordAssignerWizard(models.TransientModel):
             'csv': 'text/csv',
         }.get(ext, 'application/octet-stream')
 
-    def _process_excel(self, attachment, file_content, filename):
-        """Procesa archivo Excel usando plantilla"""
-        if not self.template_id:
-            raise UserError(_(
-                'Debe seleccionar una plantilla para procesar archivos Excel.\n'
-                'Archivo: %s'
-            ) % filename)
-
-        parsed_data = self.template_id.parse_file(file_content, filename)
-
-        # Group by password
-        passwords = {}
-        for row in parsed_data:
-            pwd = row.get('password', '') or 'SIN_CONTRASEÑA'
-            if pwd not in passwords:
-                passwords[pwd] = {
-                    'password_number': pwd if pwd != 'SIN_CONTRASEÑA' else '',
-                    'issuer_name': '',
-                    'invoices': [],
-                }
-            passwords[pwd]['invoices'].append({
-                'invoice_number': row.get('invoice_number', ''),
-                'invoice_series': row.get('invoice_series', ''),
-                'amount': row.get('amount', 0),
-                'date': row.get('date', ''),
-            })
+    def _process_excel(self, attachment, file_content, filename, log=None):
+        """
+        Procesa archivo Excel usando plantilla. Sin plantilla en el wizard, se
+        detecta la plantilla del archivo por sus encabezados.
+        """
+        template = self.template_id
+        if not template:
+            template = self.env['password.assigner.template']._detect_template(file_content, filename)
+            if not template:
+                raise UserError(_(
+                    'No se encontró una plantilla cuyas columnas coincidan con el archivo. '
+                    'Seleccione una plantilla manualmente.\n'
+                    'Archivo: %s'
+                ) % filename)
+            if len(template) > 1:
+                raise UserError(_(
+                    'Varias plantillas coinciden con las columnas del archivo: %(templates)s. '
+                    'Seleccione una plantilla manualmente.\n'
+                    'Archivo: %(file)s'
+                ) % {'templates': ', '.join(template.mapped('name')), 'file': filename})
+            if log is not None:
+                log.append(f"Plantilla detectada: {template.name}")
 
         return [
             {
-                'password_number': data['password_number'],
-                'issuer_name': data['issuer_name'],
-                'invoices': data['invoices'],
+                'password_number': group['password_number'],
+                'issuer_name': '',
+                'invoices': group['invoices'],
                 'source': 'excel',
+                'sheet': group['sheet'],
             }
-            for data in passwords.values()
+            for group in template.parse_file_grouped(file_content, filename)
         ]
 
-    def _extract_tables_from_pdf(self, file_content, filename):
+    def _extract_tables_from_pdf(self, file_content, filename, pdf_document=None):
         """
         Extrae tablas de un PDF usando pdfplumber.
         Retorna lista de contraseñas con sus facturas si encuentra tablas válidas.
+
+        Args:
+            pdf_document: PdfDocument ya abierto (opcional, se crea uno si no se indica)
         """
         if not PDFPLUMBER_AVAILABLE:
             return None
 
+        own_document = pdf_document is None
+        if own_document:
+            pdf_document = PdfDocument(file_content)
+
         try:
-            pdf_buffer = io.BytesIO(file_content)
             password_number = None
             issuer_name = None
             all_invoices = []
 
-            with pdfplumber.open(pdf_buffer) as pdf:
-                for page_num, page in enumerate(pdf.pages):
-                    # Extraer texto de la página para buscar contraseña y emisor
-                    page_text = page.extract_text() or ''
-
-                    # Buscar número de contraseña en el texto
-                    if not password_number:
-                        # Patrones comunes: "No. DIS - 5994", "Contraseña: 055648", "No. 12345"
-                        pwd_patterns = [
-                            r'No\.\s*([A-Z]{2,4}\s*-?\s*\d+)',  # DIS - 5994, CAR-1234
-                            r'Contraseña[:\s]+(\d+)',
-                            r'Nº?\.\s*(\d+)',
-                            r'No\.\s+(\d+)',
-                        ]
-                        for pattern in pwd_patterns:
-                            match = re.search(pattern, page_text, re.IGNORECASE)
-                            if match:
-                                password_number = match.group(1).strip()
-                                break
-
-                    # Buscar nombre del emisor
-                    if not issuer_name:
-                        issuer_patterns = [
-                            r'(DISTELSA|CARTOGUA|La Popular|Carton Box|GRUPO\s+\w+)',
-                            r'Contraseña de pago\s+([A-Z][A-Za-z\s]+)',
-                        ]
-                        for pattern in issuer_patterns:
-                            match = re.search(pattern, page_text, re.IGNORECASE)
-                            if match:
-                                issuer_name = match.group(1).strip()
-                                break
-
-                    # Extraer tablas de la página
-                    tables = page.extract_tables()
-
-                    for table in tables:
-                        if not table or len(table) < 2:
+            for page_num in range(pdf_document.page_count):
+                # Extraer texto de la página para buscar contraseña y emisor
+                page_text = pdf_document.page_text(page_num)
+
+                # Buscar número de contraseña en el texto
+                if not password_number:
+                    # Patrones comunes: "No. DIS - 5994", "Contraseña: 055648", "No. 12345"
+                    pwd_patterns = [
+                        r'No\.\s*([A-Z]{2,4}\s*-?\s*\d+)',  # DIS - 5994, CAR-1234
+                        r'Contraseña[:\s]+(\d+)',
+                        r'Nº?\.\s*(\d+)',
+                        r'No\.\s+(\d+)',
+                    ]
+                    for pattern in pwd_patterns:
+                        match = re.search(pattern, page_text, re.IGNORECASE)
+                        if match:
+                            password_number = match.group(1).strip()
+                            break
+
+                # Buscar nombre del emisor
+                if not issuer_name:
+                    issuer_patterns = [
+                        r'(DISTELSA|CARTOGUA|La Popular|Carton Box|GRUPO\s+\w+)',
+                        r'Contraseña de pago\s+([A-Z][A-Za-z\s]+)',
+                    ]
+                    for pattern in issuer_patterns:
+                        match = re.search(pattern, page_text, re.IGNORECASE)
+                        if match:
+                            issuer_name = match.group(1).strip()
+                            break
+
+                # Extraer tablas de la página
+                tables = pdf_document.page_tables(page_num)
+
+                for table in tables:
+                    if not table or len(table) < 2:
+                        continue
+
+                    # Detectar columnas de factura y monto
+                    header = table[0] if table[0] else []
+                    header_lower = [str(h).lower() if h else '' for h in header]
+
+                    # Buscar índices de columnas
+                    factura_idx = None
+                    monto_idx = None
+
+                    for i, h in enumerate(header_lower):
+                        if 'factura' in h or 'número' in h or 'no.' in h:
+                            factura_idx = i
+                        if 'monto' in h or 'total' in h or 'importe' in h:
+                            monto_idx = i
+
+                    # Si no encontró headers, intentar detectar por posición
+                    # Típicamente: # | Factura | Monto
+                    if factura_idx is None and len(header) >= 2:
+                        # Asumir segunda columna es factura
+                        factura_idx = 1
+                    if monto_idx is None and len(header) >= 3:
+                        # Asumir última columna es monto
+                        monto_idx = len(header) - 1
+
+                    if factura_idx is None:
+                        continue
+
+                    # Procesar filas de datos (saltar header)
+                    for row in table[1:]:
+                        if not row or len(row) <= factura_idx:
                             continue
 
-                        # Detectar columnas de factura y monto
-                        header = table[0] if table[0] else []
-                        header_lower = [str(h).lower() if h else '' for h in header]
-
-                        # Buscar índices de columnas
-                        factura_idx = None
-                        monto_idx = None
-
-                        for i, h in enumerate(header_lower):
-                            if 'factura' in h or 'número' in h or 'no.' in h:
-                                factura_idx = i
-                            if 'monto' in h or 'total' in h or 'importe' in h:
-                                monto_idx = i
-
-                        # Si no encontró headers, intentar detectar por posición
-                        # Típicamente: # | Factura | Monto
-                        if factura_idx is None and len(header) >= 2:
-                            # Asumir segunda columna es factura
-                            factura_idx = 1
-                        if monto_idx is None and len(header) >= 3:
-                            # Asumir última columna es monto
-                            monto_idx = len(header) - 1
-
-                        if factura_idx is None:
+                        invoice_num = str(row[factura_idx] or '').strip()
+                        if not invoice_num or invoice_num.lower() in ['', 'none', 'null', 'factura']:
                             continue
 
-                        # Procesar filas de datos (saltar header)
-                        for row in table[1:]:
-                            if not row or len(row) <= factura_idx:
-                                continue
-
-                            invoice_num = str(row[factura_idx] or '').strip()
-                            if not invoice_num or invoice_num.lower() in ['', 'none', 'null', 'factura']:
-                                continue
-
-                            # Extraer monto si existe
-                            amount = 0.0
-                            if monto_idx is not None and len(row) > monto_idx:
-                                monto_str = str(row[monto_idx] or '').strip()
-                                # Limpiar formato de número: "1,606.58" -> 1606.58
-                                monto_clean = re.sub(r'[^\d.,]', '', monto_str)
-                                monto_clean = monto_clean.replace(',', '')
-                                try:
-                                    amount = float(monto_clean) if monto_clean else 0.0
-                                except ValueError:
-                                    amount = 0.0
-
-                            all_invoices.append({
-                                'invoice_number': invoice_num,
-                                'invoice_series': None,
-                                'amount': amount,
-                                'currency': 'Q',
-                                'date': None,
-                            })
+                        # Extraer monto si existe
+                        amount = 0.0
+                        if monto_idx is not None and len(row) > monto_idx:
+                            monto_str = str(row[monto_idx] or '').strip()
+                            # Limpiar formato de número: "1,606.58" -> 1606.58
+                            monto_clean = re.sub(r'[^\d.,]', '', monto_str)
+                            monto_clean = monto_clean.replace(',', '')
+                            try:
+                                amount = float(monto_clean) if monto_clean else 0.0
+                            except ValueError:
+                                amount = 0.0
+
+                        all_invoices.append({
+                            'invoice_number': invoice_num,
+                            'invoice_series': None,
+                            'amount': amount,
+                            'currency': 'Q',
+                            'date': None,
+                        })
 
             # Si encontramos facturas, retornar resultado
             if all_invoices and password_number:
@@ -415,19 +681,97 @@ class PasswordAssignerWizard(models.TransientModel):
         except Exception as e:
             _logger.warning('Error extracting tables from PDF: %s', str(e))
             return None
+        finally:
+            if own_document:
+                pdf_document.close()
+
+    def _get_cpu_pool_options(self):
+        """Argumentos de PdfDocument para usar el pool de procesos de la configuración"""
+        workers = self.config_id.cpu_workers if self.config_id else 0
+        if not workers or self.env.registry.in_test_mode():
+            return {}
+        executor = cpu_pool.get_executor(workers)
+        return {'cpu_executor': executor, 'cpu_workers': workers} if executor else {}
+
+    def _extract_with_issuer_profile(self, pdf_document, filename, log):
+        """
+        Lee el PDF con el perfil de emisor cuya huella coincide con su encabezado.
 
-    def _process_image_pdf(self, attachment, file_content, filename, mime_type):
+        Returns:
+            list: Resultados como _extract_tables_from_pdf, o None si ningún perfil aplica
+        """
+        try:
+            profiles = self.env['password.assigner.issuer.profile']._get_compiled_profiles()
+            profile = issuer_profiles.find_profile(profiles, pdf_document)
+            if not profile:
+                return None
+            result = issuer_profiles.parse_with_profile(profile, pdf_document)
+        except Exception as e:
+            _logger.warning('Error leyendo %s con perfil de emisor: %s', filename, str(e))
+            return None
+
+        if not result:
+            log.append(f"Perfil de emisor {profile['name']}: sin contraseña o facturas, continuando")
+            return None
+
+        _logger.info('✓ Perfil de emisor %s extrajo %d facturas de %s',
+                     profile['name'], len(result['invoices']), filename)
+        log.append(f"Leído con el perfil de emisor {profile['name']} (sin IA)")
+        return [result]
+
+    def _process_image_pdf(self, attachment, file_content, filename, mime_type, log=None, document_info=None):
         """
         Procesa imagen o PDF con el siguiente orden de prioridad:
         1. pdfplumber (extracción de tablas) - más rápido y gratis
         2. PDF directo a OpenAI - funciona bien con PDFs con texto
         3. Convertir PDF a imágenes - fallback para PDFs escaneados
+
+        Los PDFs se abren una sola vez (PdfDocument) y se comparten entre las etapas.
+        Un PDF que el clasificador local detecta como escaneado va directo al paso 3.
+
+        Args:
+            log: Lista opcional donde se agregan líneas para el log de procesamiento
+            document_info: Dict opcional donde se registra la clasificación (pdf_kind)
         """
+        if log is None:
+            log = []
+        if mime_type != 'application/pdf':
+            return self._process_pdf_document(attachment, file_content, filename, mime_type, None, log)
+
+        with PdfDocument(file_content, **self._get_cpu_pool_options()) as pdf_document:
+            pdf_kind, metrics = pdf_document.classify()
+            if document_info is not None:
+                document_info['pdf_kind'] = pdf_kind
+            if metrics:
+                log.append(
+                    f"Clasificación PDF: {dict(PDF_KINDS)[pdf_kind]} "
+                    f"({metrics['chars_per_page']:.0f} caracteres/página, "
+                    f"{metrics['image_coverage']:.0%} cubierto por imágenes, {metrics['fonts']} fuentes)"
+                )
+            return self._process_pdf_document(
+                attachment, file_content, filename, mime_type, pdf_document, log, pdf_kind=pdf_kind
+            )
+
+    def _process_pdf_document(self, attachment, file_content, filename, mime_type, pdf_document, log,
+                              pdf_kind='unknown'):
+        """Etapas de _process_image_pdf sobre un documento ya analizado"""
+        scanned = pdf_kind == 'scanned'
+
+        # Emisores con perfil conocido se leen directamente, sin IA
+        if mime_type == 'application/pdf' and PDFPLUMBER_AVAILABLE and not scanned:
+            # Texto y tablas de todas las páginas en el pool de procesos (si está habilitado)
+            pdf_document.prefetch_pages()
+            profile_results = self._extract_with_issuer_profile(pdf_document, filename, log)
+            if profile_results:
+                return profile_results
 
         # Para PDFs, intentar primero extracción de tablas (más rápido y preciso)
-        if mime_type == 'application/pdf' and PDFPLUMBER_AVAILABLE:
+        if mime_type == 'application/pdf' and PDFPLUMBER_AVAILABLE and not scanned:
             _logger.info('Paso 1: Intentando extracción de tablas con pdfplumber: %s', filename)
-            table_results = self._extract_tables_from_pdf(file_content, filename)
+            table_results = self._with_extraction_cache(
+                'tables', file_content,
+                lambda: self._extract_tables_from_pdf(file_content, filename, pdf_document=pdf_document),
+            )
             if table_results:
                 _logger.info('✓ pdfplumber extrajo %d contraseñas exitosamente', len(table_results))
                 return table_results
@@ -440,36 +784,59 @@ class PasswordAssignerWizard(models.TransientModel):
                 'Archivo: %s'
             ) % filename)
 
-        # Para PDFs, intentar enviar directo a OpenAI primero
-        if mime_type == 'application/pdf':
-            _logger.info('Paso 2: Enviando PDF directo a OpenAI: %s', filename)
-            try:
-                response_data = self._call_openai_extraction(
-                    file_content, filename, mime_type, use_images=False
-                )
-                # Verificar si extrajo datos útiles
-                if response_data and response_data.get('passwords'):
-                    passwords = response_data.get('passwords', [])
-                    total_invoices = sum(len(p.get('invoices', [])) for p in passwords)
-                    if total_invoices > 0:
-                        _logger.info('✓ PDF directo extrajo %d contraseñas con %d facturas',
-                                   len(passwords), total_invoices)
+        # Para PDFs con capa de texto, enviar primero solo el texto extraído
+        if (mime_type == 'application/pdf' and self.config_id.pdf_text_first
+                and PDFPLUMBER_AVAILABLE and not scanned):
+            if pdf_document.has_text_layer:
+                _logger.info('Paso 2: Enviando texto del PDF a OpenAI: %s', filename)
+                try:
+                    response_data = self._cached_openai_extraction(
+                        file_content, filename, mime_type, use_text=True, pdf_document=pdf_document, log=log
+                    )
+                    if self._is_valid_extraction(response_data):
+                        log.append("Extraído desde la capa de texto del PDF")
                         return self._parse_openai_response(response_data)
-                    _logger.info('PDF directo no extrajo facturas, probando con imágenes...')
-                else:
-                    _logger.info('PDF directo no extrajo datos, probando con imágenes...')
-            except Exception as e:
-                _logger.warning('Error con PDF directo: %s, probando con imágenes...', str(e))
+                    log.append("La capa de texto no dio un resultado válido, se envía el PDF")
+                except Exception as e:
+                    _logger.warning('Error con texto del PDF: %s, enviando PDF directo...', str(e))
+                    log.append(f"Error con la capa de texto ({str(e)}), se envía el PDF")
+            else:
+                log.append("PDF sin capa de texto utilizable")
+
+        # Para PDFs, intentar enviar directo a OpenAI (los escaneados van directo a imágenes)
+        if mime_type == 'application/pdf':
+            if scanned:
+                _logger.info('PDF escaneado, omitiendo paso 2: %s', filename)
+                log.append("PDF escaneado: se envían directamente las imágenes de las páginas")
+            else:
+                _logger.info('Paso 2: Enviando PDF directo a OpenAI: %s', filename)
+                try:
+                    response_data = self._cached_openai_extraction(
+                        file_content, filename, mime_type, use_images=False, pdf_document=pdf_document, log=log
+                    )
+                    # Verificar si extrajo datos útiles
+                    if response_data and response_data.get('passwords'):
+                        passwords = response_data.get('passwords', [])
+                        total_invoices = sum(len(p.get('invoices', [])) for p in passwords)
+                        if total_invoices > 0:
+                            _logger.info('✓ PDF directo extrajo %d contraseñas con %d facturas',
+                                       len(passwords), total_invoices)
+                            return self._parse_openai_response(response_data)
+                        _logger.info('PDF directo no extrajo facturas, probando con imágenes...')
+                    else:
+                        _logger.info('PDF directo no extrajo datos, probando con imágenes...')
+                except Exception as e:
+                    _logger.warning('Error con PDF directo: %s, probando con imágenes...', str(e))
 
             # Fallback: Convertir PDF a imágenes
             _logger.info('Paso 3: Convirtiendo PDF a imágenes: %s', filename)
-            response_data = self._call_openai_extraction(
-                file_content, filename, mime_type, use_images=True
+            response_data = self._cached_openai_extraction(
+                file_content, filename, mime_type, use_images=True, pdf_document=pdf_document, log=log
             )
         else:
             # Para imágenes, enviar directamente
-            response_data = self._call_openai_extraction(
-                file_content, filename, mime_type, use_images=False
+            response_data = self._cached_openai_extraction(
+                file_content, filename, mime_type, use_images=False, log=log
             )
 
         if not response_data:
@@ -477,6 +844,73 @@ class PasswordAssignerWizard(models.TransientModel):
 
         return self._parse_openai_response(response_data)
 
+    def _is_valid_extraction(self, response_data):
+        """
+        Verifica que una respuesta de extracción sea utilizable: al menos una
+        contraseña, y cada contraseña con número y facturas con número.
+        """
+        passwords = (response_data or {}).get('passwords') or []
+        if not passwords:
+            return False
+        for pwd_data in passwords:
+            invoices = pwd_data.get('invoices') or []
+            if not (pwd_data.get('password_number') or '').strip() or not invoices:
+                return False
+            if any(not (inv_data.get('invoice_number') or '').strip() for inv_data in invoices):
+                return False
+        return True
+
+    def _with_extraction_cache(self, stage, file_content, compute, use_model=False, variant=''):
+        """
+        Retorna el resultado de compute() para el archivo, usando la caché de
+        extracción de la configuración si está habilitada.
+
+        Args:
+            stage: Nombre de la etapa de extracción (parte de la clave)
+            use_model: Si True la clave incluye modelo, instrucciones y schema
+            variant: Opciones adicionales que cambian el resultado
+        """
+        config = self.config_id
+        if not config or not config.use_extraction_cache:
+            return compute()
+
+        Cache = self.env['password.assigner.extraction.cache'].sudo()
+        key = Cache._make_key(
+            stage, file_content,
+            config=config if use_model else None,
+            variant=variant if use_model else f'{variant}|config:{config.id}',
+        )
+        found, result = Cache._lookup(key, config)
+        if found:
+            _logger.info('Resultado de %s obtenido de la caché', stage)
+            return result
+
+        result = compute()
+        Cache._store(key, stage, result, config)
+        return result
+
+    def _cached_openai_extraction(self, file_content, filename, mime_type, use_images=False,
+                                  pdf_document=None, log=None, use_text=False):
+        """_call_openai_extraction a través de la caché de extracción"""
+        config = self.config_id
+        variant = f'{mime_type}|images:{use_images}'
+        if use_text:
+            variant += f'|text|words:{config.pdf_text_include_words}'
+        if use_images and config.pdf_chunked_extraction:
+            variant += f'|chunk:{config.pdf_chunk_pages}'
+        image_options = config._get_image_preprocess_options()
+        if image_options and (use_images or mime_type.startswith('image/')):
+            variant += f'|preprocess:{sorted(image_options.items())}'
+        return self._with_extraction_cache(
+            'ai', file_content,
+            lambda: self._call_openai_extraction(
+                file_content, filename, mime_type, use_images=use_images,
+                pdf_document=pdf_document, log=log, use_text=use_text
+            ),
+            use_model=True,
+            variant=variant,
+        )
+
     def _parse_openai_response(self, response_data):
         """Parsea la respuesta de OpenAI y retorna lista de resultados"""
         passwords = response_data.get('passwords', [])
@@ -496,11 +930,8 @@ class PasswordAssignerWizard(models.TransientModel):
 
         return results
 
-    def _convert_pdf_to_images(self, pdf_content):
-        """
-        Convierte un PDF a lista de imágenes base64.
-        Esto es necesario porque la Responses API tiene bugs con PDFs escaneados.
-        """
+    def _check_pdf_rendering(self):
+        """Verifica que estén instaladas las librerías para renderizar PDFs"""
         if not PDF2IMAGE_AVAILABLE:
             raise UserError(_(
                 'La librería pdf2image no está instalada.\n'
@@ -511,29 +942,25 @@ class PasswordAssignerWizard(models.TransientModel):
         if not PIL_AVAILABLE:
             raise UserError(_('La librería Pillow no está instalada. Ejecute: pip install Pillow'))
 
-        try:
-            # Convertir PDF a imágenes (100 DPI para balance velocidad/calidad)
-            images = convert_from_bytes(pdf_content, dpi=100, fmt='jpeg')
-
-            result = []
-            for i, img in enumerate(images):
-                # Redimensionar si es muy grande (max 1500px de ancho)
-                max_width = 1500
-                if img.width > max_width:
-                    ratio = max_width / img.width
-                    new_size = (max_width, int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-                # Convertir imagen a base64 (calidad 75 para reducir tamaño)
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=75)
-                img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                result.append({
-                    'page': i + 1,
-                    'base64': img_b64,
-                    'mime': 'image/jpeg'
-                })
+    def _convert_pdf_to_images(self, pdf_content, pdf_document=None, first_page=1, last_page=None,
+                               image_options=None):
+        """
+        Convierte páginas de un PDF a lista de imágenes base64.
+        Esto es necesario porque la Responses API tiene bugs con PDFs escaneados.
 
+        Args:
+            pdf_document: PdfDocument ya abierto (opcional)
+            first_page, last_page: Rango de páginas a renderizar (desde 1; por defecto todas)
+            image_options: Opciones de preprocesamiento (config._get_image_preprocess_options)
+        """
+        self._check_pdf_rendering()
+
+        try:
+            if pdf_document:
+                result = pdf_document.page_images(first_page, last_page, image_options=image_options)
+            else:
+                with PdfDocument(pdf_content) as own_document:
+                    result = own_document.page_images(first_page, last_page, image_options=image_options)
             _logger.info('PDF converted to %d images', len(result))
             return result
 
@@ -541,7 +968,8 @@ class PasswordAssignerWizard(models.TransientModel):
             _logger.exception('Error converting PDF to images')
             raise UserError(_('Error al convertir PDF a imágenes: %s') % str(e))
 
-    def _call_openai_extraction(self, file_content, filename, mime_type, use_images=False):
+    def _call_openai_extraction(self, file_content, filename, mime_type, use_images=False,
+                                pdf_document=None, log=None, use_text=False):
         """
         Llama a OpenAI API para extraer información del documento.
 
@@ -550,36 +978,62 @@ class PasswordAssignerWizard(models.TransientModel):
             filename: Nombre del archivo
             mime_type: Tipo MIME del archivo
             use_images: Si True, convierte PDF a imágenes. Si False, envía PDF directo.
+            pdf_document: PdfDocument ya abierto (opcional, solo PDFs)
+            use_text: Si True, envía el texto extraído de cada página en lugar del PDF
+            log: Lista opcional donde se agregan líneas para el log de procesamiento
         """
         config = self.config_id
+        image_options = config._get_image_preprocess_options() if PIL_AVAILABLE else None
 
         # Prepare content blocks
         content_blocks = []
         page_count = 1
+        text_context = ''
 
         if mime_type.startswith('image/'):
             # Imagen directa
-            data_b64 = base64.b64encode(file_content).decode('utf-8')
-            content_blocks.append({
-                "type": "input_image",
-                "image_url": f"data:{mime_type};base64,{data_b64}"
-            })
+            content_blocks.append(self._direct_image_content_block(file_content, mime_type, image_options, log))
         elif mime_type == 'application/pdf':
-            if use_images:
+            if pdf_document is None:
+                with PdfDocument(file_content) as pdf_document:
+                    return self._call_openai_extraction(
+                        file_content, filename, mime_type, use_images=use_images,
+                        pdf_document=pdf_document, log=log, use_text=use_text
+                    )
+
+            if use_text:
+                # Enviar la capa de texto (mucho más liviano que el archivo)
+                _logger.info('Enviando texto del PDF a OpenAI (sin archivo)...')
+                content_blocks.extend(
+                    self._pdf_text_content_blocks(pdf_document, config.pdf_text_include_words)
+                )
+                page_count = pdf_document.page_count
+                text_context = """
+
+El documento se envía como el texto extraído de cada página del PDF, conservando la disposición de las columnas."""
+                if log is not None:
+                    text_size = sum(len(block['text']) for block in content_blocks)
+                    log.append(f"Texto enviado: {text_size} caracteres en lugar de {len(file_content) / 1024:.0f} KB de PDF")
+            elif use_images:
                 # Convertir PDF a imágenes (fallback para PDFs escaneados)
                 _logger.info('Convirtiendo PDF a imágenes para mejor OCR...')
-                pdf_images = self._convert_pdf_to_images(file_content)
-
-                # Agregar cada página como imagen (máximo 10 páginas por request)
-                max_pages = min(len(pdf_images), 10)
-                if len(pdf_images) > 10:
-                    _logger.warning('PDF tiene %d páginas, procesando solo las primeras 10', len(pdf_images))
-
-                for img_data in pdf_images[:max_pages]:
-                    content_blocks.append({
-                        "type": "input_image",
-                        "image_url": f"data:{img_data['mime']};base64,{img_data['base64']}"
-                    })
+
+                if config.pdf_chunked_extraction:
+                    # Todas las páginas, en solicitudes paralelas de pocas páginas
+                    return self._call_openai_extraction_chunked(pdf_document, filename, image_options, log)
+
+                # Agregar cada página como imagen (máximo 10 páginas por request);
+                # solo se renderizan las páginas que se envían
+                if pdf_document.page_count > 10:
+                    _logger.warning('PDF tiene %d páginas, procesando solo las primeras 10', pdf_document.page_count)
+                pdf_images = self._convert_pdf_to_images(
+                    file_content, pdf_document, last_page=10, image_options=image_options
+                )
+                if image_options and pdf_images and log is not None:
+                    log.append(image_preprocess.format_preprocess_stats(pdf_images))
+
+                for img_data in pdf_images:
+                    content_blocks.append(self._image_content_block(img_data))
                 page_count = len(content_blocks)
             else:
                 # Enviar PDF directo (más eficiente para PDFs con texto)
@@ -590,15 +1044,7 @@ class PasswordAssignerWizard(models.TransientModel):
                     "filename": filename,
                     "file_data": f"data:application/pdf;base64,{data_b64}"
                 })
-                # Estimar páginas del PDF
-                try:
-                    if PDFPLUMBER_AVAILABLE:
-                        import pdfplumber
-                        pdf_buffer = io.BytesIO(file_content)
-                        with pdfplumber.open(pdf_buffer) as pdf:
-                            page_count = len(pdf.pages)
-                except Exception:
-                    page_count = 1
+                page_count = pdf_document.page_count
 
         # Add text prompt with page context for multi-page
         page_context = ""
@@ -612,13 +1058,69 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
 - Combina todas las facturas bajo UNA sola contraseña (si es el mismo número)
 - NO omitas ninguna fila de la tabla"""
 
-        content_blocks.append({
+        content_blocks.append(self._prompt_content_block(text_context + page_context))
+
+        _logger.info('Calling OpenAI API for file: %s', filename)
+        return self._send_openai_request(self._build_openai_payload(content_blocks))
+
+    def _pdf_text_content_blocks(self, pdf_document, include_words=False):
+        """
+        Bloques input_text con el texto de cada página del PDF.
+
+        Args:
+            include_words: Agrega cada palabra con su posición (texto@x,y en puntos)
+        """
+        blocks = []
+        for index in range(pdf_document.page_count):
+            text = f"--- Página {index + 1} ---\n{pdf_document.page_layout_text(index)}"
+            if include_words:
+                words = ' '.join(f'{word}@{x0},{top}' for x0, top, word in pdf_document.page_words(index))
+                text += f"\n\nPalabras (texto@x,y):\n{words}"
+            blocks.append({"type": "input_text", "text": text})
+        return blocks
+
+    def _image_content_block(self, img_data):
+        """Bloque input_image para una página convertida con _convert_pdf_to_images"""
+        block = {
+            "type": "input_image",
+            "image_url": f"data:{img_data['mime']};base64,{img_data['base64']}"
+        }
+        if img_data.get('detail'):
+            block['detail'] = img_data['detail']
+        return block
+
+    def _direct_image_content_block(self, file_content, mime_type, image_options=None, log=None):
+        """
+        Bloque input_image para una imagen subida directamente. Con image_options la
+        imagen se preprocesa; si no se puede abrir se envía tal como se subió.
+        """
+        if image_options:
+            try:
+                img_data = image_preprocess.preprocess_image_bytes(file_content, **image_options)
+            except Exception as e:
+                _logger.warning('No se pudo preprocesar la imagen, se envía original: %s', str(e))
+            else:
+                if log is not None:
+                    log.append(image_preprocess.format_preprocess_stats([img_data]))
+                return self._image_content_block(img_data)
+
+        data_b64 = base64.b64encode(file_content).decode('utf-8')
+        return {
+            "type": "input_image",
+            "image_url": f"data:{mime_type};base64,{data_b64}"
+        }
+
+    def _prompt_content_block(self, page_context=''):
+        """Bloque input_text con la instrucción de extracción"""
+        return {
             "type": "input_text",
             "text": f"Analiza este documento y extrae la información de contraseñas de pago y TODAS las facturas según las instrucciones.{page_context}"
-        })
+        }
 
-        # Build payload
-        payload = {
+    def _build_openai_payload(self, content_blocks):
+        """Arma el payload de la Responses API para los bloques de contenido dados"""
+        config = self.config_id
+        return {
             "model": config.openai_model,
             "instructions": config.openai_instructions or '',
             "input": [{
@@ -637,99 +1139,283 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
             "max_output_tokens": 16000,
         }
 
-        headers = {
-            'Authorization': f'Bearer {config.openai_api_key}',
-            'Content-Type': 'application/json',
-        }
+    def _get_openai_request_params(self):
+        """
+        Parámetros de conexión de la configuración, con el cupo de solicitudes en
+        curso de la corrida si la extracción se ejecuta en paralelo.
+        """
+        params = self.config_id._get_openai_request_params()
+        request_slots = self.env.context.get('password_assigner_request_slots')
+        if request_slots:
+            params['request_slots'] = request_slots
+        return params
+
+    def _send_openai_request(self, payload):
+        """Envía un payload de extracción y retorna el JSON extraído (o None)"""
+        try:
+            return openai_client.request_extraction(self._get_openai_request_params(), payload)
+        except openai_client.OpenAIError as e:
+            raise self._openai_user_error(e)
+
+    def _openai_user_error(self, error):
+        """Convierte un error del cliente de OpenAI en UserError"""
+        if isinstance(error, openai_client.OpenAITimeoutError):
+            return UserError(_('Timeout: No se pudo conectar con OpenAI'))
+        if isinstance(error, openai_client.OpenAIConnectionError):
+            return UserError(_('Error de conexión: %s') % str(error))
+        if isinstance(error, openai_client.OpenAIParseError):
+            return UserError(_('Error al parsear respuesta de OpenAI'))
+        if isinstance(error, openai_client.OpenAIRateLimitError):
+            return UserError(_('Límite de tasa de OpenAI: %s') % str(error))
+        return UserError(_('Error de OpenAI: %s') % str(error))
+
+    def _call_openai_extraction_chunked(self, pdf_document, filename, image_options=None, log=None):
+        """
+        Envía las páginas de un PDF en bloques de config.pdf_chunk_pages páginas,
+        en paralelo, y combina las respuestas en una sola.
 
-        _logger.info('Calling OpenAI API for file: %s', filename)
+        Cada parte renderiza sus propias páginas justo antes de enviarlas, así que
+        en memoria solo están las imágenes de las partes en curso.
 
-        try:
-            response = requests.post(
-                config.openai_api_url,
-                headers=headers,
-                data=json.dumps(payload),
-                timeout=config.timeout
-            )
+        Args:
+            pdf_document: PdfDocument del PDF a extraer
+            image_options: Opciones de preprocesamiento de las páginas
+            log: Lista opcional donde se agregan líneas para el log de procesamiento
+        """
+        config = self.config_id
+        self._check_pdf_rendering()
+        chunk_size = max(config.pdf_chunk_pages, 1)
+        page_count = pdf_document.page_count
+        chunks = [
+            (first_page, min(first_page + chunk_size - 1, page_count))
+            for first_page in range(1, page_count + 1, chunk_size)
+        ]
 
-            if response.status_code != 200:
-                error_msg = response.json().get('error', {}).get('message', response.text)
-                _logger.error('OpenAI API error: %s', error_msg)
-                raise UserError(_('Error de OpenAI: %s') % error_msg)
+        prompts = []
+        for first_page, last_page in chunks:
+            page_context = ''
+            if len(chunks) > 1:
+                page_context = f"""
+
+IMPORTANTE - DOCUMENTO DIVIDIDO EN PARTES:
+- Estas imágenes son las páginas {first_page} a {last_page} de un documento de {page_count} páginas
+- En page_numbers usa la posición de la imagen en esta solicitud (1 = primera imagen)
+- Si la contraseña no aparece en estas páginas porque continúa de páginas anteriores, deja password_number vacío y usa document_type "continuation"
+- Debes extraer TODAS las facturas de estas páginas
+- NO omitas ninguna fila de la tabla"""
+            elif page_count > 1:
+                page_context = f"""
 
-            resp_json = response.json()
+IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
+- Este documento tiene {page_count} páginas
+- Debes extraer TODAS las facturas de TODAS las páginas
+- La tabla de facturas continúa en las páginas siguientes
+- Combina todas las facturas bajo UNA sola contraseña (si es el mismo número)
+- NO omitas ninguna fila de la tabla"""
+            prompts.append(self._prompt_content_block(page_context))
 
-            # Extract content from response
-            content_txt = resp_json.get('output_text')
-            if not content_txt:
-                for blk in resp_json.get('output', []):
-                    for p in blk.get('content', []):
-                        if p.get('type') in ('output_text', 'text') and p.get('text'):
-                            content_txt = p['text']
-                            break
-                    if content_txt:
-                        break
+        _logger.info('Calling OpenAI API for file: %s (%d páginas en %d partes)',
+                     filename, page_count, len(chunks))
 
-            if content_txt:
-                return json.loads(content_txt)
+        # Las partes solo renderizan y hacen HTTP: no necesitan cursor
+        params = self._get_openai_request_params()
+        base_payload = self._build_openai_payload([])
+        page_stats = []
 
-            _logger.warning('No content extracted from OpenAI response')
-            return None
+        def request_chunk(chunk, prompt):
+            first_page, last_page = chunk
+            try:
+                content_blocks = []
+                for img_data in pdf_document.iter_page_images(first_page, last_page, image_options=image_options):
+                    content_blocks.append(self._image_content_block(img_data))
+                    if image_options:
+                        page_stats.append({key: value for key, value in img_data.items() if key != 'base64'})
+            except Exception as e:
+                _logger.exception('Error converting PDF pages %d-%d to images', first_page, last_page)
+                return None, e
+            content_blocks.append(prompt)
+            payload = dict(base_payload, input=[{"role": "user", "content": content_blocks}])
+            try:
+                return openai_client.request_extraction(params, payload), None
+            except openai_client.OpenAIError as e:
+                return None, e
+
+        pool_size = min(config.max_parallel_documents or 1, len(chunks))
+        if pool_size == 1:
+            outcomes = [request_chunk(chunk, prompt) for chunk, prompt in zip(chunks, prompts)]
+        else:
+            with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='password_assigner_chunk') as executor:
+                outcomes = list(executor.map(request_chunk, chunks, prompts))
+
+        chunk_responses = []
+        for (first_page, last_page), (response_data, error) in zip(chunks, outcomes):
+            if isinstance(error, openai_client.OpenAIError):
+                _logger.error('Error en páginas %d-%d de %s: %s',
+                              first_page, last_page, filename, str(error))
+                raise self._openai_user_error(error)
+            if error:
+                raise UserError(_('Error al convertir PDF a imágenes: %s') % str(error))
+            chunk_responses.append((first_page, response_data))
+
+        if page_stats and log is not None:
+            log.append(image_preprocess.format_preprocess_stats(page_stats))
+
+        if len(chunk_responses) == 1:
+            return chunk_responses[0][1]
+        return self._merge_chunk_responses(chunk_responses)
+
+    def _merge_chunk_responses(self, chunk_responses):
+        """
+        Combina las respuestas de las partes de un PDF.
+
+        Las contraseñas se agrupan por password_number (sin espacios, tal como se
+        extrajo); una parte sin número de contraseña (continuación) se agrega a la
+        última contraseña de las páginas anteriores o, si es la primera, a la
+        siguiente contraseña con número. Los números de página se convierten a
+        páginas del documento. Las partes no se solapan, así que las facturas
+        repetidas en partes distintas son filas distintas y se conservan.
 
-        except requests.exceptions.Timeout:
-            raise UserError(_('Timeout: No se pudo conectar con OpenAI'))
-        except requests.exceptions.RequestException as e:
-            raise UserError(_('Error de conexión: %s') % str(e))
-        except json.JSONDecodeError as e:
-            _logger.error('Error parsing OpenAI response: %s', str(e))
-            raise UserError(_('Error al parsear respuesta de OpenAI'))
+        Args:
+            chunk_responses: Lista de tuplas (primera página de la parte, respuesta)
+        """
+        merged = {}
+        confidences = []
+        last_key = None
+        # Continuaciones sin contraseña anterior: (páginas, datos de la contraseña)
+        orphans = []
+
+        def add_password(target, pages, pwd_data):
+            for field in ('password_number', 'issuer_name', 'document_date', 'payment_date'):
+                if not target[field] and pwd_data.get(field):
+                    target[field] = pwd_data[field]
+            target['page_numbers'] = sorted(set(target['page_numbers']) | set(pages))
+            target['invoices'].extend(pwd_data.get('invoices', []))
+
+        def new_password(password_number):
+            return {
+                'password_number': password_number,
+                'issuer_name': None,
+                'document_date': None,
+                'payment_date': None,
+                'page_numbers': [],
+                'invoices': [],
+            }
+
+        for first_page, response_data in chunk_responses:
+            if not response_data:
+                continue
+            confidences.append(response_data.get('confidence', 0))
+
+            for pwd_data in response_data.get('passwords', []):
+                password_number = (pwd_data.get('password_number') or '').strip()
+                pages = sorted({
+                    first_page + page - 1
+                    for page in (pwd_data.get('page_numbers') or [])
+                    if page and page > 0
+                })
+                key = password_number or last_key
+                if key is None:
+                    orphans.append((pages, pwd_data))
+                    continue
+
+                target = merged.get(key)
+                if target is None:
+                    target = merged[key] = new_password(password_number)
+                for orphan_pages, orphan_data in orphans:
+                    add_password(target, orphan_pages, orphan_data)
+                orphans = []
+                add_password(target, pages, pwd_data)
+                last_key = key
+
+        if orphans:
+            # Ninguna parte trae número de contraseña: se conserva como una sola
+            # contraseña sin número, igual que la respuesta de un PDF sin partes
+            _logger.warning('No password number found in any chunk; %d entries kept without password', len(orphans))
+            target = merged[''] = new_password('')
+            for orphan_pages, orphan_data in orphans:
+                add_password(target, orphan_pages, orphan_data)
+
+        passwords = list(merged.values())
+        return {
+            'passwords': passwords,
+            'document_type': 'multiple_passwords' if len(passwords) > 1 else 'single_password',
+            'confidence': min(confidences) if confidences else 0,
+        }
 
     def _create_preview_line(self, result, source_document):
-        """Crea una línea de preview basada en los resultados extraídos"""
-        password_number = result.get('password_number', '')
-        if not password_number:
-            return
+        """Crea las líneas de preview de un resultado extraído"""
+        self._create_preview_lines([(result, source_document)])
 
-        invoices = result.get('invoices', [])
-        page_numbers = result.get('page_numbers', [])
+    def _create_preview_lines(self, pending_results):
+        """
+        Crea las líneas de preview para una lista de resultados extraídos.
+        El match de facturas se hace por lotes de MATCH_BATCH_SIZE facturas y todas
+        las líneas se crean con un solo create, que inserta las filas de la relación
+        con las facturas y recalcula los campos en bloque.
 
-        for inv_data in invoices:
-            invoice_number = inv_data.get('invoice_number', '')
-            invoice_series = inv_data.get('invoice_series', '')
-            amount = inv_data.get('amount', 0)
+        Args:
+            pending_results: Lista de tuplas (result, source_document)
 
-            if not invoice_number:
+        Returns:
+            password.assigner.wizard.line: Las líneas creadas
+        """
+        entries = []
+        for result, source_document in pending_results:
+            if not result.get('password_number', ''):
                 continue
-
-            # Search for matching invoices
-            matched_invoices, match_status, confidence = self._match_invoices(
-                invoice_number, invoice_series, amount
+            for inv_data in result.get('invoices', []):
+                if not inv_data.get('invoice_number', ''):
+                    continue
+                entries.append((result, source_document, inv_data))
+
+        vals_list = []
+        for start in range(0, len(entries), MATCH_BATCH_SIZE):
+            batch = entries[start:start + MATCH_BATCH_SIZE]
+            matches = self._match_invoices_batch([
+                (inv_data.get('invoice_number', ''), inv_data.get('invoice_series', ''), inv_data.get('amount', 0))
+                for _result, _source, inv_data in batch
+            ])
+
+            vals_list.extend(
+                self._prepare_preview_line_vals(result, source_document, inv_data, *match)
+                for (result, source_document, inv_data), match in zip(batch, matches)
             )
 
-            # Build notes
-            notes = []
-            if result.get('source') == 'ai':
-                notes.append(f"Confianza IA: {result.get('confidence', 0):.0f}%")
-            if match_status == 'multiple':
-                notes.append(f"Múltiples coincidencias encontradas ({len(matched_invoices)})")
-            elif match_status == 'not_found':
-                notes.append("No se encontró factura coincidente")
-
-            self.env['password.assigner.wizard.line'].create({
-                'wizard_id': self.id,
-                'password': password_number,
-                'issuer_name': result.get('issuer_name', ''),
-                'source_document': source_document,
-                'source_page': page_numbers[0] if page_numbers else 0,
-                'invoice_number_extracted': invoice_number,
-                'invoice_series_extracted': invoice_series,
-                'amount_extracted': amount or 0,
-                'invoice_ids': [(6, 0, matched_invoices.ids)] if matched_invoices else [],
-                'match_confidence': confidence,
-                'match_status': match_status,
-                'apply': match_status in ('matched', 'partial') and bool(matched_invoices),
-                'notes': '\n'.join(notes) if notes else '',
-            })
+        return self.env['password.assigner.wizard.line'].create(vals_list)
+
+    def _prepare_preview_line_vals(self, result, source_document, inv_data,
+                                   matched_invoices, match_status, confidence):
+        """Valores de una línea de preview para una factura extraída"""
+        page_numbers = result.get('page_numbers', [])
+        amount = inv_data.get('amount', 0)
+        if result.get('sheet'):
+            # Libros de varias hojas: la hoja de origen forma parte del documento
+            source_document = f"{source_document} / {result['sheet']}"
+
+        # Build notes
+        notes = []
+        if result.get('source') == 'ai':
+            notes.append(f"Confianza IA: {result.get('confidence', 0):.0f}%")
+        if match_status == 'multiple':
+            notes.append(f"Múltiples coincidencias encontradas ({len(matched_invoices)})")
+        elif match_status == 'not_found':
+            notes.append("No se encontró factura coincidente")
+
+        return {
+            'wizard_id': self.id,
+            'password': result.get('password_number', ''),
+            'issuer_name': result.get('issuer_name', ''),
+            'source_document': source_document,
+            'source_page': page_numbers[0] if page_numbers else 0,
+            'invoice_number_extracted': inv_data.get('invoice_number', ''),
+            'invoice_series_extracted': inv_data.get('invoice_series', ''),
+            'amount_extracted': amount or 0,
+            'invoice_ids': [(6, 0, matched_invoices.ids)] if matched_invoices else [],
+            'match_confidence': confidence,
+            'match_status': match_status,
+            'apply': match_status in ('matched', 'partial') and bool(matched_invoices),
+            'notes': '\n'.join(notes) if notes else '',
+        }
 
     def _match_invoices(self, invoice_number, invoice_series, amount):
         """
@@ -740,70 +1426,288 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
         Returns:
             tuple: (matched_invoices recordset, match_status, confidence)
         """
+        return self._match_invoices_batch([(invoice_number, invoice_series, amount)])[0]
+
+    def _match_invoices_batch(self, entries):
+        """
+        Busca facturas para varias entradas a la vez con un número fijo de consultas,
+        sin importar cuántas facturas se hayan extraído.
+
+        Args:
+            entries: Lista de tuplas (invoice_number, invoice_series, amount)
+
+        Returns:
+            list: Una tupla (matched_invoices, match_status, confidence) por entrada
+        """
         AccountMove = self.env['account.move']
-        AccountMoveLine = self.env['account.move.line']
-
-        base_domain = [
-            ('move_type', 'in', ['out_invoice', 'out_refund']),
-            ('state', '=', 'posted'),
-            ('company_id', '=', self.company_id.id),
-            # Solo facturas sin contraseña asignada
-            '|',
-            ('document_password', '=', False),
-            ('document_password', '=', ''),
-        ]
 
-        # Clean invoice number for search
-        clean_number = invoice_number.strip()
+        # Clean invoice numbers; repeated numbers are searched only once
+        clean_numbers = [(number or '').strip() for number, _series, _amount in entries]
+        terms = list(dict.fromkeys(clean_numbers))
+
+        # 1. Search in invoice fields (invoice_number, name, ref), plus the invoices
+        # whose normalized key is equal (indexed); the status is decided on the
+        # whole candidate set, as for any other search hit
+        move_hits = self._search_invoice_candidates(terms)
+        for term, move_ids in self._search_invoice_keys(terms).items():
+            candidates = move_hits.get(term, [])
+            move_hits[term] = (candidates + [move_id for move_id in move_ids if move_id not in candidates])[:10]
+
+        # 2. Search in invoice line descriptions (e.g., "POLTT2483374605") only for misses
+        line_hits = self._search_invoice_line_candidates(
+            [term for term in terms if not move_hits.get(term)]
+        )
 
-        # 1. Try exact match in invoice fields first
-        exact_domain = base_domain + [
-            '|', '|', '|',
-            ('invoice_number', '=', clean_number),
-            ('invoice_number', 'ilike', clean_number),
-            ('name', 'ilike', clean_number),
-            ('ref', 'ilike', clean_number),
-        ]
+        # Prefetch the fields used to narrow down multiple matches in one query
+        all_ids = {move_id for ids in move_hits.values() for move_id in ids}
+        all_ids.update(move_id for ids in line_hits.values() for move_id in ids)
+        AccountMove.browse(list(all_ids)).fetch(['amount_total', 'invoice_series'])
 
-        matched = AccountMove.search(exact_domain, limit=10)
+        results = []
+        for clean_number, (_number, invoice_series, amount) in zip(clean_numbers, entries):
+            results.append(self._resolve_invoice_match(
+                AccountMove.browse(move_hits.get(clean_number, [])),
+                AccountMove.browse(line_hits.get(clean_number, [])),
+                invoice_series,
+                amount,
+            ))
+        return results
+
+    def _search_invoice_keys(self, terms):
+        """
+        Busca facturas sin contraseña cuya clave normalizada sea igual a la de cada término.
+        Para números solo de dígitos también compara con la cola numérica de la factura
+        (ej: 23243 -> TK00023243).
 
+        Returns:
+            dict: {término: [move ids]} con máximo 10 facturas por término,
+                  en el mismo orden que account.move.search
+        """
+        keys = {}
+        for term in terms:
+            key = normalize_invoice_key(term)
+            if key:
+                keys[term] = key
+        if not keys:
+            return {}
+
+        self.env['account.move'].flush_model([
+            'move_type', 'state', 'company_id', 'document_password',
+            'password_match_key', 'password_match_tail', 'date', 'name',
+        ])
+        self.env.cr.execute("""
+            SELECT term, move_id
+              FROM (
+                    SELECT q.term, m.id AS move_id,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY q.term
+                               ORDER BY m.date DESC, m.name DESC, m.id DESC
+                           ) AS rnk
+                      FROM unnest(%s::text[], %s::text[], %s::bool[]) AS q(term, key, use_tail)
+                      JOIN account_move m
+                        ON m.password_match_key = q.key
+                        OR (q.use_tail AND m.password_match_tail = q.key)
+                     WHERE m.move_type IN ('out_invoice', 'out_refund')
+                       AND m.state = 'posted'
+                       AND m.company_id = %s
+                       AND COALESCE(m.document_password, '') = ''
+                   ) AS ranked
+             WHERE rnk <= 10
+          ORDER BY term, rnk
+        """, [
+            list(keys),
+            list(keys.values()),
+            [is_numeric_key(term) and len(key) >= MIN_NUMERIC_TAIL_LENGTH for term, key in keys.items()],
+            self.company_id.id,
+        ])
+        hits = {}
+        for term, move_id in self.env.cr.fetchall():
+            hits.setdefault(term, []).append(move_id)
+        return hits
+
+    def _search_invoice_candidates(self, terms):
+        """
+        Busca facturas sin contraseña cuyo invoice_number, name o ref contenga cada término.
+
+        Returns:
+            dict: {término: [move ids]} con máximo 10 facturas por término,
+                  en el mismo orden que account.move.search
+        """
+        if not terms:
+            return {}
+
+        index = self._get_invoice_candidate_index()
+        hits = {}
+        for term in terms:
+            move_ids = index.contains(term, limit=10)
+            if move_ids:
+                hits[term] = move_ids
+        return hits
+
+    def _get_invoice_candidate_index(self):
+        """
+        Índice en memoria de las facturas candidatas de la compañía.
+
+        Se comparte entre corridas del mismo worker y se reconstruye cuando cambia
+        el conjunto de candidatas (cantidad o última modificación).
+        """
+        self.env['account.move'].flush_model([
+            'move_type', 'state', 'company_id', 'document_password',
+            'invoice_number', 'name', 'ref', 'date',
+        ])
+        signature = worker_cache.table_signature(self.env.cr, 'account_move', """
+            move_type IN ('out_invoice', 'out_refund')
+               AND state = 'posted'
+               AND company_id = %s
+               AND COALESCE(document_password, '') = ''
+        """, [self.company_id.id])
+
+        def load_index():
+            self.env.cr.execute("""
+                SELECT id, invoice_number, name, ref
+                  FROM account_move
+                 WHERE move_type IN ('out_invoice', 'out_refund')
+                   AND state = 'posted'
+                   AND company_id = %s
+                   AND COALESCE(document_password, '') = ''
+              ORDER BY date DESC, name DESC, id DESC
+            """, [self.company_id.id])
+            index = InvoiceCandidateIndex(self.env.cr.fetchall())
+            _logger.info('Invoice candidate index built for company %s: %d invoices',
+                         self.company_id.id, len(index))
+            return index
+
+        return worker_cache.get_cached('invoice_candidates', (self.env.cr.dbname, self.company_id.id), signature, load_index)
+
+    def _search_invoice_line_candidates(self, terms):
+        """
+        Busca en la descripción de las líneas de factura cada término, usando la
+        tabla de tokens (password.assigner.line.token).
+
+        Returns:
+            dict: {término: [move ids]} con máximo 20 facturas por término
+        """
+        keys = {}
+        for term in terms:
+            key = normalize_invoice_key(term)
+            if len(key) >= MIN_TOKEN_LENGTH:
+                keys[term] = key
+
+        hits = {}
+        if keys:
+            self.env['account.move'].flush_model([
+                'move_type', 'state', 'company_id', 'document_password', 'date', 'name',
+            ])
+            self.env['password.assigner.line.token'].flush_model()
+            self.env.cr.execute("""
+                SELECT term, move_id
+                  FROM (
+                        SELECT q.term, m.id AS move_id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY q.term
+                                   ORDER BY m.date DESC, m.name DESC, m.id DESC
+                               ) AS rnk
+                          FROM unnest(%s::text[], %s::text[]) AS q(term, key)
+                          JOIN password_assigner_line_token t
+                            ON t.token = q.key
+                           AND t.company_id = %s
+                          JOIN account_move m ON m.id = t.move_id
+                         WHERE m.move_type IN ('out_invoice', 'out_refund')
+                           AND m.state = 'posted'
+                           AND COALESCE(m.document_password, '') = ''
+                       ) AS ranked
+                 WHERE rnk <= 20
+              ORDER BY term, rnk
+            """, [list(keys), list(keys.values()), self.company_id.id])
+            for term, move_id in self.env.cr.fetchall():
+                hits.setdefault(term, []).append(move_id)
+
+        missing = [term for term in terms if term not in hits]
+        if self.env['password.assigner.line.token']._is_backfill_done():
+            # La tabla de tokens no representa claves cortas ni subcadenas dentro de
+            # un token: buscar esos términos con ilike, con un máximo por corrida
+            missing = [term for term in missing if len(term.strip()) >= LINE_ILIKE_MIN_LENGTH]
+            if len(missing) > LINE_ILIKE_MAX_TERMS:
+                _logger.info('Line description ilike fallback limited to %d of %d terms',
+                             LINE_ILIKE_MAX_TERMS, len(missing))
+                missing = missing[:LINE_ILIKE_MAX_TERMS]
+        # Mientras no termine de indexar las facturas antiguas, buscar todo el resto con ilike
+        hits.update(self._search_invoice_line_names(missing))
+        return hits
+
+    def _search_invoice_line_names(self, terms):
+        """
+        Busca con ilike en la descripción de las líneas de factura cada término.
+
+        Returns:
+            dict: {término: [move ids]} a partir de máximo 20 líneas por término
+        """
+        if not terms:
+            return {}
+
+        self.env['account.move'].flush_model([
+            'move_type', 'state', 'company_id', 'document_password',
+        ])
+        self.env['account.move.line'].flush_model(['name', 'move_id', 'date', 'move_name'])
+        self.env.cr.execute("""
+            SELECT term, move_id
+              FROM (
+                    SELECT q.term, l.move_id,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY q.term
+                               ORDER BY l.date DESC, l.move_name DESC, l.id
+                           ) AS rnk
+                      FROM unnest(%s::text[]) AS q(term)
+                      JOIN account_move_line l ON l.name ILIKE '%%' || q.term || '%%'
+                      JOIN account_move m ON m.id = l.move_id
+                     WHERE m.move_type IN ('out_invoice', 'out_refund')
+                       AND m.state = 'posted'
+                       AND m.company_id = %s
+                       AND COALESCE(m.document_password, '') = ''
+                   ) AS ranked
+             WHERE rnk <= 20
+          ORDER BY term, rnk
+        """, [terms, self.company_id.id])
+
+        hits = {}
+        for term, move_id in self.env.cr.fetchall():
+            move_ids = hits.setdefault(term, [])
+            if move_id not in move_ids:
+                move_ids.append(move_id)
+        return hits
+
+    def _resolve_invoice_match(self, matched, line_matched, invoice_series, amount):
+        """
+        Decide el estado del match a partir de los candidatos encontrados.
+
+        Args:
+            matched: Facturas encontradas por invoice_number, name, ref o clave normalizada
+            line_matched: Facturas encontradas por descripción de línea (solo si matched está vacío)
+
+        Returns:
+            tuple: (matched_invoices recordset, match_status, confidence)
+        """
         if len(matched) == 1:
             return matched, 'matched', 100.0
 
-        # 2. If no match, search in invoice line descriptions (e.g., "POLTT2483374605")
-        if not matched:
-            # Search in invoice lines
-            line_domain = [
-                ('move_id.move_type', 'in', ['out_invoice', 'out_refund']),
-                ('move_id.state', '=', 'posted'),
-                ('move_id.company_id', '=', self.company_id.id),
-                '|',
-                ('move_id.document_password', '=', False),
-                ('move_id.document_password', '=', ''),
-                '|',
-                ('name', 'ilike', clean_number),
-                ('name', 'ilike', f'%{clean_number}%'),
-            ]
-
-            lines = AccountMoveLine.search(line_domain, limit=20)
-            if lines:
-                matched = lines.mapped('move_id')
-                if len(matched) == 1:
-                    return matched, 'matched', 95.0
-                if matched:
-                    # Filter by amount if available
-                    if amount:
-                        amount_matched = matched.filtered(
-                            lambda m: abs(m.amount_total - amount) < 1.0
-                        )
-                        if len(amount_matched) == 1:
-                            return amount_matched, 'matched', 90.0
-                        if amount_matched:
-                            matched = amount_matched
-
-                    if len(matched) == 1:
-                        return matched, 'matched', 85.0
-                    return matched, 'multiple', 70.0
+        # Match by invoice line description
+        if not matched and line_matched:
+            matched = line_matched
+            if len(matched) == 1:
+                return matched, 'matched', 95.0
+            # Filter by amount if available
+            if amount:
+                amount_matched = matched.filtered(
+                    lambda m: abs(m.amount_total - amount) < 1.0
+                )
+                if len(amount_matched) == 1:
+                    return amount_matched, 'matched', 90.0
+                if amount_matched:
+                    matched = amount_matched
+
+            if len(matched) == 1:
+                return matched, 'matched', 85.0
+            return matched, 'multiple', 70.0
 
         if len(matched) > 1:
             # Try to narrow down with series
@@ -828,35 +1732,9 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
 
             return matched, 'multiple', 70.0
 
-        # Try partial match - number contains extracted value
-        partial_domain = base_domain + [
-            '|', '|',
-            ('invoice_number', 'ilike', f'%{clean_number}%'),
-            ('name', 'ilike', f'%{clean_number}%'),
-            ('ref', 'ilike', f'%{clean_number}%'),
-        ]
-
-        partial_matched = AccountMove.search(partial_domain, limit=10)
-
-        if len(partial_matched) == 1:
-            return partial_matched, 'partial', 80.0
-
-        if partial_matched:
-            # Filter by series if available
-            if invoice_series:
-                series_matched = partial_matched.filtered(
-                    lambda m: m.invoice_series and invoice_series in m.invoice_series
-                )
-                if series_matched:
-                    partial_matched = series_matched
-
-            if len(partial_matched) == 1:
-                return partial_matched, 'partial', 75.0
-
-            return partial_matched, 'multiple', 60.0
-
-        # No match found
-        return AccountMove, 'not_found', 0.0
+        # ilike ya busca '%número%', así que una búsqueda parcial adicional
+        # no puede encontrar facturas que el paso 1 no haya encontrado.
+        return self.env['account.move'], 'not_found', 0.0
 
     def action_apply_passwords(self):
         """Aplica las contraseñas a las facturas seleccionadas"""
@@ -876,6 +1754,9 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
                 invoice_count += 1
             applied_count += 1
 
+        # Las facturas con contraseña ya no son candidatas
+        worker_cache.invalidate('invoice_candidates', (self.env.cr.dbname, self.company_id.id))
+
         self.state = 'done'
         self.processing_log = (self.processing_log or '') + f'\n\n✓ Aplicadas {applied_count} contraseñas a {invoice_count} facturas.'
 
@@ -892,6 +1773,7 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
         self.ensure_one()
         self.state = 'upload'
         self.line_ids.unlink()
+        self.job_ids = [(5, 0, 0)]
         return {
             'type': 'ir.actions.act_window',
             'res_model': self._name,
@@ -900,10 +1782,88 @@ IMPORTANTE - DOCUMENTO MULTI-PÁGINA:
             'target': 'new',
         }
 
+    def action_create_issuer_profiles(self):
+        """
+        Crea perfiles de emisor a partir de los PDFs del preview ya revisados, para
+        que sus próximos documentos se lean sin IA. Por cada PDF se usa la contraseña
+        con más líneas marcadas para aplicar.
+        """
+        self.ensure_one()
+        if not PDFPLUMBER_AVAILABLE:
+            raise UserError(_('La librería pdfplumber no está instalada. Ejecute: pip install pdfplumber'))
+
+        Profile = self.env['password.assigner.issuer.profile']
+        profiles = Profile._get_compiled_profiles()
+        created = Profile
+        skipped = []
+
+        for attachment in self.document_ids:
+            filename = attachment.name or ''
+            mime_type = attachment.mimetype or self._guess_mimetype(filename)
+            lines = self.line_ids.filtered(lambda l: l.apply and l.source_document == filename)
+            if mime_type != 'application/pdf' or not lines:
+                continue
+
+            passwords = {}
+            for line in lines:
+                passwords.setdefault(line.password, self.env['password.assigner.wizard.line'])
+                passwords[line.password] |= line
+            password, password_lines = max(passwords.items(), key=lambda item: len(item[1]))
+
+            with PdfDocument(base64.b64decode(attachment.datas)) as pdf_document:
+                if issuer_profiles.find_profile(profiles, pdf_document):
+                    skipped.append(_('%s (ya tiene perfil)') % filename)
+                    continue
+                vals = issuer_profiles.build_profile_values(
+                    pdf_document,
+                    password,
+                    [(line.invoice_number_extracted, line.amount_extracted) for line in password_lines],
+                    issuer_name=password_lines[0].issuer_name,
+                )
+            if not vals:
+                skipped.append(_('%s (no se encontró la tabla de facturas)') % filename)
+                continue
+            created |= Profile.create(dict(vals, source_document=filename))
+
+        if not created:
+            raise UserError(_('No se pudo crear ningún perfil de emisor.\n%s') % '\n'.join(skipped))
+
+        message = _('Perfiles creados: %s.') % ', '.join(created.mapped('name'))
+        if skipped:
+            message += ' ' + _('Omitidos: %s.') % ', '.join(skipped)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Perfiles de Emisor'),
+                'message': message,
+                'type': 'success',
+                'sticky': False,
+            }
+        }
+
     def action_close(self):
         """Cierra el wizard"""
         return {'type': 'ir.actions.act_window_close'}
 
+    def action_open_lines_by_password(self):
+        """
+        Abre las líneas del preview agrupadas por contraseña. La lista agrupada se
+        pagina en el servidor: solo se leen las líneas de los grupos abiertos.
+        """
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Líneas por Contraseña'),
+            'res_model': 'password.assigner.wizard.line',
+            'view_mode': 'list',
+            'views': [(self.env.ref('adroc_password_assigner.view_password_assigner_wizard_line_list').id, 'list')],
+            'search_view_id': self.env.ref('adroc_password_assigner.view_password_assigner_wizard_line_search').id,
+            'domain': [('wizard_id', '=', self.id)],
+            'context': {'group_by': ['password'], 'create': False},
+            'target': 'new',
+        }
+
     def action_select_all(self):
         """Selecciona todas las líneas con facturas"""
         self.line_ids.filtered(lambda l: l.invoice_ids).write({'apply': True})